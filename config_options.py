@@ -13,7 +13,27 @@ class ConfigVars(StrEnum):
     SIM_WORKER_NAME = auto()
     SIM_WORKER_UUID = auto()
     SIM_3D_SIM_LOCATION = auto()
+    SIM_3D_HOST = auto()
+    SIM_3D_PORT = auto()
     SIM_HITL_SIM_LOCATION = auto()
+    SIM_WSS_WIRE_FORMAT = auto()
+    SIM_WSS_OUTBOX_SIZE = auto()
+    SIM_WSS_OUTBOX_PATH = auto()
+    SIM_WSS_COMPRESSION_WINDOW_BITS = auto()
+    SIM_WSS_COMPRESSION_LEVEL = auto()
+    SIM_WSS_COMPRESSION_THRESHOLD = auto()
+    SIM_LOG_QUEUE_SIZE = auto()
+    SIM_LOG_OVERFLOW_POLICY = auto()
+    SIM_LOG_SPILL_DIR = auto()
+    SIM_STOP_GRACE_PERIOD = auto()
+    SIM_STOP_DEADLINE = auto()
+    SIM_START_TIMEOUT = auto()
+    SIM_HITL_READY_PATTERN = auto()
+    SIM_WARM_STANDBY = auto()
+    SIM_WARM_RECYCLE_SESSIONS = auto()
+    SIM_WARM_RECYCLE_MEMORY_GROWTH = auto()
+    SIM_SLOTS = auto()
+    SIM_SLOT_CORES = auto()
 
 
 class Commands(StrEnum):
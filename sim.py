@@ -1,18 +1,28 @@
 from __future__ import annotations
 
 import asyncio
+import os
 import sys
 from argparse import ArgumentParser
+from typing import Optional, Dict, Any
 
 from decouple import AutoConfig
 
 from config_options import Commands, ConfigVars
-from src.api.core import Command
-from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.compression import (
+    Compression, COMPRESSION_WINDOW_BITS, COMPRESSION_LEVEL, COMPRESSION_THRESHOLD)
+from src.api.websocket_connection.websocket_client import Client, CLIENT_OUTBOX_SIZE
+from src.api.websocket_connection.wire_format import WireFormat
 
 from src.communicators.cli_communicator import CliCommunicator
 from src.communicators.wss_communicator import WssCommunicator
-from src.core.sim_core import SimCore
+from src.core.log_forwarding import OverflowPolicy, LOG_QUEUE_SIZE
+from src.core.process_control import STOP_GRACE_PERIOD, STOP_DEADLINE
+from src.core.readiness import START_SIM_TIMEOUT
+from src.core.sim_core import SimCore, MAVLINK_UDP_PORT
+from src.core.slots import MultiSlotCore, SLOT_CORES, cpu_slot_limit
+from src.core.sim3d_channel import SIM_3D_HOST, SIM_3D_PORT
+from src.core.sim_pool import WARM_RECYCLE_SESSIONS, WARM_RECYCLE_MEMORY_GROWTH
 from src.logger import logger
 
 config = AutoConfig('config')
@@ -34,6 +44,16 @@ sim_launch_options_parser.add_argument(
     dest=ConfigVars.SIM_3D_SIM_LOCATION.name,
     help='path to the 3D simulator executable, will not use 3D sim if left empty'
 )
+sim_launch_options_parser.add_argument(
+    '--3d_sim_host', type=str, dest=ConfigVars.SIM_3D_HOST.name,
+    default=config(ConfigVars.SIM_3D_HOST.name, None) or SIM_3D_HOST,
+    help='host the 3D simulator API listens on'
+)
+sim_launch_options_parser.add_argument(
+    '--3d_sim_port', type=int, dest=ConfigVars.SIM_3D_PORT.name,
+    default=config(ConfigVars.SIM_3D_PORT.name, None) or SIM_3D_PORT,
+    help='port the 3D simulator API listens on'
+)
 sim_launch_options_parser.add_argument(
     '--hitl_sim_location',
     required=config(ConfigVars.SIM_HITL_SIM_LOCATION.name, None) is None,
@@ -41,6 +61,71 @@ sim_launch_options_parser.add_argument(
     dest=ConfigVars.SIM_HITL_SIM_LOCATION.name,
     help='path to the hitl simulator'
 )
+sim_launch_options_parser.add_argument(
+    '--log_queue_size', type=int, dest=ConfigVars.SIM_LOG_QUEUE_SIZE.name,
+    default=config(ConfigVars.SIM_LOG_QUEUE_SIZE.name, None) or LOG_QUEUE_SIZE,
+    help='how many log records may wait to be forwarded'
+)
+sim_launch_options_parser.add_argument(
+    '--log_overflow_policy', type=str, dest=ConfigVars.SIM_LOG_OVERFLOW_POLICY.name,
+    choices=list(OverflowPolicy),
+    default=config(ConfigVars.SIM_LOG_OVERFLOW_POLICY.name, None) or OverflowPolicy.drop_oldest,
+    help='what to do with log records when the log queue is full'
+)
+sim_launch_options_parser.add_argument(
+    '--log_spill_dir', type=str, dest=ConfigVars.SIM_LOG_SPILL_DIR.name,
+    default=config(ConfigVars.SIM_LOG_SPILL_DIR.name, None) or None,
+    help='directory to also write simulator logs to, in rotating files'
+)
+sim_launch_options_parser.add_argument(
+    '--stop_grace_period', type=float, dest=ConfigVars.SIM_STOP_GRACE_PERIOD.name,
+    default=config(ConfigVars.SIM_STOP_GRACE_PERIOD.name, None) or STOP_GRACE_PERIOD,
+    help='seconds simulators get to exit after SIGTERM before they are killed'
+)
+sim_launch_options_parser.add_argument(
+    '--stop_deadline', type=float, dest=ConfigVars.SIM_STOP_DEADLINE.name,
+    default=config(ConfigVars.SIM_STOP_DEADLINE.name, None) or STOP_DEADLINE,
+    help='seconds stop_sim may take at most'
+)
+sim_launch_options_parser.add_argument(
+    '--start_timeout', type=float, dest=ConfigVars.SIM_START_TIMEOUT.name,
+    default=config(ConfigVars.SIM_START_TIMEOUT.name, None) or START_SIM_TIMEOUT,
+    help='seconds start_sim waits for the simulators to get ready'
+)
+sim_launch_options_parser.add_argument(
+    '--hitl_ready_pattern', type=str, dest=ConfigVars.SIM_HITL_READY_PATTERN.name,
+    default=config(ConfigVars.SIM_HITL_READY_PATTERN.name, None) or None,
+    help='regular expression matching the line the hitl sim prints once it is up'
+)
+sim_launch_options_parser.add_argument(
+    '--warm_standby', action='store_true', dest=ConfigVars.SIM_WARM_STANDBY.name,
+    default=config(ConfigVars.SIM_WARM_STANDBY.name, default=False, cast=bool),
+    help='keep simulators running between sessions, stop_sim resets them instead'
+)
+sim_launch_options_parser.add_argument(
+    '--warm_recycle_sessions', type=int, dest=ConfigVars.SIM_WARM_RECYCLE_SESSIONS.name,
+    default=config(ConfigVars.SIM_WARM_RECYCLE_SESSIONS.name, None) or WARM_RECYCLE_SESSIONS,
+    help='restart a warm simulator after that many sessions'
+)
+sim_launch_options_parser.add_argument(
+    '--warm_recycle_memory_growth', type=int,
+    dest=ConfigVars.SIM_WARM_RECYCLE_MEMORY_GROWTH.name,
+    default=config(ConfigVars.SIM_WARM_RECYCLE_MEMORY_GROWTH.name, None)
+    or WARM_RECYCLE_MEMORY_GROWTH // 2 ** 20,
+    help='restart a warm simulator once its memory grows by that many MiB'
+)
+sim_launch_options_parser.add_argument(
+    '--slots', type=int, dest=ConfigVars.SIM_SLOTS.name,
+    default=config(ConfigVars.SIM_SLOTS.name, None) or 1,
+    help='run that many independent SITL simulations, commands pick one by its slot. '
+         'Slot n gets the 3D sim port and the MAVLink port plus n, the simulator scripts '
+         'get SIM_SLOT, SIM_3D_PORT and SIM_MAVLINK_UDP_PORT in their environment'
+)
+sim_launch_options_parser.add_argument(
+    '--slot_cores', type=int, dest=ConfigVars.SIM_SLOT_CORES.name,
+    default=config(ConfigVars.SIM_SLOT_CORES.name, None) or SLOT_CORES,
+    help='CPUs a slot takes, no more slots run at once than there are CPUs for'
+)
 
 wss_parser = subparsers.add_parser(
     Commands.WSS,
@@ -79,6 +164,40 @@ wss_parser.add_argument(
     help='specify a host for local cli connections. '
          'If left empty, no local connection will be allowed'
 )
+wss_parser.add_argument(
+    '--wire-format', type=str, dest=ConfigVars.SIM_WSS_WIRE_FORMAT.name,
+    choices=list(WireFormat),
+    default=config(ConfigVars.SIM_WSS_WIRE_FORMAT.name, None) or WireFormat.json,
+    help='preferred encoding of messages, the server may still fall back to json'
+)
+wss_parser.add_argument(
+    '--outbox_size', type=int, dest=ConfigVars.SIM_WSS_OUTBOX_SIZE.name,
+    default=config(ConfigVars.SIM_WSS_OUTBOX_SIZE.name, None) or CLIENT_OUTBOX_SIZE,
+    help='messages kept for the server while it is unreachable, the oldest are dropped beyond that'
+)
+wss_parser.add_argument(
+    '--outbox_path', type=str, dest=ConfigVars.SIM_WSS_OUTBOX_PATH.name,
+    default=config(ConfigVars.SIM_WSS_OUTBOX_PATH.name, None),
+    help='file to keep the messages for the server in, so that they survive a restart'
+)
+wss_parser.add_argument(
+    '--compression_window_bits', type=int,
+    dest=ConfigVars.SIM_WSS_COMPRESSION_WINDOW_BITS.name,
+    default=config(ConfigVars.SIM_WSS_COMPRESSION_WINDOW_BITS.name, None)
+    or COMPRESSION_WINDOW_BITS,
+    help='permessage-deflate window in bits, 9 to 15, 0 turns compression off'
+)
+wss_parser.add_argument(
+    '--compression_level', type=int, dest=ConfigVars.SIM_WSS_COMPRESSION_LEVEL.name,
+    default=config(ConfigVars.SIM_WSS_COMPRESSION_LEVEL.name, None) or COMPRESSION_LEVEL,
+    help='zlib level, 1 is the fastest, 9 compresses the best'
+)
+wss_parser.add_argument(
+    '--compression_threshold', type=int, dest=ConfigVars.SIM_WSS_COMPRESSION_THRESHOLD.name,
+    default=config(ConfigVars.SIM_WSS_COMPRESSION_THRESHOLD.name, None)
+    or COMPRESSION_THRESHOLD,
+    help='messages shorter than that many bytes are sent uncompressed'
+)
 wss_parser.add_argument(
     '--worker_name', type=str, dest=ConfigVars.SIM_WORKER_NAME,
     required=config(ConfigVars.SIM_WORKER_NAME.name, None) is None,
@@ -130,8 +249,51 @@ if arguments['command'] == Commands.CLI and (arguments.get('opcodes') is None):
 
 logger.info("Booting up")
 
+
+def sim_core_options(slot: Optional[int] = None) -> Dict[str, Any]:
+    """SimCore arguments from the command line, for one of the slots if there are several"""
+    options = dict(
+        hitl_sim_path=arguments[ConfigVars.SIM_HITL_SIM_LOCATION],
+        sim_3d_path=arguments[ConfigVars.SIM_3D_SIM_LOCATION],
+        log_queue_size=arguments[ConfigVars.SIM_LOG_QUEUE_SIZE],
+        log_overflow_policy=arguments[ConfigVars.SIM_LOG_OVERFLOW_POLICY],
+        log_spill_dir=arguments[ConfigVars.SIM_LOG_SPILL_DIR],
+        stop_grace_period=arguments[ConfigVars.SIM_STOP_GRACE_PERIOD],
+        stop_deadline=arguments[ConfigVars.SIM_STOP_DEADLINE],
+        start_timeout=arguments[ConfigVars.SIM_START_TIMEOUT],
+        hitl_ready_pattern=arguments[ConfigVars.SIM_HITL_READY_PATTERN],
+        warm_standby=arguments[ConfigVars.SIM_WARM_STANDBY],
+        warm_recycle_sessions=arguments[ConfigVars.SIM_WARM_RECYCLE_SESSIONS],
+        warm_recycle_memory_growth=int(
+            arguments[ConfigVars.SIM_WARM_RECYCLE_MEMORY_GROWTH]) * 2 ** 20,
+        sim_3d_host=arguments[ConfigVars.SIM_3D_HOST],
+        sim_3d_port=int(arguments[ConfigVars.SIM_3D_PORT]))
+    if slot is None:
+        return options
+    options['sim_3d_port'] += slot
+    options['mavlink_udp_port'] = MAVLINK_UDP_PORT + slot
+    if options['log_spill_dir'] is not None:
+        options['log_spill_dir'] = os.path.join(options['log_spill_dir'], f'slot{slot}')
+    options['process_env'] = {
+        'SIM_SLOT': str(slot),
+        'SIM_3D_PORT': str(options['sim_3d_port']),
+        'SIM_MAVLINK_UDP_PORT': str(options['mavlink_udp_port']),
+    }
+    return options
+
+
+def create_sim(communicator, **communicator_options):
+    slots = int(arguments[ConfigVars.SIM_SLOTS])
+    if slots > 1:
+        return MultiSlotCore(
+            communicator, SimCore, slots, sim_core_options,
+            max_active=cpu_slot_limit(int(arguments[ConfigVars.SIM_SLOT_CORES])),
+            **communicator_options)
+    return SimCore(communicator, **communicator_options, **sim_core_options())
+
+
 if arguments['command'] == Commands.WSS:
-    sim = SimCore(
+    sim = create_sim(
         communicator=WssCommunicator,
         remote_host=arguments[ConfigVars.SIM_WSS_REMOTE_HOST],
         remote_port=arguments[ConfigVars.SIM_WSS_REMOTE_PORT],
@@ -144,16 +306,19 @@ if arguments['command'] == Commands.WSS:
         local_port=arguments[ConfigVars.SIM_WSS_LOCAL_PORT],
         name=arguments[ConfigVars.SIM_WORKER_NAME],
         uuid=arguments[ConfigVars.SIM_WORKER_UUID],
-        hitl_sim_path=arguments[ConfigVars.SIM_HITL_SIM_LOCATION],
-        sim_3d_path=arguments[ConfigVars.SIM_3D_SIM_LOCATION])
+        wire_format=arguments[ConfigVars.SIM_WSS_WIRE_FORMAT],
+        outbox_size=int(arguments[ConfigVars.SIM_WSS_OUTBOX_SIZE]),
+        outbox_path=arguments[ConfigVars.SIM_WSS_OUTBOX_PATH],
+        compression=Compression(
+            window_bits=int(arguments[ConfigVars.SIM_WSS_COMPRESSION_WINDOW_BITS]),
+            level=int(arguments[ConfigVars.SIM_WSS_COMPRESSION_LEVEL]),
+            threshold=int(arguments[ConfigVars.SIM_WSS_COMPRESSION_THRESHOLD])))
     sim.run()
 elif arguments['command'] == Commands.CLI and arguments['new']:
-    sim = SimCore(
+    sim = create_sim(
         communicator=CliCommunicator,
         opcode_list=arguments['opcodes'],
-        local_port=arguments[ConfigVars.SIM_WSS_LOCAL_PORT],
-        hitl_sim_path=arguments[ConfigVars.SIM_HITL_SIM_LOCATION],
-        sim_3d_path=arguments[ConfigVars.SIM_3D_SIM_LOCATION])
+        local_port=arguments[ConfigVars.SIM_WSS_LOCAL_PORT])
     sim.run()
 elif arguments['command'] == Commands.CLI and not arguments['new']:
     wss_client = Client(
@@ -163,17 +328,15 @@ elif arguments['command'] == Commands.CLI and not arguments['new']:
         uuid=LOCAL_UUID
     )
 
-    async def cb(cmd: Command):
-        return await wss_client.send(cmd)
-
     com = CliCommunicator(
-        opcode_list=arguments['opcodes'],
-        dest=cb
+        opcode_list=arguments['opcodes']
     )
 
     async def run():
         await wss_client.connect()
         await com.setup()
+        async for cmd in com.receive():
+            print(await wss_client.request(cmd, on_progress=print))
         await wss_client.close()
     asyncio.run(run())
 
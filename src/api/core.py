@@ -2,13 +2,15 @@ from __future__ import annotations
 import asyncio
 import typing
 from abc import ABC, abstractmethod
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from enum import auto
 from functools import partial
-from typing import Union, List, Protocol, Dict, Coroutine, Any, Type
+from typing import Union, List, Protocol, Dict, Coroutine, Any, Type, Optional
 from strenum import StrEnum
 
-from .packable_dataclass import BaseEvent
+from .packable_dataclass import BaseEvent, optional_field
+from .scheduler import OpcodeScheduler, ResourceClass
 from ..logger import logger
 if typing.TYPE_CHECKING:
     from ..communicators.base_communicator import BaseCommunicator
@@ -21,13 +23,18 @@ class Opcodes(StrEnum):
     start_sim = auto()
     stop_sim = auto()
     load_scene = auto()
+    preload_scenes = auto()
     spawn_agent = auto()
+    spawn_agents = auto()
     remove_agent = auto()
     configure_autopilot = auto()
     upload_mission = auto()
     reboot_autopilot = auto()
     start_mission = auto()
     abort_mission = auto()
+    get_scheduler_stats = auto()
+    get_logs = auto()
+    get_sim3d_stats = auto()
     noop = auto()
 
 
@@ -56,24 +63,48 @@ class Pose(BaseEvent):
     angular_velocity: Vector3
 
 
+@dataclass
+class AgentSpawn(BaseEvent):
+    agent_name: str
+    position: Pose
+
+
 @dataclass
 class Command(BaseEvent):
     opcode: Opcodes
     args: List[Union[str, int, float, BaseEvent]] = field(default_factory=list)
     kwargs: Dict[str, Union[str, int, float, BaseEvent]] = field(default_factory=dict)
+    # Optional, every Result produced by the command carries the same request_id
+    request_id: Optional[str] = optional_field(default=None)
+    # Optional, the slot of a multi-slot worker to execute the command in
+    slot: Optional[int] = optional_field(default=None)
 
 
 @dataclass
 class Result(BaseEvent):
     status: StatusCode
     message: dict = field(default_factory=dict)
+    request_id: Optional[str] = optional_field(default=None)
+    slot: Optional[int] = optional_field(default=None)
+
+
+# request_id of the command being executed, Results sent on its behalf are tagged with it
+current_request_id: ContextVar[Optional[str]] = ContextVar('current_request_id', default=None)
+# Opcode of the command being executed, the same way
+current_opcode: ContextVar[Optional[str]] = ContextVar('current_opcode', default=None)
 
 
 class AbstractSimCore(ABC):
     communicator: BaseCommunicator
+    scheduler: OpcodeScheduler
 
     def __init__(self, communicator: Type[BaseCommunicator], *args, **kwargs):
         self.communicator = communicator(*args, **kwargs)
+        self.scheduler = OpcodeScheduler(
+            execute=self.execute,
+            resource_of=self.resource_of,
+            sequential=self.communicator.sequential
+        )
         for opcode in Opcodes:
             if opcode not in self.opcode_table():
                 logger.warning(f"Opcode {opcode} not found in the opcodes table. "
@@ -91,16 +122,26 @@ class AbstractSimCore(ABC):
     async def load_scene(self, scene_name: str) -> Result:
         pass
 
+    @abstractmethod
+    async def preload_scenes(self, scenes: Optional[List[str]] = None) -> Result:
+        pass
+
     @abstractmethod
     async def spawn_agent(self, agent_name: str, position: Pose) -> Result:
         pass
 
+    @abstractmethod
+    async def spawn_agents(self, agents: List[AgentSpawn]) -> Result:
+        pass
+
     @abstractmethod
     async def remove_agent(self, agent_id: str) -> Result:
         pass
 
     @abstractmethod
-    async def configure_autopilot(self, firmware: str, config: List[str]) -> Result:
+    async def configure_autopilot(
+            self, firmware: str, config: List[str], force_flash: bool = False,
+            incremental: bool = False) -> Result:
         pass
 
     @abstractmethod
@@ -119,6 +160,24 @@ class AbstractSimCore(ABC):
     async def abort_mission(self) -> Result:
         pass
 
+    @abstractmethod
+    async def get_logs(self, source: str, start: Optional[int] = None, end: Optional[int] = None,
+                       tail: Optional[int] = None, pattern: Optional[str] = None) -> Result:
+        pass
+
+    @abstractmethod
+    async def get_sim3d_stats(self) -> Result:
+        pass
+
+    async def get_scheduler_stats(self) -> Result:
+        return Result(
+            status=StatusCode.ok,
+            message={
+                'resources': self.scheduler.snapshot(),
+                'communicator': self.communicator.stats(),
+            }
+        )
+
     async def noop(self) -> None:
         pass
 
@@ -133,23 +192,39 @@ class AbstractSimCore(ABC):
         )
         return res
 
-    def run(self) -> None:
+    async def execute(self, command: Command) -> None:
+        # Every command runs in its own task, so the variable is local to the command
+        current_request_id.set(command.request_id)
+        current_opcode.set(command.opcode)
+        try:
+            res = await self.dispatch(command)
+            if res is not None:
+                res.request_id = command.request_id
+                await self.communicator.send(res)
+        finally:
+            self.communicator.completed(command)
+
+    def resource_of(self, command: Command) -> ResourceClass:
+        return self.opcode_resources().get(command.opcode, ResourceClass.none)
+
+    async def serve(self) -> None:
 
         async def recv_commands():
+            # Commands are scheduled without waiting for the previous ones to complete,
+            # see OpcodeScheduler for the order they are executed in
             async for command in self.communicator.receive():
-                res = await self.dispatch(command)
-                if res is not None:
-                    await self.communicator.send(res)
+                self.scheduler.submit(command)
+            await self.scheduler.join()
 
-        async def main():
-            await self.communicator.setup()
+        await self.communicator.setup()
 
-            await asyncio.gather(
-                self.communicator.run(),
-                recv_commands())
-            await self.cleanup()
+        await asyncio.gather(
+            self.communicator.run(),
+            recv_commands())
+        await self.cleanup()
 
-        asyncio.run(main())
+    def run(self) -> None:
+        asyncio.run(self.serve())
 
     def __getitem__(self, item: Opcodes) -> OpcodeMethod:
         return partial(self.opcode_table()[item], self)
@@ -160,16 +235,39 @@ class AbstractSimCore(ABC):
             Opcodes.start_sim: cls.start_sim,
             Opcodes.stop_sim: cls.stop_sim,
             Opcodes.load_scene: cls.load_scene,
+            Opcodes.preload_scenes: cls.preload_scenes,
             Opcodes.spawn_agent: cls.spawn_agent,
+            Opcodes.spawn_agents: cls.spawn_agents,
             Opcodes.remove_agent: cls.remove_agent,
             Opcodes.configure_autopilot: cls.configure_autopilot,
             Opcodes.upload_mission: cls.upload_mission,
             Opcodes.reboot_autopilot: cls.reboot_autopilot,
             Opcodes.start_mission: cls.start_mission,
             Opcodes.abort_mission: cls.abort_mission,
+            Opcodes.get_scheduler_stats: cls.get_scheduler_stats,
+            Opcodes.get_logs: cls.get_logs,
+            Opcodes.get_sim3d_stats: cls.get_sim3d_stats,
             Opcodes.noop: cls.noop
         }
 
+    @classmethod
+    def opcode_resources(cls):
+        # Opcodes missing here use no resource and run right away.
+        # abort_mission must not wait for the mission it aborts
+        return {
+            Opcodes.start_sim: ResourceClass.process,
+            Opcodes.stop_sim: ResourceClass.process,
+            Opcodes.load_scene: ResourceClass.sim3d,
+            Opcodes.preload_scenes: ResourceClass.sim3d,
+            Opcodes.spawn_agent: ResourceClass.sim3d,
+            Opcodes.spawn_agents: ResourceClass.sim3d,
+            Opcodes.remove_agent: ResourceClass.sim3d,
+            Opcodes.configure_autopilot: ResourceClass.autopilot,
+            Opcodes.upload_mission: ResourceClass.autopilot,
+            Opcodes.reboot_autopilot: ResourceClass.autopilot,
+            Opcodes.start_mission: ResourceClass.autopilot,
+        }
+
 
 class ModeEnum(StrEnum):
     HITL = 'cyphal_standard_vtol'
@@ -1,8 +1,10 @@
 from __future__ import annotations
-from dataclasses import dataclass, fields, is_dataclass
+from dataclasses import dataclass, field, fields, is_dataclass, MISSING, Field
 from enum import Enum
 from functools import lru_cache
-from typing import Dict, Union, get_type_hints, TypeVar, List, get_origin, Type
+from typing import (
+    Dict, Union, get_type_hints, TypeVar, List, get_origin, get_args, Type, Callable,
+    Optional, Tuple, Any)
 
 from strenum import StrEnum
 
@@ -12,6 +14,28 @@ SimpleTypes = Union[str, dict, int, float]
 DataDict = Dict[str, SimpleTypes]
 DataContainer = Union[DataDict, List[SimpleTypes], SimpleTypes, Enum, StrEnum]
 
+FieldCodec = Optional[Callable[[Any], Any]]
+
+# Values of these types are sent as is, no conversion needed
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+# Marks a field packed by value, see optional_field
+_REQUIRED = object()
+
+
+def optional_field(**kwargs) -> Any:
+    """
+    Field added to a message after peers that don't know it were released. It is left out
+    of the packed json while it holds its default, so those peers can still read the message
+    """
+    return field(metadata={'optional': True}, **kwargs)
+
+
+def _omitted_default(f: Field) -> Any:
+    # Value that is not packed, _REQUIRED if the field is always packed
+    if not f.metadata.get('optional'):
+        return _REQUIRED
+    return f.default_factory() if f.default is MISSING else f.default
+
 
 @dataclass
 class BaseEvent:
@@ -22,22 +46,24 @@ class BaseEvent:
 
     This class uses type annotations a LOT, so it is an imperative to annotate fields
 
-    For now all fields are included in the packed json (and used to recreate a dataclass back)
+    All fields are included in the packed json (and used to recreate a dataclass back),
+    except for the optional ones that hold their default, see optional_field
+
+    Type annotations are only inspected once per class, see DataclassCodec
     """
     def pack(self) -> DataDict:
-        res = {
-            'type': str(type(self).__name__),
-            'data': {}
-        }
-        BaseEvent._to_dict_recurse(res['data'], self)
-        return res
+        return DataclassCodec.of(type(self)).pack(self)
 
     @staticmethod
     def _to_dict_recurse(res: DataDict, part: BaseEvent) -> DataDict:
+        # Reflective reference implementation of pack(), it inspects type hints on every call.
+        # Kept to check DataclassCodec for wire compatibility and to benchmark it
         # Pull out types and arg names
         types_involved = get_type_hints(type(part))
-        for type_, name in [(types_involved[n.name], n.name) for n in fields(part)]:
-            res[name] = BaseEvent._parse_field(type_, part, name)
+        for f in fields(part):
+            if getattr(part, f.name) == _omitted_default(f):
+                continue
+            res[f.name] = BaseEvent._parse_field(types_involved[f.name], part, f.name)
         return res
 
     @staticmethod
@@ -71,10 +97,11 @@ class BaseEvent:
     def unpack(cls, dictionary: DataDict) -> BaseEvent:
         if 'type' not in dictionary or 'data' not in dictionary:
             raise MalformedDataclassJson(dictionary)
-        return BaseEvent._from_dict_recurse(dictionary)
+        return DataclassCodec.unpack_any(dictionary)
 
     @staticmethod
     def _from_dict_recurse(src: DataContainer) -> Union[BaseEvent, List, Dict]:
+        # Reflective reference implementation of unpack(), see _to_dict_recurse
         # Pull type from the corresponding field, create a new object from the type_table
         # And populate it with data, for dataclas-field recurse onwards until there are only simple
         # args
@@ -122,3 +149,156 @@ class BaseEvent:
         }
 
     T = TypeVar('T')
+
+
+class DataclassCodec:
+    """
+    Pack and unpack functions specialized for a single dataclass.
+
+    Type hints of the dataclass are resolved once, when the codec is built, and turned
+    into a list of per-field converters. Fields of plain types (str, int, List[int], etc.)
+    get no converter at all, so packing them is a mere attribute read.
+    Codecs are built lazily on first use and cached per class, use DataclassCodec.of to get one
+
+    The produced json is the same as BaseEvent._to_dict_recurse produces. On unpacking,
+    enum fields are restored from their {name: value} representation
+    and fields unknown to the recipient are ignored
+    """
+    _codecs: Dict[type, DataclassCodec] = {}
+
+    def __init__(self, cls: type):
+        self.cls = cls
+        self.type_name = str(cls.__name__)
+        hints = get_type_hints(cls)
+        self.packers: List[Tuple[str, FieldCodec, Any]] = []
+        self.unpackers: List[Tuple[str, FieldCodec]] = []
+        for f in fields(cls):
+            self.packers.append(
+                (f.name, DataclassCodec._compile_packer(hints[f.name]), _omitted_default(f)))
+            if f.init:
+                self.unpackers.append((f.name, DataclassCodec._compile_unpacker(hints[f.name])))
+
+    @classmethod
+    def of(cls, dataclass_type: type) -> DataclassCodec:
+        try:
+            return cls._codecs[dataclass_type]
+        except KeyError:
+            codec = cls._codecs[dataclass_type] = DataclassCodec(dataclass_type)
+            return codec
+
+    def pack(self, obj: Any) -> DataDict:
+        data = {}
+        for name, packer, omitted in self.packers:
+            value = getattr(obj, name)
+            if omitted is not _REQUIRED and value == omitted:
+                continue
+            data[name] = value if packer is None or value is None else packer(value)
+        return {
+            'type': self.type_name,
+            'data': data
+        }
+
+    def unpack(self, src: DataDict) -> Any:
+        data = src['data']
+        kwargs = {}
+        for name, unpacker in self.unpackers:
+            if name in data:
+                value = data[name]
+                kwargs[name] = value if unpacker is None or value is None else unpacker(value)
+        return self.cls(**kwargs)
+
+    @staticmethod
+    def pack_any(value: Any) -> DataContainer:
+        # Used when the type is not known beforehand, mirrors BaseEvent._parse_field
+        if type(value) in _PLAIN_TYPES:
+            return value
+        if isinstance(value, Enum):
+            return {value.name: value.value}
+        if isinstance(value, dict):
+            return {k: DataclassCodec.pack_any(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [DataclassCodec.pack_any(v) for v in value]
+        if is_dataclass(value):
+            return DataclassCodec.of(type(value)).pack(value)
+        return value
+
+    @staticmethod
+    def unpack_any(src: DataContainer) -> Any:
+        # Used when the type is not known beforehand, mirrors BaseEvent._from_dict_recurse
+        if isinstance(src, dict):
+            if 'type' in src and 'data' in src:
+                try:
+                    cls_ = BaseEvent.type_table()[src['type']]
+                except KeyError as exc:
+                    raise UnknownMessage(src['type']) from exc
+                return DataclassCodec.of(cls_).unpack(src)
+            return {k: DataclassCodec.unpack_any(v) for k, v in src.items()}
+        if isinstance(src, list):
+            return [DataclassCodec.unpack_any(v) for v in src]
+        return src
+
+    @staticmethod
+    def _compile_packer(type_: Any) -> FieldCodec:
+        origin = get_origin(type_)
+        args = get_args(type_)
+        if type_ in _PLAIN_TYPES:
+            return None
+        if origin is Union:
+            options = [t for t in args if t is not type(None)]
+            if len(options) == 1:
+                return DataclassCodec._compile_packer(options[0])
+            if all(t in _PLAIN_TYPES for t in options):
+                return None
+            return DataclassCodec.pack_any
+        if origin is list or type_ is list:
+            item = DataclassCodec._compile_packer(args[0]) if args else DataclassCodec.pack_any
+            if item is None:
+                return list
+            return lambda v: [None if x is None else item(x) for x in v]
+        if origin is dict or type_ is dict:
+            item = DataclassCodec._compile_packer(args[1]) if args else DataclassCodec.pack_any
+            if item is None:
+                return dict
+            return lambda v: {k: None if x is None else item(x) for k, x in v.items()}
+        if isinstance(type_, type) and issubclass(type_, Enum):
+            return lambda v: {v.name: v.value}
+        if isinstance(type_, type) and is_dataclass(type_):
+            # Actual value may be a subclass, so the codec is picked by the value type
+            return lambda v: DataclassCodec.of(type(v)).pack(v)
+        return DataclassCodec.pack_any
+
+    @staticmethod
+    def _compile_unpacker(type_: Any) -> FieldCodec:
+        origin = get_origin(type_)
+        args = get_args(type_)
+        if type_ in _PLAIN_TYPES:
+            return None
+        if origin is Union:
+            options = [t for t in args if t is not type(None)]
+            if len(options) == 1:
+                return DataclassCodec._compile_unpacker(options[0])
+            if all(t in _PLAIN_TYPES for t in options):
+                return None
+            return DataclassCodec.unpack_any
+        if origin is list or type_ is list:
+            item = DataclassCodec._compile_unpacker(args[0]) if args else DataclassCodec.unpack_any
+            if item is None:
+                return None
+            return lambda v: [None if x is None else item(x) for x in v]
+        if origin is dict or type_ is dict:
+            item = DataclassCodec._compile_unpacker(args[1]) if args else DataclassCodec.unpack_any
+            if item is None:
+                return None
+            return lambda v: {k: None if x is None else item(x) for k, x in v.items()}
+        if isinstance(type_, type) and issubclass(type_, Enum):
+            enum_type = type_
+
+            def unpack_enum(v: Any) -> Any:
+                try:
+                    if isinstance(v, dict) and len(v) == 1:
+                        return enum_type[next(iter(v))]
+                    return enum_type(v)
+                except (KeyError, ValueError) as exc:
+                    raise MalformedDataclassJson(v) from exc
+            return unpack_enum
+        return DataclassCodec.unpack_any
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import typing
+from dataclasses import dataclass, field
+from enum import auto
+from typing import Callable, Awaitable, Dict, Set, Optional
+
+from strenum import StrEnum
+
+from ..logger import logger
+from ..utils import LatencyStats
+if typing.TYPE_CHECKING:
+    from .core import Command
+
+scheduler_logger = logger.getChild('scheduler')
+scheduler_logger.setLevel(logger.level)
+scheduler_logger.handlers = []
+
+
+class ResourceClass(StrEnum):
+    """
+    Part of the worker an opcode works with. Opcodes that use different resources
+    may run at the same time, opcodes that use the same resource run one by one
+    in the order they were received.
+
+    process is special: starting or stopping the simulator changes everything, so such
+    opcodes wait for all the earlier ones to finish, and the later ones wait for them
+    """
+    process = auto()
+    sim3d = auto()
+    autopilot = auto()
+    none = auto()
+
+
+@dataclass
+class ResourceStats:
+    waiting: int = 0
+    running: int = 0
+    executed: int = 0
+    wait: LatencyStats = field(default_factory=LatencyStats)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'queue_depth': self.waiting + self.running,
+            'waiting': self.waiting,
+            'running': self.running,
+            'executed': self.executed,
+            'last_wait': round(self.wait.last, 3),
+            'max_wait': round(self.wait.max, 3),
+            'avg_wait': round(self.wait.avg, 3),
+        }
+
+
+class OpcodeScheduler:
+    """
+    Runs commands concurrently according to the resources they use, see ResourceClass.
+    Every command becomes a task that waits for its predecessors before it executes,
+    so submitting never blocks the reader of commands.
+
+    With sequential=True every command waits for all the earlier ones, as if they were
+    executed one after another, which is what the CLI opcode files expect
+    """
+    execute: Callable[[Command], Awaitable[None]]
+    resource_of: Callable[[Command], ResourceClass]
+    sequential: bool
+    stats: Dict[ResourceClass, ResourceStats]
+
+    def __init__(
+            self, execute: Callable[[Command], Awaitable[None]],
+            resource_of: Callable[[Command], ResourceClass],
+            sequential: bool = False):
+        self.execute = execute
+        self.resource_of = resource_of
+        self.sequential = sequential
+        self.stats = {resource: ResourceStats() for resource in ResourceClass}
+        self._tasks: Set[asyncio.Task] = set()
+        self._tails: Dict[ResourceClass, asyncio.Task] = {}
+        self._barrier: Optional[asyncio.Task] = None
+
+    def submit(self, command: Command) -> asyncio.Task:
+        resource = self.resource_of(command)
+        exclusive = self.sequential or resource == ResourceClass.process
+
+        if exclusive:
+            predecessors = set(self._tasks)
+        else:
+            predecessors = {
+                task for task in (self._barrier, self._tails.get(resource))
+                if task is not None and not task.done()
+            }
+
+        self.stats[resource].waiting += 1
+        task = asyncio.create_task(
+            self._run(command, resource, predecessors, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if exclusive:
+            self._barrier = task
+        if resource != ResourceClass.none:
+            self._tails[resource] = task
+        return task
+
+    async def join(self) -> None:
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {str(resource): stats.to_dict() for resource, stats in self.stats.items()}
+
+    async def _run(
+            self, command: Command, resource: ResourceClass,
+            predecessors: Set[asyncio.Task], submitted: float) -> None:
+        stats = self.stats[resource]
+        if predecessors:
+            await asyncio.wait(predecessors)
+
+        waited = time.monotonic() - submitted
+        stats.waiting -= 1
+        stats.running += 1
+        stats.wait.record(waited)
+        try:
+            await self.execute(command)
+        except Exception:  # pylint: disable=broad-exception-caught
+            scheduler_logger.exception(f'Command {command.opcode} failed')
+        finally:
+            stats.running -= 1
+            stats.executed += 1
@@ -0,0 +1,183 @@
+"""
+Compression of messages on the wire, and how much it saves
+
+Messages are compressed with the permessage-deflate extension, except for the ones
+shorter than the threshold, which are not worth the CPU. The window and the level
+trade memory and CPU for the size of the messages, log dumps and mission results
+are the big ones and compress very well
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, List, Tuple, Dict, Any, Sequence, Union
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate, ClientPerMessageDeflateFactory, ServerPerMessageDeflateFactory)
+from websockets.frames import Frame, CONT, CTRL_OPCODES
+from websockets.typing import ExtensionParameter
+
+from ..core import Command, current_opcode
+from ..packable_dataclass import BaseEvent
+from ..websocket_connection.wire_format import WireFormat, encode
+
+# LZ77 window of either side in bits, 9 to 15, 0 turns compression off
+COMPRESSION_WINDOW_BITS = 12
+# zlib level, 1 is the fastest, 9 compresses the best
+COMPRESSION_LEVEL = 6
+# Messages shorter than that, in bytes, are sent as they are
+COMPRESSION_THRESHOLD = 256
+# zlib memory for the compression state, 1 to 9, the same as websockets uses by default
+COMPRESSION_MEM_LEVEL = 5
+
+# Payload sizes of the frames of the message being sent, and whether they were compressed.
+# Frames are encoded in the task that sends them, so the variable is local to the message
+_encoded: ContextVar[Optional[List[Tuple[int, bool]]]] = ContextVar('_encoded', default=None)
+
+
+@dataclass
+class Compression:
+    window_bits: int = COMPRESSION_WINDOW_BITS
+    level: int = COMPRESSION_LEVEL
+    threshold: int = COMPRESSION_THRESHOLD
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_bits > 0
+
+    def client_extensions(self) -> Optional[List[ClientPerMessageDeflateFactory]]:
+        if not self.enabled:
+            return None
+        return [ClientDeflateFactory(
+            server_max_window_bits=self.window_bits,
+            client_max_window_bits=self.window_bits,
+            compress_settings=self._compress_settings(),
+            threshold=self.threshold)]
+
+    def server_extensions(self) -> Optional[List[ServerPerMessageDeflateFactory]]:
+        if not self.enabled:
+            return None
+        return [ServerDeflateFactory(
+            server_max_window_bits=self.window_bits,
+            client_max_window_bits=self.window_bits,
+            compress_settings=self._compress_settings(),
+            threshold=self.threshold)]
+
+    def connection_options(self, server: bool = False) -> Dict[str, Any]:
+        """Arguments of websockets.connect, or of websockets.serve if server"""
+        if not self.enabled:
+            return {'compression': None}
+        return {
+            'compression': None,
+            'extensions': self.server_extensions() if server else self.client_extensions(),
+        }
+
+    def _compress_settings(self) -> Dict[str, int]:
+        return {'level': self.level, 'memLevel': COMPRESSION_MEM_LEVEL}
+
+
+class ThresholdDeflate(PerMessageDeflate):
+    """permessage-deflate that leaves the messages shorter than the threshold alone"""
+
+    def __init__(self, *args, threshold: int = COMPRESSION_THRESHOLD, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        self._skipping = False
+
+    @classmethod
+    def of(cls, extension: PerMessageDeflate, threshold: int) -> ThresholdDeflate:
+        return cls(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            threshold=threshold)
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not CONT:
+            # The first frame decides for the whole message
+            self._skipping = len(frame.data) < self.threshold
+        encoded = frame if self._skipping else super().encode(frame)
+        sizes = _encoded.get()
+        if sizes is not None:
+            sizes.append((len(encoded.data), not self._skipping))
+        return encoded
+
+
+class ClientDeflateFactory(ClientPerMessageDeflateFactory):
+
+    def __init__(self, *args, threshold: int = COMPRESSION_THRESHOLD, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def process_response_params(self, params: Sequence[ExtensionParameter],
+                                accepted_extensions: Sequence[Extension]) -> PerMessageDeflate:
+        return ThresholdDeflate.of(
+            super().process_response_params(params, accepted_extensions), self.threshold)
+
+
+class ServerDeflateFactory(ServerPerMessageDeflateFactory):
+
+    def __init__(self, *args, threshold: int = COMPRESSION_THRESHOLD, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def process_request_params(
+            self, params: Sequence[ExtensionParameter],
+            accepted_extensions: Sequence[Extension]
+    ) -> Tuple[List[ExtensionParameter], PerMessageDeflate]:
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdDeflate.of(extension, self.threshold)
+
+
+def label_of(event: BaseEvent) -> str:
+    """Opcode the message is about, Results are about the command being executed"""
+    if isinstance(event, Command):
+        return event.opcode
+    return current_opcode.get() or type(event).__name__
+
+
+class FrameSizes:
+    """Bytes of the messages sent, before and after compression, by opcode"""
+
+    def __init__(self):
+        self.by_opcode: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+            'messages': 0,
+            'compressed': 0,
+            'raw_bytes': 0,
+            'wire_bytes': 0,
+        })
+
+    async def send(self, connection, event: BaseEvent,
+                   wire_format: Union[str, WireFormat] = WireFormat.json,
+                   label: Optional[str] = None) -> None:
+        """Sends the event, counted under the label, or under label_of(event) by default"""
+        frame = encode(event, wire_format)
+        sizes = []
+        token = _encoded.set(sizes)
+        try:
+            await connection.send(frame)
+        finally:
+            _encoded.reset(token)
+        # JSON is dumped as ASCII, so characters are bytes
+        raw = len(frame)
+        counters = self.by_opcode[label or label_of(event)]
+        counters['messages'] += 1
+        counters['raw_bytes'] += raw
+        # Without the extension, frames go as they are
+        counters['wire_bytes'] += sum(size for size, _ in sizes) if sizes else raw
+        counters['compressed'] += any(compressed for _, compressed in sizes)
+
+    def stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        return {
+            label: {
+                **counters,
+                'ratio': round(counters['wire_bytes'] / max(counters['raw_bytes'], 1), 3),
+            }
+            for label, counters in self.by_opcode.items()
+        }
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import auto
+from typing import Callable, Optional, List, Dict, Deque, Set, Any
+from uuid import uuid4
+
+from strenum import StrEnum
+from websockets.exceptions import ConnectionClosed
+
+from ..core import Command, Result, StatusCode
+from ..websocket_connection.pending_requests import ProgressCallback
+from ..websocket_connection.websocket_server import Server, Worker
+from ...logger import logger
+
+# A job is given up on once that many workers left while running it
+JOB_ATTEMPTS = 3
+
+jobs_logger = logger.getChild('jobs')
+jobs_logger.setLevel(logger.level)
+jobs_logger.handlers = []
+
+
+class JobState(StrEnum):
+    queued = auto()
+    running = auto()
+    done = auto()
+    failed = auto()
+
+
+class WorkerLost(Exception):
+    """The job was requeued JOB_ATTEMPTS times, every worker that took it left"""
+
+
+@dataclass
+class Job:
+    """Commands executed one after another on a single worker, in a single slot of it"""
+    commands: List[Command]
+    # Which workers may run the job, any by default
+    eligible: Optional[Callable[[Worker], bool]] = None
+    on_progress: Optional[ProgressCallback] = None
+    id: str = field(default_factory=lambda: uuid4().hex)
+    state: JobState = JobState.queued
+    attempts: int = 0
+    worker: Optional[str] = None
+    slot: Optional[int] = None
+    results: List[Result] = field(default_factory=list)
+    future: Optional[asyncio.Future] = None
+
+
+@dataclass
+class WorkerLoad:
+    """What the scheduler knows about a worker, from the jobs it gave it and their Results"""
+    capacity: int
+    joined_at: float = field(default_factory=time.monotonic)
+    # Slots with a job in them, and when the job started
+    running: Dict[int, float] = field(default_factory=dict)
+    # Commands sent to the worker that have no final Result yet
+    queued: int = 0
+    jobs_done: int = 0
+    jobs_requeued: int = 0
+    errors: int = 0
+    busy_time: float = 0
+    last_result: Optional[float] = None
+
+    @property
+    def load(self) -> float:
+        return len(self.running) / self.capacity
+
+    def free_slot(self) -> Optional[int]:
+        return next((slot for slot in range(self.capacity) if slot not in self.running), None)
+
+    def observe(self, result: Result) -> None:
+        self.last_result = time.monotonic()
+        if result.status == StatusCode.error:
+            self.errors += 1
+
+    def release(self, slot: int) -> None:
+        self.busy_time += time.monotonic() - self.running.pop(slot)
+
+    def utilization(self) -> float:
+        """Share of the slot time since the worker joined that was spent on jobs"""
+        now = time.monotonic()
+        busy = self.busy_time + sum(now - started for started in self.running.values())
+        return busy / max(self.capacity * (now - self.joined_at), 1e-9)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'capacity': self.capacity,
+            'busy': bool(self.running),
+            'running': len(self.running),
+            'queued': self.queued,
+            'jobs_done': self.jobs_done,
+            'jobs_requeued': self.jobs_requeued,
+            'errors': self.errors,
+            'utilization': round(self.utilization(), 3),
+        }
+
+
+class JobScheduler:
+    """
+    Places jobs on the workers connected to the server. A job goes to the eligible worker
+    with a free slot that is the least loaded: the fewest of its slots busy, then the fewest
+    commands waiting for a Result, then the least time spent on jobs so far.
+    Jobs that fit nowhere wait in the queue, in the order they were submitted, and are placed
+    as soon as a slot frees up or a worker joins. Jobs of a worker that leaves are put back
+    at the head of the queue and start over elsewhere.
+
+    Takes over the join and leave callbacks of the server, calling the ones it had
+    """
+
+    def __init__(self, server: Server, attempts: int = JOB_ATTEMPTS):
+        self.server = server
+        self.attempts = attempts
+        self.loads: Dict[str, WorkerLoad] = {}
+        self._queue: Deque[Job] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+        self.counters = {
+            'submitted': 0,
+            'placed': 0,
+            'done': 0,
+            'failed': 0,
+            'requeued': 0,
+        }
+        self._join_callback = server.join_callback
+        self._leave_callback = server.leave_callback
+        server.join_callback = self._joined
+        server.leave_callback = self._left
+
+    def submit(self, commands: List[Command],
+               eligible: Optional[Callable[[Worker], bool]] = None,
+               on_progress: Optional[ProgressCallback] = None) -> Job:
+        job = Job(list(commands), eligible, on_progress)
+        job.future = asyncio.get_running_loop().create_future()
+        self.counters['submitted'] += 1
+        self._queue.append(job)
+        self._place()
+        return job
+
+    async def run(self, commands: List[Command],
+                  eligible: Optional[Callable[[Worker], bool]] = None,
+                  on_progress: Optional[ProgressCallback] = None) -> List[Result]:
+        """Results of the commands of the job, once it is done"""
+        return await self.submit(commands, eligible, on_progress).future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': len(self._queue),
+            'running': len(self._tasks),
+            **self.counters,
+            'workers': {uuid: load.stats() for uuid, load in self.loads.items()},
+        }
+
+    async def _joined(self, uuid: str, name: str) -> None:
+        self.loads[uuid] = WorkerLoad(capacity=max(1, self.server.workers[uuid].capacity))
+        if self._join_callback is not None:
+            await self._join_callback(uuid, name)
+        self._place()
+
+    async def _left(self, uuid: str, name: str) -> None:
+        # Jobs running there find out on their own, their requests fail unless it resumes
+        self.loads.pop(uuid, None)
+        if self._leave_callback is not None:
+            await self._leave_callback(uuid, name)
+
+    def _place(self) -> None:
+        free = sum(load.capacity - len(load.running) for load in self.loads.values())
+        waiting = deque()
+        while self._queue and free:
+            job = self._queue.popleft()
+            uuid = self._pick(job)
+            if uuid is None:
+                waiting.append(job)
+                continue
+            load = self.loads[uuid]
+            slot = load.free_slot()
+            load.running[slot] = time.monotonic()
+            free -= 1
+            job.state, job.worker, job.slot = JobState.running, uuid, slot
+            self.counters['placed'] += 1
+            task = asyncio.create_task(self._run_job(job, uuid, load, slot))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        waiting.extend(self._queue)
+        self._queue = waiting
+
+    def _pick(self, job: Job) -> Optional[str]:
+        candidates = [
+            (load.load, load.queued, load.busy_time, uuid)
+            for uuid, load in self.loads.items()
+            if len(load.running) < load.capacity
+            and (job.eligible is None or job.eligible(self.server.workers[uuid]))
+        ]
+        return min(candidates)[-1] if candidates else None
+
+    async def _run_job(self, job: Job, uuid: str, load: WorkerLoad, slot: int) -> None:
+
+        def on_progress(result: Result):
+            load.last_result = time.monotonic()
+            if job.on_progress is not None:
+                job.on_progress(result)
+
+        results = []
+        try:
+            for command in job.commands:
+                # Workers with one slot may not know about slots at all
+                command = dataclasses.replace(
+                    command, request_id=None, slot=slot if load.capacity > 1 else None)
+                load.queued += 1
+                try:
+                    result = await self.server.request(uuid, command, on_progress=on_progress)
+                finally:
+                    load.queued -= 1
+                load.observe(result)
+                results.append(result)
+        except (ConnectionClosed, KeyError):
+            self._requeue(job, uuid, load)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self._fail(job, exc)
+        else:
+            job.results = results
+            job.state = JobState.done
+            load.jobs_done += 1
+            self.counters['done'] += 1
+            if not job.future.done():
+                job.future.set_result(results)
+        finally:
+            load.release(slot)
+            self._place()
+
+    def _requeue(self, job: Job, uuid: str, load: WorkerLoad) -> None:
+        job.attempts += 1
+        load.jobs_requeued += 1
+        if self.loads.get(uuid) is load:
+            # The connection is gone, even if the server did not notice yet
+            del self.loads[uuid]
+        if job.attempts >= self.attempts:
+            self._fail(job, WorkerLost(
+                f'job {job.id} lost {job.attempts} workers, the last one {uuid}'))
+            return
+        jobs_logger.info(f'Worker {uuid} left, job {job.id} goes back to the queue')
+        job.state, job.worker, job.slot = JobState.queued, None, None
+        self.counters['requeued'] += 1
+        self._queue.appendleft(job)
+
+    def _fail(self, job: Job, exc: Exception) -> None:
+        job.state = JobState.failed
+        self.counters['failed'] += 1
+        if not job.future.done():
+            job.future.set_exception(exc)
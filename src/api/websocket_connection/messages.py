@@ -1,9 +1,24 @@
 from dataclasses import dataclass
+from typing import List, Optional
 
-from ..packable_dataclass import BaseEvent
+from ..packable_dataclass import BaseEvent, optional_field
 
 
 @dataclass
 class Greeting(BaseEvent):
     name: str
     uuid: str
+    # Encodings the sender is able to receive, in the order of preference.
+    # When the server replies with a Greeting, this holds the one encoding it picked
+    wire_formats: List[str] = optional_field(default_factory=lambda: ['json'])
+    # How many jobs a worker runs at once, one per slot
+    capacity: int = optional_field(default=1)
+    # Session the worker resumes after a reconnect, see SESSION_HEADER, and how many messages
+    # of it the server has received. Only the server sends these, in its reply
+    session: Optional[str] = optional_field(default=None)
+    delivered: Optional[int] = optional_field(default=None)
+
+
+# The worker names its session in the handshake rather than in the Greeting,
+# servers that know nothing about sessions ignore the header
+SESSION_HEADER = 'X-Worker-Session'
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional, Callable
+from uuid import uuid4
+
+from ..core import Command, Result, StatusCode
+from ..packable_dataclass import BaseEvent
+
+ProgressCallback = Callable[[Result], None]
+
+
+@dataclass
+class PendingRequest:
+    future: asyncio.Future
+    on_progress: Optional[ProgressCallback] = None
+
+
+class PendingRequests:
+    """
+    Commands sent with request() that wait for their final Result.
+    Results are matched to commands by request_id, in_progress Results
+    are passed to the progress callback of the command
+    """
+    _pending: Dict[str, PendingRequest]
+
+    def __init__(self):
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, cmd: Command, on_progress: Optional[ProgressCallback] = None
+                 ) -> asyncio.Future:
+        if cmd.request_id is None:
+            cmd.request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[cmd.request_id] = PendingRequest(future=future, on_progress=on_progress)
+        return future
+
+    def resolve(self, event: BaseEvent) -> bool:
+        """Returns False if the event is not a reply to any of the pending requests"""
+        if not isinstance(event, Result) or event.request_id not in self._pending:
+            return False
+        if event.status == StatusCode.in_progress:
+            if (on_progress := self._pending[event.request_id].on_progress) is not None:
+                on_progress(event)
+            return True
+        future = self._pending.pop(event.request_id).future
+        if not future.done():
+            future.set_result(event)
+        return True
+
+    def discard(self, request_id: str) -> None:
+        self._pending.pop(request_id, None)
+
+    def fail_all(self, exc: BaseException) -> None:
+        for request in self._pending.values():
+            if not request.future.done():
+                request.future.set_exception(exc)
+        self._pending.clear()
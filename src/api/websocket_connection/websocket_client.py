@@ -1,66 +1,348 @@
 import asyncio
 import json
+import os
+import random
 import ssl
+import time
 from asyncio import sleep
+from collections import deque
 from dataclasses import dataclass, field
+from typing import List, Optional, Deque, Dict, Union, Any
+from uuid import uuid4
 
 import websockets
-from websockets.exceptions import ConnectionClosedOK
+from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
 from websockets.legacy.client import WebSocketClientProtocol
 
-from ..core import Command, Opcodes
+from ..core import Command, Opcodes, Result
 from ..packable_dataclass import BaseEvent
-from ..websocket_connection.messages import Greeting
+from ..websocket_connection.compression import Compression, FrameSizes, label_of
+from ..websocket_connection.messages import Greeting, SESSION_HEADER
+from ..websocket_connection.pending_requests import PendingRequests, ProgressCallback
+from ..websocket_connection.wire_format import WireFormat, decode
+from ...exceptions import DataclassJsonException
 from ...logger import logger
 
+# Messages kept for resending after a reconnect, the oldest ones are dropped beyond that
+CLIENT_OUTBOX_SIZE = 1000
+# Delay between connection attempts, doubling up to the max, with jitter
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 30
+# How long to wait for the server to say what it got before the connection dropped.
+# Servers that know nothing about sessions don't say anything, nor do the ones that don't
+# know the session, having been restarted
+RESUME_TIMEOUT = 2
+
 ws_logger = logger.getChild('wss_client')
 ws_logger.setLevel(logger.level)
 ws_logger.handlers = []
 
 
+@dataclass
+class Outgoing:
+    msg: BaseEvent
+    # Number of the message in the session once it is put on the wire,
+    # which doesn't mean the server got it
+    index: Optional[int] = None
+    # What its size is counted under, the opcode of the command it was sent for
+    label: Optional[str] = None
+
+    @property
+    def sent(self) -> bool:
+        return self.index is not None
+
+
 @dataclass
 class Client:
+    """
+    Connection to the server.
+
+    With reconnect=True, a dropped connection is made again with jittered exponential
+    backoff, and so is the first one if the server is not there yet. Messages sent
+    meanwhile wait in the outbox, up to outbox_size of them, and go out once connected.
+    With outbox_path, they are also written there, so they survive a restart of the worker.
+
+    Every message put on the wire gets the next number of the session, the session being
+    this Client. When it connects again, the handshake names the session, and the server
+    replies with how many of its messages it has received, so that exactly the rest is resent
+    """
     host: str
     port: int
     uuid: str
     name: str = ""
     cert: str = None
+    # Encodings to offer to the server, in the order of preference
+    wire_formats: List[str] = field(default_factory=lambda: [WireFormat.json])
+    # Jobs the worker is able to run at once, told to the server in the Greeting
+    capacity: int = 1
+    reconnect: bool = False
+    outbox_size: int = CLIENT_OUTBOX_SIZE
+    outbox_path: Optional[str] = None
+    backoff_min: float = RECONNECT_BACKOFF_MIN
+    backoff_max: float = RECONNECT_BACKOFF_MAX
+    compression: Compression = field(default_factory=Compression)
     ssl_context: ssl.SSLContext = field(init=False)
-    connection: WebSocketClientProtocol = field(init=False)
+    connection: WebSocketClientProtocol = field(init=False, default=None)
+    # Messages are sent in JSON until the server picks something else
+    wire_format: WireFormat = field(init=False, default=WireFormat.json)
+    pending: PendingRequests = field(init=False, default_factory=PendingRequests)
+    session: str = field(init=False, default_factory=lambda: uuid4().hex)
+    frame_sizes: FrameSizes = field(init=False, default_factory=FrameSizes)
+    # Everything received that is not a reply to request(), see recv()
+    _inbox: asyncio.Queue = field(init=False, default=None)
+    _reader: Optional[asyncio.Task] = field(init=False, default=None)
+    _outbox: Deque[Outgoing] = field(init=False, default=None)
+    # Messages of the session put on the wire
+    _wired: int = field(init=False, default=0)
+    # Set while connected and nothing is waiting in the outbox
+    _online: asyncio.Event = field(init=False, default=None)
+    _reconnecting: Optional[asyncio.Task] = field(init=False, default=None)
+    _closing: bool = field(init=False, default=False)
+    counters: Dict[str, Union[int, float, None]] = field(init=False, default_factory=lambda: {
+        'connects': 0,
+        'reconnects': 0,
+        'connect_failures': 0,
+        'resent': 0,
+        'dropped': 0,
+        'last_reconnect_time': None,
+        'max_reconnect_time': 0.0,
+    })
 
     def __post_init__(self):
         self.is_using_ssl = self.cert is not None
         if self.is_using_ssl:
             logger.info("Using secure sockets")
+            # Made once and used for every connection
             self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
             self.ssl_context.load_verify_locations(self.cert)
         else:
             logger.info("Using plain sockets")
 
     async def connect(self):
+        if self._inbox is None:
+            self._inbox = asyncio.Queue()
+            self._outbox = deque()
+            self._online = asyncio.Event()
+            self._load_outbox()
+        self._closing = False
+        if self.reconnect:
+            await self._connect_with_backoff()
+        else:
+            await self._connect_once()
+
+    async def _connect_once(self):
+        # Only a client that reconnects has a session to resume
+        headers = {SESSION_HEADER: self.session} if self.reconnect else None
         if self.is_using_ssl:
             self.connection = await websockets.connect(  # pylint: disable=E1101
-                f'wss://{self.host}:{self.port}', ssl=self.ssl_context)
+                f'wss://{self.host}:{self.port}', ssl=self.ssl_context,
+                additional_headers=headers, **self.compression.connection_options())
 
         else:
             self.connection = await websockets.connect(  # pylint: disable=E1101
-                f'ws://{self.host}:{self.port}')
+                f'ws://{self.host}:{self.port}', additional_headers=headers,
+                **self.compression.connection_options())
 
-        await self.connection.send(
-            json.dumps(Greeting(name=self.name, uuid=self.uuid).pack())
-        )
+        resuming = self.reconnect and self.counters['connects'] > 0
+        self.counters['connects'] += 1
+        self.wire_format = WireFormat.json
+        # Greeting is always sent as JSON, so that any server can read it
+        await self.frame_sizes.send(self.connection, Greeting(
+            name=self.name, uuid=self.uuid, wire_formats=list(self.wire_formats),
+            capacity=self.capacity))
+        delivered = await self._resume_point() if resuming else None
+        await self._flush(delivered)
+        # Started once the handshake is over, so that a connection dropped during it is
+        # only made again by whoever is connecting, never by the reader as well
+        self._reader = asyncio.create_task(self._read(self.connection))
+
+    async def _resume_point(self) -> Optional[int]:
+        """How many messages of the session the server has received, if it says"""
+        try:
+            frame = await asyncio.wait_for(self.connection.recv(), RESUME_TIMEOUT)
+            msg = decode(frame)
+        except asyncio.TimeoutError:
+            ws_logger.info('The server does not resume sessions')
+            return None
+        except DataclassJsonException as exc:
+            ws_logger.error(f'Dropping a malformed message: {exc}')
+            return None
+        if isinstance(msg, Greeting):
+            self._greeted(msg)
+            return msg.delivered
+        # Servers that know nothing about sessions may send commands right away
+        self._route(msg)
+        return None
+
+    async def _connect_with_backoff(self):
+        backoff = self.backoff_min
+        while not self._closing:
+            try:
+                await self._connect_once()
+                return
+            except (OSError, ConnectionClosed, asyncio.TimeoutError,
+                    websockets.exceptions.InvalidHandshake) as exc:
+                self.counters['connect_failures'] += 1
+                ws_logger.debug(f'Connecting to {self.host}:{self.port} failed: {exc}')
+                await sleep(backoff * random.uniform(0.5, 1))
+                backoff = min(backoff * 2, self.backoff_max)
+
+    async def _flush(self, delivered: Optional[int]):
+        """
+        Sends what the server has not got. Without a word from it, only what was never sent,
+        what was sent right before the connection dropped may be lost then.
+        The server counts the messages of the session anew if it does not know the session
+        """
+        while self._outbox and self._outbox[0].sent and (
+                delivered is None or self._outbox[0].index <= delivered):
+            self._outbox.popleft()
+        for outgoing in self._outbox:
+            if outgoing.sent:
+                outgoing.index = None
+                self.counters['resent'] += 1
+        self._wired = delivered or 0
+        # Whatever is sent meanwhile joins the end of the outbox
+        while (outgoing := next((o for o in self._outbox if not o.sent), None)) is not None:
+            await self._send_outgoing(outgoing)
+        self._clear_outbox_file()
+        self._online.set()
 
     async def send(self, cmd: BaseEvent):
-        print(str(cmd.pack()))
-        await self.connection.send(
-            json.dumps(cmd.pack())
-        )
+        if not self.reconnect:
+            await self.frame_sizes.send(self.connection, cmd, self.wire_format)
+            return
+        # Resent later on, by then the command may be long over
+        outgoing = Outgoing(cmd, label=label_of(cmd))
+        if len(self._outbox) >= self.outbox_size:
+            if not self._outbox.popleft().sent:
+                self.counters['dropped'] += 1
+        self._outbox.append(outgoing)
+        if not self._online.is_set():
+            self._save_outgoing(outgoing)
+            return
+        try:
+            await self._send_outgoing(outgoing)
+        except ConnectionClosed:
+            # The reader notices too and connects again, the message goes out then
+            self._save_outgoing(outgoing)
+
+    async def _send_outgoing(self, outgoing: Outgoing):
+        # Numbered before sending, in the order the messages go on the wire
+        self._wired += 1
+        outgoing.index = self._wired
+        try:
+            await self.frame_sizes.send(
+                self.connection, outgoing.msg, self.wire_format, outgoing.label)
+        except ConnectionClosed:
+            outgoing.index = None
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connected': self._online is not None and self._online.is_set(),
+            'outbox': len(self._outbox) if self._outbox is not None else 0,
+            'unsent': sum(1 for o in self._outbox or () if not o.sent),
+            **self.counters,
+            'frames': self.frame_sizes.stats(),
+        }
+
+    async def request(self, cmd: Command, on_progress: ProgressCallback = None) -> Result:
+        """
+        Send a command and wait for its final Result. Any number of requests
+        may be in flight at once, in_progress Results go to on_progress
+        """
+        future = self.pending.register(cmd, on_progress)
+        try:
+            await self.send(cmd)
+            return await future
+        finally:
+            self.pending.discard(cmd.request_id)
 
     async def recv(self) -> BaseEvent:
-        return BaseEvent.unpack(json.loads(await self.connection.recv()))
+        msg = await self._inbox.get()
+        if isinstance(msg, ConnectionClosed):
+            # Let the other readers know as well
+            self._inbox.put_nowait(msg)
+            raise msg
+        return msg
+
+    async def _read(self, connection: WebSocketClientProtocol):
+        # The only reader of the connection, it routes replies to request() callers
+        # and leaves the rest to recv()
+        try:
+            while True:
+                try:
+                    msg = decode(await connection.recv())
+                except DataclassJsonException as exc:
+                    ws_logger.error(f'Dropping a malformed message: {exc}')
+                    continue
+                if isinstance(msg, Greeting):
+                    self._greeted(msg)
+                else:
+                    self._route(msg)
+        except ConnectionClosed as exc:
+            if connection is not self.connection:
+                # Replaced already, by a close() and connect() for one
+                return
+            self._online.clear()
+            self.pending.fail_all(exc)
+            if self.reconnect and not self._closing:
+                self._reconnecting = asyncio.create_task(self._reconnect(exc))
+            else:
+                self._inbox.put_nowait(exc)
+
+    def _greeted(self, greeting: Greeting):
+        # Servers that know about wire formats reply with the one they picked
+        ws_logger.info(f'Server picked {greeting.wire_formats[0]} wire format')
+        self.wire_format = WireFormat(greeting.wire_formats[0])
+
+    def _route(self, msg: BaseEvent):
+        if not self.pending.resolve(msg):
+            self._inbox.put_nowait(msg)
+
+    async def _reconnect(self, exc: ConnectionClosed):
+        ws_logger.warning(f'Connection to the server lost: {exc}, connecting again')
+        started = time.monotonic()
+        await self._connect_with_backoff()
+        if self._closing:
+            return
+        elapsed = round(time.monotonic() - started, 3)
+        self.counters['reconnects'] += 1
+        self.counters['last_reconnect_time'] = elapsed
+        self.counters['max_reconnect_time'] = max(self.counters['max_reconnect_time'], elapsed)
+        ws_logger.info(f'Connected again in {elapsed} s')
+
+    def _save_outgoing(self, outgoing: Outgoing):
+        if self.outbox_path is None:
+            return
+        with open(self.outbox_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(outgoing.msg.pack()) + '\n')
+
+    def _clear_outbox_file(self):
+        if self.outbox_path is not None and os.path.exists(self.outbox_path):
+            os.remove(self.outbox_path)
+
+    def _load_outbox(self):
+        """Messages a previous run of the worker could not send"""
+        if self.outbox_path is None or not os.path.exists(self.outbox_path):
+            return
+        with open(self.outbox_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    msg = BaseEvent.unpack(json.loads(line))
+                except (ValueError, DataclassJsonException):
+                    continue
+                self._outbox.append(Outgoing(msg, label=label_of(msg)))
+        ws_logger.info(f'{len(self._outbox)} messages left from the previous run')
 
     async def close(self):
-        await self.connection.close()
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self.connection is not None:
+            await self.connection.close()
+        if self._reader is not None:
+            await self._reader
 
 
 if __name__ == '__main__':
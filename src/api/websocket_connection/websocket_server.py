@@ -2,18 +2,30 @@ import asyncio
 import json
 import ssl
 from dataclasses import dataclass, field
-from typing import Dict, cast, Optional, Callable, Awaitable
+from typing import Dict, cast, Optional, Callable, Awaitable, List, Tuple, Any, Set
 
 import websockets
+from websockets.exceptions import ConnectionClosed
 from websockets.legacy.server import WebSocketServerProtocol, WebSocketServer
 
-from ...utils import exec_one_task
-from ..core import Command, Pose, Vector3, Opcodes, AgentName, Transform
+from ..core import Command, Pose, Vector3, Opcodes, AgentName, Transform, Result
 from ..packable_dataclass import BaseEvent
-from ..websocket_connection.messages import Greeting
+from ..websocket_connection.compression import Compression, FrameSizes
+from ..websocket_connection.messages import Greeting, SESSION_HEADER
+from ..websocket_connection.pending_requests import PendingRequests, ProgressCallback
+from ..websocket_connection.wire_format import (
+    WireFormat, SUPPORTED_WIRE_FORMATS, choose_wire_format, decode)
 from ...exceptions import DataclassJsonException
 from ...logger import logger
 
+# Messages from workers waiting for recv(). Each worker may have as many more on their way
+# into it, a worker that sends more is not read from until there is room, so that it slows
+# down instead of the server running out of memory. Replies to request() are read past
+# the messages on their way
+SERVER_INBOX_SIZE = 1000
+# Seconds the requests sent to a worker that dropped wait for it to resume its session
+SESSION_TIMEOUT = 30
+
 ws_logger = logger.getChild('wss_srv')
 ws_logger.setLevel(ws_logger.level)
 ws_logger.handlers = []
@@ -24,6 +36,38 @@ class Worker:
     name: str
     uuid: str
     connection: WebSocketServerProtocol
+    wire_format: WireFormat = WireFormat.json
+    # Jobs it runs at once, as it says in its Greeting
+    capacity: int = 1
+    pending: PendingRequests = field(default_factory=PendingRequests)
+
+
+@dataclass
+class Session:
+    """Messages received from a worker, which it may send over several connections"""
+    id: str
+    received: int = 0
+    # Requests sent over any of its connections, their replies may come after a resume
+    pending: PendingRequests = field(default_factory=PendingRequests)
+    _expiry: Optional[asyncio.TimerHandle] = None
+    _lost: Optional[ConnectionClosed] = None
+
+    def disconnected(self, exc: ConnectionClosed, timeout: float) -> None:
+        """Fails the pending requests unless the worker resumes within the timeout"""
+        self._lost = exc
+        self._expiry = asyncio.get_running_loop().call_later(
+            timeout, self.pending.fail_all, exc)
+
+    def resumed(self) -> None:
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def end(self) -> None:
+        """The worker started over, nothing sent over the session is answered any more"""
+        if self._expiry is not None:
+            self.resumed()
+            self.pending.fail_all(self._lost)
 
 
 @dataclass
@@ -35,9 +79,30 @@ class Server:
 
     cert: str = None
     key: str = None
+    # Encodings the server agrees to send, in the order of preference
+    wire_formats: List[str] = field(default_factory=lambda: list(SUPPORTED_WIRE_FORMATS))
+    inbox_size: int = SERVER_INBOX_SIZE
+    compression: Compression = field(default_factory=Compression)
+    # When set, messages that are not replies are passed there instead of to recv(),
+    # the reader of the connection waits for it to return
+    deliver: Callable[[str, BaseEvent], Awaitable[None]] = None
+    session_timeout: float = SESSION_TIMEOUT
     ssl_context: ssl.SSLContext = field(init=False)
     workers: Dict[str, Worker] = field(init=False, default_factory=dict)
+    # Outlive the connections, so that a worker that reconnects does not send anything twice
+    sessions: Dict[str, Session] = field(init=False, default_factory=dict)
+    frame_sizes: FrameSizes = field(init=False, default_factory=FrameSizes)
     is_using_ssl: bool = field(init=False)
+    # Everything received from workers that is not a reply to request(), see recv().
+    # Each connection has a reader of its own, all of them put into the same queue
+    _inbox: asyncio.Queue = field(init=False, default=None)
+    _forwarders: Set[asyncio.Task] = field(init=False, default_factory=set)
+    counters: Dict[str, int] = field(init=False, default_factory=lambda: {
+        'received': 0,
+        'replies': 0,
+        'inbox_full': 0,
+        'resumed': 0,
+    })
 
     def __post_init__(self):
         self.is_using_ssl = self.cert is not None and self.key is not None
@@ -49,7 +114,22 @@ class Server:
             logger.info("Using plain sockets")
 
     async def send_message(self, worker_name: str, msg: BaseEvent):
-        await self.workers[worker_name].connection.send(msg.pack())
+        worker = self.workers[worker_name]
+        await self.frame_sizes.send(worker.connection, msg, worker.wire_format)
+
+    async def request(self, worker_uuid: str, cmd: Command,
+                      on_progress: ProgressCallback = None) -> Result:
+        """
+        Send a command to the worker and wait for its final Result. Any number of requests
+        may be in flight at once, in_progress Results go to on_progress
+        """
+        worker = self.workers[worker_uuid]
+        future = worker.pending.register(cmd, on_progress)
+        try:
+            await self.frame_sizes.send(worker.connection, cmd, worker.wire_format)
+            return await future
+        finally:
+            worker.pending.discard(cmd.request_id)
 
     async def connected(self, websocket: WebSocketServerProtocol):
         try:
@@ -58,46 +138,135 @@ class Server:
             logger.error('Malformed greeting. Terminating')
             return
         ws_logger.info(f'Worker {greeting.uuid}/{greeting.name} joined')
-        if self.join_callback is not None:
-            await self.join_callback(greeting.uuid, greeting.name)
 
-        self.workers[greeting.uuid] = Worker(
+        wire_format = choose_wire_format(
+            x for x in greeting.wire_formats if x in self.wire_formats)
+        session, resumed = self._session(
+            greeting.uuid, websocket.request.headers.get(SESSION_HEADER))
+        if wire_format != WireFormat.json or session is not None:
+            # Only workers that offered something besides JSON or named a session expect a reply
+            await self.frame_sizes.send(websocket, Greeting(
+                name='', uuid='', wire_formats=[wire_format],
+                session=session.id if session is not None else None,
+                delivered=session.received if resumed else None))
+
+        worker = self.workers[greeting.uuid] = Worker(
             name=greeting.name,
             uuid=greeting.uuid,
             connection=websocket,
+            wire_format=wire_format,
+            capacity=greeting.capacity,
+            pending=session.pending if session is not None else PendingRequests()
         )
-        await websocket.wait_closed()
+        # Called once the worker is there to send requests to
+        if self.join_callback is not None:
+            await self.join_callback(greeting.uuid, greeting.name)
+        await self._read(worker, session)
+        if self.workers.get(greeting.uuid) is not worker:
+            # It has connected again before this connection was found closed
+            return
         if self.leave_callback is not None:
             await self.leave_callback(greeting.uuid, greeting.name)
         _ = self.workers.pop(greeting.uuid)
         ws_logger.info(f'Worker {greeting.uuid}/{greeting.name} left')
         ws_logger.debug(f'There are {len(self.workers)} workers left')
 
+    def _session(self, uuid: str,
+                 session_id: Optional[str]) -> Tuple[Optional[Session], bool]:
+        """Session of the worker, and whether it is one that was already connected"""
+        if session_id is None:
+            return None, False
+        session = self.sessions.get(uuid)
+        if session is not None and session.id == session_id:
+            self.counters['resumed'] += 1
+            ws_logger.info(f'Worker {uuid} resumed, {session.received} messages so far')
+            session.resumed()
+            return session, True
+        if session is not None:
+            session.end()
+        session = self.sessions[uuid] = Session(session_id)
+        return session, False
+
+    async def _read(self, worker: Worker, session: Optional[Session] = None):
+        # The only reader of the connection, it routes replies to request() callers
+        # and leaves the rest to recv()
+        on_the_way = asyncio.Queue()
+        room = asyncio.Semaphore(self.inbox_size)
+        forwarder = asyncio.create_task(self._forward(worker.uuid, on_the_way, room))
+        self._forwarders.add(forwarder)
+        forwarder.add_done_callback(self._forwarders.discard)
+        try:
+            while True:
+                data = await worker.connection.recv()
+                if session is not None:
+                    session.received += 1
+                try:
+                    msg = decode(data)
+                except DataclassJsonException as exc:
+                    ws_logger.error(f'Dropping a malformed message from {worker.uuid}: {exc}')
+                    continue
+                self.counters['received'] += 1
+                if worker.pending.resolve(msg):
+                    self.counters['replies'] += 1
+                    continue
+                if self.deliver is not None:
+                    await self.deliver(worker.uuid, msg)
+                    continue
+                await room.acquire()
+                on_the_way.put_nowait(msg)
+        except ConnectionClosed as exc:
+            # A worker that closed the connection itself is not coming back
+            left = exc.rcvd is not None and bool(exc.rcvd_then_sent)
+            if session is None or left or self.sessions.get(worker.uuid) is not session:
+                worker.pending.fail_all(exc)
+            elif self.workers.get(worker.uuid) is worker:
+                # Not resumed over another connection yet
+                session.disconnected(exc, self.session_timeout)
+        finally:
+            # What is on the way still gets into the inbox
+            on_the_way.put_nowait(None)
+
+    async def _forward(self, uuid: str, on_the_way: asyncio.Queue, room: asyncio.Semaphore):
+        """Puts the messages of a worker into the inbox in the order they came, one by one"""
+        while (msg := await on_the_way.get()) is not None:
+            if self._inbox.full():
+                self.counters['inbox_full'] += 1
+            await self._inbox.put((uuid, msg))
+            room.release()
+
     async def run(self, blocking: bool = True) -> Optional[WebSocketServer]:
+        self._inbox = asyncio.Queue(self.inbox_size)
         if self.is_using_ssl:
             srv = websockets.serve(  # pylint: disable=E1101
                     self.connected, self.host, self.port, ssl=self.ssl_context,
-                    logger=ws_logger)
+                    logger=ws_logger, **self.compression.connection_options(server=True))
         else:
             srv = websockets.serve(  # pylint: disable=E1101
-                    self.connected, self.host, self.port, logger=ws_logger)
+                    self.connected, self.host, self.port, logger=ws_logger,
+                    **self.compression.connection_options(server=True))
         if blocking:
             async with srv:
                 await asyncio.Future()
         else:
             return await srv
 
-    async def recv(self) -> Dict[str, Command]:
-
-        async def worker_aware_recv(worker: Worker) -> Dict[str, Command]:
-            return {
-                worker.name: await worker.connection.recv()
-            }
-        tasks = [
-            asyncio.create_task(worker_aware_recv(worker))
-            for worker in self.workers.values()
-        ]
-        return await exec_one_task(tasks)
+    async def recv(self) -> Tuple[str, BaseEvent]:
+        """The next message from any of the workers, along with the uuid of the worker"""
+        return await self._inbox.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[str, BaseEvent]:
+        return await self.recv()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': len(self.workers),
+            'inbox': self._inbox.qsize() if self._inbox is not None else 0,
+            **self.counters,
+            'frames': self.frame_sizes.stats(),
+        }
 
 
 async def echo(_: WebSocketServerProtocol, data: BaseEvent) -> None:
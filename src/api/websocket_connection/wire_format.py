@@ -0,0 +1,207 @@
+"""
+Encodings of BaseEvents on the wire
+
+JSON is always supported and is sent in text frames. MessagePack is sent in binary
+frames, so the receiving end can tell the encoding of any frame without extra
+bookkeeping. Peers agree on what to *send* in the Greeting handshake,
+see Greeting.wire_formats
+
+MessagePack is encoded with the msgpack package if it is installed,
+a built-in pure-Python implementation of the same format is used otherwise
+"""
+from __future__ import annotations
+
+import json
+import struct
+from typing import Union, List, Any, Tuple, Iterable
+
+from strenum import StrEnum
+
+from ..packable_dataclass import BaseEvent, DataContainer
+from ...exceptions import MalformedDataclassJson
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+Frame = Union[str, bytes]
+
+
+class WireFormat(StrEnum):
+    json = 'json'
+    msgpack = 'msgpack'
+
+
+# In the order of preference
+SUPPORTED_WIRE_FORMATS = [WireFormat.msgpack, WireFormat.json]
+
+
+def choose_wire_format(offered: Iterable[str]) -> WireFormat:
+    # Offered formats are in the order of the peer preference, JSON is the fallback for everyone
+    for wire_format in offered:
+        if wire_format in SUPPORTED_WIRE_FORMATS:
+            return WireFormat(wire_format)
+    return WireFormat.json
+
+
+def encode(event: BaseEvent, wire_format: str = WireFormat.json) -> Frame:
+    if wire_format == WireFormat.msgpack:
+        return packb(event.pack())
+    return json.dumps(event.pack())
+
+
+def decode(frame: Frame) -> BaseEvent:
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        return BaseEvent.unpack(unpackb(frame))
+    return BaseEvent.unpack(json.loads(frame))
+
+
+def packb(obj: DataContainer) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    buf = bytearray()
+    _pack_into(buf, obj)
+    return bytes(buf)
+
+
+def unpackb(data: Union[bytes, bytearray, memoryview]) -> DataContainer:
+    if msgpack is not None:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    data = bytes(data)
+    try:
+        obj, offset = _unpack_from(data, 0)
+    except (struct.error, UnicodeDecodeError) as exc:
+        raise MalformedDataclassJson({'malformed_msgpack': str(exc)}) from exc
+    if offset != len(data):
+        raise MalformedDataclassJson({'trailing_bytes': len(data) - offset})
+    return obj
+
+
+def _pack_into(buf: bytearray, obj: Any) -> None:  # pylint: disable=too-many-branches
+    if obj is None:
+        buf.append(0xc0)
+    elif obj is True:
+        buf.append(0xc3)
+    elif obj is False:
+        buf.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            buf.append(obj)
+        elif -0x20 <= obj < 0:
+            buf.append(obj & 0xff)
+        elif 0 <= obj <= 0xffffffffffffffff:
+            buf += (struct.pack('>BB', 0xcc, obj) if obj <= 0xff else
+                    struct.pack('>BH', 0xcd, obj) if obj <= 0xffff else
+                    struct.pack('>BI', 0xce, obj) if obj <= 0xffffffff else
+                    struct.pack('>BQ', 0xcf, obj))
+        elif -0x8000000000000000 <= obj < 0:
+            buf += (struct.pack('>Bb', 0xd0, obj) if obj >= -0x80 else
+                    struct.pack('>Bh', 0xd1, obj) if obj >= -0x8000 else
+                    struct.pack('>Bi', 0xd2, obj) if obj >= -0x80000000 else
+                    struct.pack('>Bq', 0xd3, obj))
+        else:
+            raise OverflowError(f'Integer {obj} does not fit into 64 bits')
+    elif isinstance(obj, float):
+        buf += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        raw = obj.encode('utf-8')
+        _pack_header(buf, len(raw), 0xa0, 32, (0xd9, 0xda, 0xdb))
+        buf += raw
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        raw = bytes(obj)
+        _pack_header(buf, len(raw), None, 0, (0xc4, 0xc5, 0xc6))
+        buf += raw
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(buf, len(obj), 0x90, 16, (None, 0xdc, 0xdd))
+        for item in obj:
+            _pack_into(buf, item)
+    elif isinstance(obj, dict):
+        _pack_header(buf, len(obj), 0x80, 16, (None, 0xde, 0xdf))
+        for key, value in obj.items():
+            _pack_into(buf, key)
+            _pack_into(buf, value)
+    else:
+        raise TypeError(f'Cannot encode {type(obj)} to MessagePack')
+
+
+def _pack_header(
+        buf: bytearray, length: int, fix_code: Union[int, None], fix_limit: int,
+        codes: Tuple[Union[int, None], int, int]) -> None:
+    code8, code16, code32 = codes
+    if length < fix_limit:
+        buf.append(fix_code | length)
+    elif code8 is not None and length <= 0xff:
+        buf += struct.pack('>BB', code8, length)
+    elif length <= 0xffff:
+        buf += struct.pack('>BH', code16, length)
+    else:
+        buf += struct.pack('>BI', code32, length)
+
+
+# code: (struct format of the payload, its size)
+_FIXED_SIZE = {
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+}
+# code: (struct format of the length, its size, kind)
+_SIZED = {
+    0xd9: ('>B', 1, str), 0xda: ('>H', 2, str), 0xdb: ('>I', 4, str),
+    0xc4: ('>B', 1, bytes), 0xc5: ('>H', 2, bytes), 0xc6: ('>I', 4, bytes),
+    0xdc: ('>H', 2, list), 0xdd: ('>I', 4, list),
+    0xde: ('>H', 2, dict), 0xdf: ('>I', 4, dict),
+}
+
+
+def _unpack_from(data: bytes, offset: int) -> Tuple[Any, int]:
+    try:
+        code = data[offset]
+    except IndexError as exc:
+        raise MalformedDataclassJson({'truncated_at': offset}) from exc
+    offset += 1
+
+    if code <= 0x7f:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    if code in _FIXED_SIZE:
+        fmt, size = _FIXED_SIZE[code]
+        return struct.unpack_from(fmt, data, offset)[0], offset + size
+
+    if 0xa0 <= code <= 0xbf:
+        length, kind = code & 0x1f, str
+    elif 0x90 <= code <= 0x9f:
+        length, kind = code & 0x0f, list
+    elif 0x80 <= code <= 0x8f:
+        length, kind = code & 0x0f, dict
+    elif code in _SIZED:
+        fmt, size, kind = _SIZED[code]
+        length = struct.unpack_from(fmt, data, offset)[0]
+        offset += size
+    else:
+        raise MalformedDataclassJson({'unsupported_msgpack_code': code})
+
+    if kind in (str, bytes) and offset + length > len(data):
+        raise MalformedDataclassJson({'truncated_at': offset})
+    if kind is str:
+        return data[offset:offset + length].decode('utf-8'), offset + length
+    if kind is bytes:
+        return data[offset:offset + length], offset + length
+    if kind is list:
+        res: List[Any] = []
+        for _ in range(length):
+            item, offset = _unpack_from(data, offset)
+            res.append(item)
+        return res, offset
+    res = {}
+    for _ in range(length):
+        key, offset = _unpack_from(data, offset)
+        res[key], offset = _unpack_from(data, offset)
+    return res, offset
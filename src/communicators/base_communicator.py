@@ -1,4 +1,4 @@
-from typing import Callable, AsyncIterable, Awaitable
+from typing import Callable, AsyncIterable, Awaitable, Dict, Any
 
 from ..api.core import Command, Result, Opcodes
 
@@ -6,6 +6,9 @@ DestFun = Callable[[Command], Awaitable[Result]]
 
 
 class BaseCommunicator:
+    # Whether received commands must be executed strictly one after another
+    sequential: bool = False
+
     def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
         pass
 
@@ -20,3 +23,9 @@ class BaseCommunicator:
 
     async def send(self, msg: Result):
         pass
+
+    def completed(self, command: Command):
+        """Called once the command is over, whether it sent a Result or not"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
@@ -1,7 +1,8 @@
 import json
 from dataclasses import is_dataclass, fields, MISSING, Field
 from itertools import chain
-from typing import List, get_type_hints, Type, Dict, TypeVar, get_origin, Union, AsyncIterable
+from typing import (
+    List, get_type_hints, Type, Dict, TypeVar, get_origin, get_args, Union, AsyncIterable)
 
 from ..api.core import Command, AbstractSimCore, INCLUDE_FILE_OPCODE, Opcodes, StatusCode, Result
 from ..api.packable_dataclass import BaseEvent, DataDict, DataContainer
@@ -11,6 +12,8 @@ from ..communicators.base_communicator import BaseCommunicator, DestFun
 class CliCommunicator(BaseCommunicator):
     opcodes_raw: List[str]
     command_list = List[Command]
+    # Opcode files are written with sequential execution in mind
+    sequential = True
 
     def __init__(self, opcode_list: List[str], *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -46,15 +49,24 @@ class CliCommunicator(BaseCommunicator):
         kw_args = {}
 
         for k, v in fun_args.items():
+            if k not in opcode_args:
+                # Left out, so the default value is used
+                continue
             if is_dataclass(v) and issubclass(v, BaseEvent):
                 kw_args[k] = CliCommunicator._recreate_dataclass_from_json(v, opcode_args[k])
+            elif get_origin(v) is list and is_dataclass(get_args(v)[0]):
+                kw_args[k] = [
+                    CliCommunicator._recreate_dataclass_from_json(get_args(v)[0], item)
+                    for item in opcode_args[k]
+                ]
             else:
                 kw_args[k] = opcode_args[k]
 
         return [Command(
             opcode=Opcodes(opcode_name),
             args=[],
-            kwargs=kw_args
+            kwargs=kw_args,
+            slot=opcode_args.get('slot')
         )]
 
     T = TypeVar('T')
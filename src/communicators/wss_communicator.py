@@ -1,12 +1,22 @@
 import asyncio
-from typing import Optional, AsyncIterable
+from typing import Optional, AsyncIterable, Dict, Any
+from uuid import uuid4
+
+from websockets.exceptions import ConnectionClosed
 
 from ..api.core import Result, Command
-from ..api.websocket_connection.websocket_client import Client
+from ..api.packable_dataclass import BaseEvent
+from ..api.websocket_connection.compression import Compression
+from ..api.websocket_connection.websocket_client import Client, CLIENT_OUTBOX_SIZE
 from ..api.websocket_connection.websocket_server import Server
+from ..api.websocket_connection.wire_format import WireFormat
 from ..communicators.base_communicator import BaseCommunicator
 from ..logger import logger
-from ..utils import exec_one_task
+from ..utils import FairMerge
+
+# Commands read from each connection but not taken for execution yet,
+# a connection is not read from while it has that many
+RECEIVE_BUFFER_SIZE = 100
 
 com_logger = logger.getChild('wss_com')
 com_logger.setLevel(logger.level)
@@ -21,6 +31,14 @@ class WssCommunicator(BaseCommunicator):
 
     This communicator works as a client by default, but can also launch its own
     server if needed e.g. for CLI connections from the local network
+
+    Every connection is read by a task of its own into a FairMerge, so the server
+    and local connections take turns and none of them is read ahead by more than
+    RECEIVE_BUFFER_SIZE commands. Results of commands that came from a local
+    connection go back to that connection, the rest go to the server
+
+    The connection to the server is made again whenever it drops, Results sent
+    meanwhile wait in the outbox of the client, see Client
     """
     wss_srv: Optional[Server]
     wss_client: Client
@@ -29,14 +47,21 @@ class WssCommunicator(BaseCommunicator):
             self, remote_host: str, remote_port: int,
             name: str, uuid: str, cert: str,
             is_local_wss_enabled: bool,
-            *args, local_port: int = None, local_host: str = None, **kwargs):
+            *args, local_port: int = None, local_host: str = None,
+            wire_format: str = WireFormat.json, capacity: int = 1,
+            outbox_size: int = CLIENT_OUTBOX_SIZE, outbox_path: Optional[str] = None,
+            compression: Optional[Compression] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        compression = compression or Compression()
 
         if is_local_wss_enabled:
             com_logger.info('Running communicator with a local server')
             self.wss_srv = Server(
                 host=local_host,
                 port=local_port,
+                deliver=self._deliver_local,
+                leave_callback=self._local_left,
+                compression=compression,
             )
         else:
             self.wss_srv = None
@@ -47,31 +72,73 @@ class WssCommunicator(BaseCommunicator):
             port=remote_port,
             name=name,
             uuid=uuid,
-            cert=cert
+            cert=cert,
+            # JSON is always offered as the last resort for older servers
+            wire_formats=list(dict.fromkeys([wire_format, WireFormat.json])),
+            capacity=capacity,
+            reconnect=True,
+            outbox_size=outbox_size,
+            outbox_path=outbox_path,
+            compression=compression
         )
+        self._merged: Optional[FairMerge[Optional[str], BaseEvent]] = None
+        self._remote_reader: Optional[asyncio.Task] = None
+        # request_id of local commands -> uuid of the local connection they came from
+        self._local_requests: Dict[str, str] = {}
 
     async def setup(self):
+        self._merged = FairMerge(RECEIVE_BUFFER_SIZE)
         await self.wss_client.connect()
+        self._remote_reader = asyncio.create_task(self._read_remote())
 
     async def run(self):
         if self.wss_srv is not None:
             await self.wss_srv.run(blocking=False)
 
     async def receive(self) -> AsyncIterable[Command]:
-        if self.wss_srv is None:
-            while True:
-                yield await self.wss_client.recv()
-        else:
-            while True:
-                tasks = [
-                    asyncio.create_task(self.wss_client.recv()),
-                    asyncio.create_task(self.wss_srv.recv())
-                ]
-                yield await exec_one_task(tasks)
+        async for source, command in self._merged:
+            if not isinstance(command, Command):
+                com_logger.warning(f'Dropping {type(command).__name__} from {source}')
+                continue
+            if source is not None:
+                if command.request_id is None:
+                    command.request_id = uuid4().hex
+                self._local_requests[command.request_id] = source
+            yield command
 
     async def send(self, msg: Result):
+        local = self._local_requests.get(msg.request_id)
+        if local is not None:
+            try:
+                await self.wss_srv.send_message(local, msg)
+            except (KeyError, ConnectionClosed):
+                com_logger.warning(f'Local connection {local} is gone, dropping {msg}')
+            return
+
         if self.wss_client.connection is None:
             com_logger.warning(f'A message to server sent but there is no server: {msg}')
             return
 
         await self.wss_client.send(msg)
+
+    def completed(self, command: Command):
+        # Commands that return no Result are over too
+        self._local_requests.pop(command.request_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'server': self.wss_client.stats()}
+
+    async def _read_remote(self):
+        try:
+            while True:
+                await self._merged.put(None, await self.wss_client.recv())
+        except ConnectionClosed as exc:
+            self._merged.fail(exc)
+
+    async def _deliver_local(self, uuid: str, msg: BaseEvent):
+        await self._merged.put(uuid, msg)
+
+    async def _local_left(self, uuid: str, _: str):
+        self._merged.discard(uuid)
+        for request_id in [r for r, source in self._local_requests.items() if source == uuid]:
+            del self._local_requests[request_id]
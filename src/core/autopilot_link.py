@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, Awaitable, Any, Optional, Dict, AsyncIterator, Union, Hashable
+
+from ..api.core import Result, StatusCode, current_request_id
+from ..logger import logger
+
+# How often an idle link is checked for heartbeats, in seconds
+AUTOPILOT_CHECK_PERIOD = 5
+# The link is dropped and made again after that many checks in a row without a heartbeat
+AUTOPILOT_MISSED_HEARTBEATS = 3
+# Delay between failed connection attempts, doubling up to the max, with jitter
+AUTOPILOT_BACKOFF_MIN = 0.5
+AUTOPILOT_BACKOFF_MAX = 10
+# Threads for blocking autopilot_tools calls, calls to the same vehicle never overlap though
+AUTOPILOT_IO_WORKERS = 2
+# How often to report that a blocking autopilot call is still running, in seconds
+AUTOPILOT_PROGRESS_PERIOD = 2
+
+link_logger = logger.getChild('autopilot_link')
+link_logger.setLevel(logger.level)
+link_logger.handlers = []
+
+
+class UdpPortMixin:
+    """
+    Mixin for autopilot_tools.vehicle.Vehicle that makes connect(device='udp') listen on
+    the given UDP port, Vehicle connects to the default one only. The path Vehicle.connect
+    chose is replaced in _connect_once, which opens it. If the installed autopilot_tools
+    connects some other way, this fails instead of connecting to the autopilot of another slot
+    """
+
+    def __init__(self, *args, udp_port: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.udp_path = f'udpin:localhost:{udp_port}'
+        if not hasattr(super(), '_connect_once'):
+            raise RuntimeError(f'This autopilot_tools can not connect to {self.udp_path}')
+
+    def connect(self, device: str = 'serial') -> None:
+        super().connect(device)
+        if device == 'udp' and self.device_path != self.udp_path:
+            raise RuntimeError(
+                f'autopilot_tools connected to {self.device_path} instead of {self.udp_path}')
+
+    def _connect_once(self) -> None:
+        if self.device_path.startswith('udpin:'):
+            self.device_path = self.udp_path
+        super()._connect_once()
+
+
+class AutopilotIO:
+    """
+    Blocking autopilot_tools calls, run in a thread pool.
+    Calls to the same device are executed one at a time, in the order they were made.
+    A call keeps the device until it returns in its thread, even if the caller is cancelled.
+    While the call made on behalf of a command runs, in_progress Results are sent
+    every progress_period seconds
+    """
+
+    def __init__(self, send: Callable[[Result], Awaitable[None]],
+                 workers: int = AUTOPILOT_IO_WORKERS,
+                 progress_period: float = AUTOPILOT_PROGRESS_PERIOD):
+        self.send = send
+        self.progress_period = progress_period
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='autopilot_io')
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    async def run(self, device: Hashable, description: str, fun: Callable[..., Any],
+                  *args, **kwargs) -> Any:
+        lock = self._locks.setdefault(device, asyncio.Lock())
+        await lock.acquire()
+        try:
+            started = time.monotonic()
+            # Context goes along, so that records logged in the thread keep the request_id
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(contextvars.copy_context().run, fun, *args, **kwargs))
+        except BaseException:
+            lock.release()
+            raise
+        # Released by the call, not by the caller, the thread can not be stopped
+        future.add_done_callback(lambda _: lock.release())
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=self.progress_period)
+            if done:
+                return future.result()
+            if current_request_id.get() is None:
+                # Made in the background, e.g. by AutopilotLink, nobody waits for it
+                continue
+            await self.send(Result(
+                status=StatusCode.in_progress,
+                message={
+                    'autopilot_io': description,
+                    'elapsed': round(time.monotonic() - started, 1)
+                },
+                request_id=current_request_id.get()
+            ))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AutopilotLink:
+    """
+    Connection to the autopilot, made and kept in the background.
+
+    start() begins connecting, retrying with backoff until it succeeds, so by the time
+    an opcode needs the vehicle it is usually there already. Opcodes get it through use(),
+    which waits for the connection if it is still being made. While the link is not
+    in use, it is checked for heartbeats every AUTOPILOT_CHECK_PERIOD seconds and
+    made again once too many are missed. Checks never run while an opcode uses the link,
+    the opcode talks to the vehicle then, and a check would steal its messages
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[Any]],
+                 heartbeat: Callable[[Any], Awaitable[bool]],
+                 close: Callable[[Any], None],
+                 check_period: float = AUTOPILOT_CHECK_PERIOD,
+                 missed_heartbeats: int = AUTOPILOT_MISSED_HEARTBEATS):
+        self.connect = connect
+        self.heartbeat = heartbeat
+        self.close = close
+        self.check_period = check_period
+        self.missed_heartbeats = missed_heartbeats
+
+        self.vehicle: Optional[Any] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_use = 0
+        self._missed = 0
+        self._last_error: Optional[str] = None
+        self.counters = {
+            'connects': 0,
+            'reconnects': 0,
+            'connect_failures': 0,
+            'heartbeats': 0,
+            'missed_heartbeats': 0,
+        }
+        self.connect_latency: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def ready(self) -> Any:
+        """The connected vehicle, connecting first if nobody asked for it before"""
+        self.start()
+        await self._ready.wait()
+        return self.vehicle
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[Any]:
+        self._in_use += 1
+        try:
+            yield await self.ready()
+        finally:
+            self._in_use -= 1
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._drop()
+
+    def stats(self) -> Dict[str, Union[int, float, str, bool, None]]:
+        return {
+            'connected': self.vehicle is not None,
+            'running': self.running,
+            'in_use': self._in_use,
+            'connect_latency': self.connect_latency,
+            'last_error': self._last_error,
+            **self.counters,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self._connect()
+            while self._missed < self.missed_heartbeats:
+                await asyncio.sleep(self.check_period)
+                if self._in_use:
+                    continue
+                if await self._check():
+                    self._missed = 0
+                else:
+                    self._missed += 1
+            link_logger.warning(f'No heartbeat in {self._missed} checks, connecting again')
+            self.counters['reconnects'] += 1
+            self._drop()
+
+    async def _connect(self) -> None:
+        backoff = AUTOPILOT_BACKOFF_MIN
+        started = time.monotonic()
+        while True:
+            try:
+                self.vehicle = await self.connect()
+                break
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.counters['connect_failures'] += 1
+                self._last_error = f'{type(exc)}: {exc}'
+                link_logger.debug(f'Connecting to the autopilot failed: {self._last_error}')
+                await asyncio.sleep(backoff * random.uniform(0.5, 1))
+                backoff = min(backoff * 2, AUTOPILOT_BACKOFF_MAX)
+        self.connect_latency = round(time.monotonic() - started, 3)
+        self.counters['connects'] += 1
+        self._missed = 0
+        self._ready.set()
+
+    async def _check(self) -> bool:
+        try:
+            alive = await self.heartbeat(self.vehicle)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self._last_error = f'{type(exc)}: {exc}'
+            alive = False
+        self.counters['heartbeats' if alive else 'missed_heartbeats'] += 1
+        return alive
+
+    def _drop(self) -> None:
+        if self._ready is not None:
+            self._ready.clear()
+        if self.vehicle is not None:
+            try:
+                self.close(self.vehicle)
+            except Exception:  # pylint: disable=broad-exception-caught
+                pass
+        self.vehicle = None
@@ -0,0 +1,105 @@
+import asyncio
+import os
+from typing import Type, Optional, List, Union
+
+from ..api.core import AbstractSimCore, Result, Pose, ModeEnum, StatusCode, AgentSpawn
+from ..communicators.base_communicator import BaseCommunicator
+from ..logger import logger
+from .log_forwarding import WssLoggerHandler
+from .opcode_decorators import log_opcodes, catch_errors_to_result
+
+
+class DummySimCore(AbstractSimCore):
+    communicator: BaseCommunicator
+
+    def __init__(self, communicator: Type[BaseCommunicator], *args,
+                 opcode_delay: float = 0, **kwargs):
+        super().__init__(communicator, *args, **kwargs)
+        self.opcode_delay = opcode_delay
+        self.ws_logger = logger.getChild('sim_core')
+        self.ws_logger.setLevel(logger.level)
+        self.ws_logger.handlers = []
+
+        self.log_handler = WssLoggerHandler(
+            level=self.ws_logger.level,
+            send=self.communicator.send
+        )
+        self.ws_logger.handlers.append(self.log_handler)
+
+    async def cleanup(self):
+        await self.log_handler.stop()
+
+    async def _done(self) -> Result:
+        # As if the opcode took a while
+        await asyncio.sleep(self.opcode_delay)
+        return Result(status=StatusCode.ok)
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def start_sim(self, mode: ModeEnum, start_3d_sim: bool = True) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def stop_sim(self) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def load_scene(self, scene_name: str) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def preload_scenes(self, scenes: Optional[List[str]] = None) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def spawn_agent(self, agent_name: str, position: Pose) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def spawn_agents(self, agents: List[AgentSpawn]) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def remove_agent(self, agent_id: str) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def configure_autopilot(
+            self, firmware: Union[str, os.PathLike, None],
+            config: List[Union[str, os.PathLike]], force_flash: bool = False,
+            incremental: bool = False) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def upload_mission(self, mission: Union[str, os.PathLike]) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def reboot_autopilot(self) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    @log_opcodes
+    async def start_mission(self) -> Result:
+        return await self._done()
+
+    @log_opcodes
+    async def abort_mission(self) -> Result:
+        return await self._done()
+
+    async def get_sim3d_stats(self) -> Result:
+        return await self._done()
+
+    @catch_errors_to_result
+    async def get_logs(self, source: str, start: Optional[int] = None, end: Optional[int] = None,
+                       tail: Optional[int] = None, pattern: Optional[str] = None) -> Result:
+        return await self._done()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict, Union, NamedTuple
+
+
+class FirmwareImage(NamedTuple):
+    sha256: str
+    # Git hash the image was built from, .px4 files carry it
+    git_hash: Optional[str]
+
+    @classmethod
+    def of(cls, firmware: Union[str, os.PathLike]) -> FirmwareImage:
+        """Fingerprint of a firmware file, or of firmware passed inline"""
+        if os.path.exists(firmware):
+            with open(firmware, 'rb') as f:
+                content = f.read()
+        else:
+            content = str(firmware).encode()
+        try:
+            git_hash = json.loads(content).get('git_hash')
+        except (ValueError, AttributeError):
+            git_hash = None
+        return cls(hashlib.sha256(content).hexdigest(), git_hash)
+
+
+class BoardVersion(NamedTuple):
+    """What the board says about itself in AUTOPILOT_VERSION"""
+    uid: str
+    # Start of the git hash of the firmware it runs
+    git_hash: Optional[str]
+
+
+@dataclass
+class FlashedImage:
+    image: FirmwareImage
+    flashed_at: float
+    duration: float
+
+
+class FirmwareCache:
+    """
+    The last image flashed to each board. Boards are told apart by their uid when they
+    report one, by the device they are connected through otherwise. An image is
+    considered flashed if it is the last one flashed to the board, and the git hash
+    the board reports, if it does, matches the one of the image
+    """
+
+    def __init__(self):
+        self.images: Dict[str, FlashedImage] = {}
+        self.counters = {
+            'flashed': 0,
+            'skipped': 0,
+        }
+
+    def is_flashed(self, board: str, image: FirmwareImage,
+                   version: Optional[BoardVersion] = None) -> bool:
+        flashed = self.images.get(board)
+        if flashed is None or flashed.image.sha256 != image.sha256:
+            return False
+        if version is not None and version.git_hash and image.git_hash:
+            # The board may have been flashed by someone else since
+            return image.git_hash.startswith(version.git_hash)
+        return True
+
+    def record(self, board: str, image: FirmwareImage, duration: float) -> None:
+        self.images[board] = FlashedImage(image, time.time(), duration)
+        self.counters['flashed'] += 1
+
+    def skipped(self) -> None:
+        self.counters['skipped'] += 1
+
+    def forget(self, board: str) -> None:
+        self.images.pop(board, None)
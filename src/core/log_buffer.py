@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import os
+import re
+from array import array
+from typing import List, Tuple, Optional, Dict, Iterator, BinaryIO
+
+from .process_monitor import LogLine
+
+# Bytes of text and number of lines kept in memory, whichever runs out first
+LOG_BUFFER_SIZE = 4 * 1024 * 1024
+LOG_BUFFER_LINES = 100_000
+# Size of a spill file before it is rotated, and how many rotated files to keep
+LOG_SPILL_FILE_SIZE = 64 * 1024 * 1024
+LOG_SPILL_BACKUPS = 3
+
+
+class LogSpillFile:
+    """Append-only log file on disk, rotated like logging.handlers.RotatingFileHandler does"""
+
+    def __init__(self, path: str, max_bytes: int = LOG_SPILL_FILE_SIZE,
+                 backups: int = LOG_SPILL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+
+    def write(self, line: LogLine) -> None:
+        if self._file is None:
+            self._file = open(self.path, 'ab')  # pylint: disable=consider-using-with
+            self._size = self._file.tell()
+        raw = line.format().encode(errors='replace') + b'\n'
+        if self._size and self._size + len(raw) > self.max_bytes:
+            self._rotate()
+        self._file.write(raw)
+        self._size += len(raw)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(src := f'{self.path}.{n}'):
+                os.replace(src, f'{self.path}.{n + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')  # pylint: disable=consider-using-with
+        self._size = 0
+
+
+class LogRingBuffer:
+    """
+    Last lines of a log, stored compactly: text of all lines shares one circular bytearray,
+    and the line index is kept in fixed-size typed arrays, about 21 bytes per line.
+    Oldest lines are evicted when either of them is full.
+
+    Every line gets an absolute number that never changes, so clients can page through
+    the log with range() while it is being written. Queries only decode the lines they return.
+    Lines can also be spilled to a rotating file on disk, to keep what is evicted
+    """
+
+    def __init__(self, capacity: int = LOG_BUFFER_SIZE, max_lines: int = LOG_BUFFER_LINES,
+                 spill: Optional[LogSpillFile] = None):
+        self.capacity = capacity
+        self.max_lines = max_lines
+        self.spill = spill
+        self._data = bytearray(capacity)
+        self._offsets = array('Q', [0]) * max_lines
+        self._lengths = array('I', [0]) * max_lines
+        self._timestamps = array('d', [0.0]) * max_lines
+        self._source_ids = array('B', [0]) * max_lines
+        self._sources: List[str] = []
+        self._source_ids_by_name: Dict[str, int] = {}
+        self._written = 0
+        self._first = 0
+        self._next = 0
+
+    @property
+    def first_line(self) -> int:
+        return self._first
+
+    @property
+    def next_line(self) -> int:
+        return self._next
+
+    def __len__(self) -> int:
+        return self._next - self._first
+
+    def __iter__(self) -> Iterator[LogLine]:
+        for n in range(self._first, self._next):
+            yield self._read(n)
+
+    def append(self, line: LogLine) -> None:
+        raw = line.text.encode(errors='replace')[:self.capacity]
+        start = self._written % self.capacity
+        end = start + len(raw)
+        if end <= self.capacity:
+            self._data[start:end] = raw
+        else:
+            split = self.capacity - start
+            self._data[start:] = raw[:split]
+            self._data[:end - self.capacity] = raw[split:]
+
+        if len(self) == self.max_lines:
+            self._first += 1
+        slot = self._next % self.max_lines
+        self._offsets[slot] = self._written
+        self._lengths[slot] = len(raw)
+        self._timestamps[slot] = line.timestamp
+        self._source_ids[slot] = self._source_id(line.source)
+        self._next += 1
+        self._written += len(raw)
+
+        # Lines whose text was just overwritten
+        while (self._first < self._next
+               and self._offsets[self._first % self.max_lines] < self._written - self.capacity):
+            self._first += 1
+
+        if self.spill is not None:
+            self.spill.write(line)
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None
+              ) -> List[Tuple[int, LogLine]]:
+        start = self._first if start is None else max(start, self._first)
+        end = self._next if end is None else min(end, self._next)
+        return [(n, self._read(n)) for n in range(start, end)]
+
+    def tail(self, count: int) -> List[Tuple[int, LogLine]]:
+        return self.range(self._next - count)
+
+    def grep(self, pattern: str, limit: Optional[int] = None) -> List[Tuple[int, LogLine]]:
+        """The last `limit` lines matching the regular expression, oldest first"""
+        regex = re.compile(pattern.encode())
+        res = []
+        for n in range(self._next - 1, self._first - 1, -1):
+            if limit is not None and len(res) >= limit:
+                break
+            if regex.search(self._read_raw(n)):
+                res.append((n, self._read(n)))
+        res.reverse()
+        return res
+
+    def _source_id(self, source: str) -> int:
+        if (source_id := self._source_ids_by_name.get(source)) is None:
+            source_id = self._source_ids_by_name[source] = len(self._sources)
+            self._sources.append(source)
+        return source_id
+
+    def _read_raw(self, n: int) -> bytes:
+        slot = n % self.max_lines
+        start = self._offsets[slot] % self.capacity
+        end = start + self._lengths[slot]
+        if end <= self.capacity:
+            return bytes(self._data[start:end])
+        return bytes(self._data[start:]) + bytes(self._data[:end - self.capacity])
+
+    def _read(self, n: int) -> LogLine:
+        slot = n % self.max_lines
+        return LogLine(
+            timestamp=self._timestamps[slot],
+            source=self._sources[self._source_ids[slot]],
+            text=self._read_raw(n).decode(errors='replace'))
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from enum import auto
+from logging import Handler, LogRecord
+from typing import Callable, Awaitable, Deque, Tuple, Optional, Union, Dict, List
+
+from strenum import StrEnum
+
+from ..api.core import Result, StatusCode, current_request_id, current_opcode
+
+# Records waiting to be sent, what happens beyond that is decided by the OverflowPolicy
+LOG_QUEUE_SIZE = 5000
+# A batch is sent once it has that many records or characters, or once LOG_FLUSH_INTERVAL passes
+LOG_BATCH_SIZE = 200
+LOG_BATCH_CHARS = 64 * 1024
+LOG_FLUSH_INTERVAL = 0.25
+# With the sample policy, only every n-th record is kept once the queue is half full
+LOG_SAMPLE_EVERY = 10
+
+
+class OverflowPolicy(StrEnum):
+    drop_newest = auto()
+    drop_oldest = auto()
+    sample = auto()
+
+
+class WssLoggerHandler(Handler):
+    """
+    Forwards log records to the communicator in batches.
+
+    emit only puts a record into a bounded queue, so it is cheap and safe to call from
+    any thread. A single flusher task running on the event loop packs queued records
+    into in_progress Results, one per request_id and opcode, with the messages under
+    'logged_messages'. The opcode is the one the record was logged under, the Result is
+    sent with it set, so that the bytes it takes are counted for that opcode.
+    'logged_message' has them joined into a single string, for servers that only know it.
+    The flusher is started by the first record emitted from the event loop thread.
+
+    When the link is slow, the queue fills up and the overflow policy kicks in.
+    Every batch carries the number of records lost since the previous one under 'dropped'
+    """
+    send: Callable[[Result], Awaitable[None]]
+
+    def __init__(
+            self, level: Union[str, int],
+            send: Callable[[Result], Awaitable[None]],
+            queue_size: int = LOG_QUEUE_SIZE,
+            overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+            batch_size: int = LOG_BATCH_SIZE,
+            batch_chars: int = LOG_BATCH_CHARS,
+            flush_interval: float = LOG_FLUSH_INTERVAL,
+            sample_every: int = LOG_SAMPLE_EVERY):
+        super().__init__(level)
+        self.send = send
+        self.queue_size = queue_size
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.batch_size = batch_size
+        self.batch_chars = batch_chars
+        self.flush_interval = flush_interval
+        self.sample_every = sample_every
+
+        self.counters = {
+            'received': 0,
+            'sent': 0,
+            'batches': 0,
+            'dropped': 0,
+            'sampled_out': 0,
+            'send_failed': 0,
+        }
+        # request_id, opcode and message of each record
+        self._records: Deque[Tuple[Optional[str], Optional[str], str]] = deque()
+        self._queued_chars = 0
+        self._lost_unreported = 0
+        self._sample_counter = 0
+        self._records_lock = threading.Lock()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def emit(self, record: LogRecord):
+        message = record.getMessage()
+        with self._records_lock:
+            self.counters['received'] += 1
+            if not self._admit():
+                self._lost_unreported += 1
+                return
+            self._records.append((current_request_id.get(), current_opcode.get(), message))
+            self._queued_chars += len(message)
+            is_batch_full = (len(self._records) >= self.batch_size
+                             or self._queued_chars >= self.batch_chars)
+
+        self._ensure_flusher()
+        if is_batch_full:
+            self._wake_flusher()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, 'queued': len(self._records)}
+
+    async def flush_pending(self) -> None:
+        while (batch := self._take_batch()) is not None:
+            records, lost = batch
+            for (request_id, opcode), messages in WssLoggerHandler._group(records):
+                token = current_opcode.set(opcode)
+                try:
+                    await self.send(Result(
+                        status=StatusCode.in_progress,
+                        message={
+                            'logged_messages': messages,
+                            'logged_message': '\n'.join(messages),
+                            'dropped': lost,
+                        },
+                        request_id=request_id
+                    ))
+                    self.counters['sent'] += len(messages)
+                    self.counters['batches'] += 1
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # Can't log it, that would feed the very same handler
+                    self.counters['send_failed'] += len(messages)
+                finally:
+                    current_opcode.reset(token)
+                lost = 0
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            # Not cancelled, so that a batch it has taken is sent
+            self._stopping = True
+            self._wake_flusher()
+            await self._flusher
+            self._flusher = None
+            self._stopping = False
+        await self.flush_pending()
+
+    def _admit(self) -> bool:
+        queued = len(self._records)
+        if self.overflow_policy == OverflowPolicy.sample and queued >= self.queue_size // 2:
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_every:
+                self.counters['sampled_out'] += 1
+                return False
+        if queued < self.queue_size:
+            return True
+        if self.overflow_policy == OverflowPolicy.drop_oldest:
+            *_, message = self._records.popleft()
+            self._queued_chars -= len(message)
+            self.counters['dropped'] += 1
+            self._lost_unreported += 1
+            return True
+        self.counters['dropped'] += 1
+        return False
+
+    def _take_batch(
+            self) -> Optional[Tuple[List[Tuple[Optional[str], Optional[str], str]], int]]:
+        with self._records_lock:
+            if not self._records:
+                return None
+            records = []
+            chars = 0
+            while self._records and len(records) < self.batch_size and chars < self.batch_chars:
+                record = self._records.popleft()
+                records.append(record)
+                chars += len(record[-1])
+            self._queued_chars -= chars
+            lost, self._lost_unreported = self._lost_unreported, 0
+            return records, lost
+
+    @staticmethod
+    def _group(records: List[Tuple[Optional[str], Optional[str], str]]
+               ) -> List[Tuple[Tuple[Optional[str], Optional[str]], List[str]]]:
+        groups: Dict[Tuple[Optional[str], Optional[str]], List[str]] = {}
+        for request_id, opcode, message in records:
+            groups.setdefault((request_id, opcode), []).append(message)
+        return list(groups.items())
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on the event loop thread, the records wait for the flusher to start
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        self._flusher = loop.create_task(self._flush_forever())
+
+    def _wake_flusher(self):
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _flush_forever(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_pending()
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional, Dict, Union, NamedTuple, Any
+
+# Parsed plans kept around, plans are small, a test campaign rarely uses more
+MISSION_PLAN_CACHE_SIZE = 64
+
+
+class MissionPlan(NamedTuple):
+    # Of the plan as parsed, so the same plan written differently is the same mission
+    sha256: str
+    # Items per mission type, as the autopilot will get them
+    items: Dict[str, int]
+
+
+def read_mission(mission: Union[str, os.PathLike]) -> bytes:
+    """Content of a mission file, or of a mission passed inline"""
+    if os.path.exists(mission):
+        with open(mission, 'rb') as f:
+            return f.read()
+    return str(mission).encode()
+
+
+def parse_mission(content: bytes) -> MissionPlan:
+    """Raises ValueError if the content is not a QGroundControl plan"""
+    try:
+        plan = json.loads(content)
+        items = {
+            'mission': len(plan['mission']['items']),
+            'geofence': len(plan['geoFence']['circles']) + len(plan['geoFence']['polygons']),
+            'rally': len(plan['rallyPoints']['points']),
+        }
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f'not a mission plan, {type(exc).__name__}: {exc}') from exc
+    canonical = json.dumps(plan, sort_keys=True, separators=(',', ':')).encode()
+    return MissionPlan(hashlib.sha256(canonical).hexdigest(), items)
+
+
+class MissionCache:
+    """
+    Which mission the vehicle has, so the same one is not uploaded again.
+    Plans are parsed once, the last MISSION_PLAN_CACHE_SIZE of them are kept by
+    the hash of their content. The loaded mission is forgotten whenever the vehicle
+    may have lost it or got another one: on reconnect, reboot or a failed upload
+    """
+
+    def __init__(self, max_plans: int = MISSION_PLAN_CACHE_SIZE):
+        self.max_plans = max_plans
+        self.plans: OrderedDict[str, MissionPlan] = OrderedDict()
+        self.loaded: Optional[MissionPlan] = None
+        self.counters = {
+            'uploaded': 0,
+            'skipped': 0,
+            'parsed': 0,
+            'plan_hits': 0,
+        }
+
+    def plan(self, content: bytes) -> MissionPlan:
+        key = hashlib.sha256(content).hexdigest()
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.plans.move_to_end(key)
+            self.counters['plan_hits'] += 1
+            return plan
+        plan = self.plans[key] = parse_mission(content)
+        self.counters['parsed'] += 1
+        if len(self.plans) > self.max_plans:
+            self.plans.popitem(last=False)
+        return plan
+
+    def is_loaded(self, plan: MissionPlan) -> bool:
+        return self.loaded is not None and self.loaded.sha256 == plan.sha256
+
+    def record(self, plan: MissionPlan) -> None:
+        self.loaded = plan
+        self.counters['uploaded'] += 1
+
+    def skipped(self) -> None:
+        self.counters['skipped'] += 1
+
+    def forget(self) -> None:
+        self.loaded = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'loaded': self.loaded.sha256 if self.loaded is not None else None,
+            'plans': len(self.plans),
+            **self.counters,
+        }
@@ -0,0 +1,27 @@
+from typing import Callable, Coroutine, Any
+
+from ..api.core import AbstractSimCore, Result, StatusCode
+
+
+def log_opcodes(
+        fun: Callable[..., Coroutine[Any, Any, Result]]
+        ) -> Callable[..., Coroutine[Any, Any, Result]]:
+    async def wrapper(instance: AbstractSimCore, *args, **kwargs):
+        instance.ws_logger.info(f'Opcode {fun.__name__} called with arguments: {args}, {kwargs}')
+        return await fun(instance, *args, **kwargs)
+    return wrapper
+
+
+def catch_errors_to_result(
+        fun: Callable[..., Coroutine[Any, Any, Result]]
+        ) -> Callable[..., Coroutine[Any, Any, Result]]:
+    async def wrapper(instance: AbstractSimCore, *args, **kwargs):
+        try:
+            return await fun(instance, *args, **kwargs)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            instance.ws_logger.warning(f'{type(exc)}: {str(exc)}')
+            return Result(
+                status=StatusCode.error,
+                message={'exception': f'{type(exc)}: {str(exc)}'}
+            )
+    return wrapper
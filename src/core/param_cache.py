@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import Dict, Union, Iterable, Optional
+
+ParamValue = Union[int, float]
+
+# Parameters PX4 reads only at boot, changing one of them takes a reboot
+REBOOT_REQUIRED_PARAMS = (
+    'SYS_*',
+    'UAVCAN_*',
+    'CANNODE_*',
+    'SER_*',
+    '*_CONFIG',
+    '*_BAUD',
+)
+
+
+def same_value(a: Optional[ParamValue], b: ParamValue) -> bool:
+    """Values are compared as the autopilot stores them, floats in single precision"""
+    if a is None:
+        return False
+    if isinstance(a, int) and isinstance(b, int):
+        return a == b
+    return struct.pack('<f', a) == struct.pack('<f', b)
+
+
+def diff_params(current: Dict[str, ParamValue],
+                target: Dict[str, ParamValue]) -> Dict[str, ParamValue]:
+    """Parameters to set to turn current into target"""
+    return {name: value for name, value in target.items()
+            if not same_value(current.get(name), value)}
+
+
+def needs_reboot(names: Iterable[str], patterns=REBOOT_REQUIRED_PARAMS) -> bool:
+    return any(fnmatchcase(name, pattern) for name in names for pattern in patterns)
+
+
+@dataclass
+class BoardParams:
+    # Right after a reset to default
+    defaults: Dict[str, ParamValue]
+    # What the board has now
+    current: Dict[str, ParamValue] = field(default_factory=dict)
+
+    def target(self, requested: Dict[str, ParamValue]) -> Dict[str, ParamValue]:
+        """
+        What the board would have after a reset to default and applying requested,
+        so that parameters set by an earlier configuration go back to their defaults
+        """
+        changed_before = diff_params(self.defaults, self.current)
+        return {
+            **{name: self.defaults[name] for name in changed_before if name in self.defaults},
+            **requested,
+        }
+
+
+class ParamCache:
+    """
+    Parameter snapshots of each board, see BoardParams. A board without one
+    has to be reset to default and read first. A board is forgotten once
+    its parameters may have changed behind our back, e.g. when it is flashed
+    or setting a parameter fails
+    """
+
+    def __init__(self):
+        self.boards: Dict[str, BoardParams] = {}
+
+    def get(self, board: str) -> Optional[BoardParams]:
+        return self.boards.get(board)
+
+    def reset(self, board: str, defaults: Dict[str, ParamValue]) -> BoardParams:
+        self.boards[board] = params = BoardParams(defaults, dict(defaults))
+        return params
+
+    def forget(self, board: str) -> None:
+        self.boards.pop(board, None)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import time
+from asyncio.subprocess import Process
+from typing import Dict, Union, Optional
+
+# Time a process group gets to exit after SIGTERM before it is killed, in seconds
+STOP_GRACE_PERIOD = 5
+# Time the whole teardown may take, in seconds
+STOP_DEADLINE = 15
+# Time to wait for a process to be reaped after SIGKILL
+KILL_WAIT = 1
+
+
+def signal_group(proc: Process, sig: signal.Signals) -> None:
+    """
+    Signal the process group led by proc. The process has to be started
+    with start_new_session=True, otherwise that would be the group of the worker itself
+    """
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def stop_process_group(
+        proc: Optional[Process],
+        grace_period: float = STOP_GRACE_PERIOD
+) -> Dict[str, Union[str, float, int, bool, None]]:
+    """
+    SIGTERM the process group of proc, then SIGKILL it if proc is still running
+    after the grace period. Returns how it went, for the teardown report
+    """
+    if proc is None:
+        return {'signal': None, 'seconds': 0.0, 'returncode': None, 'exited': True}
+    started = time.monotonic()
+    sent = None
+    if proc.returncode is None:
+        sent = signal.SIGTERM
+        signal_group(proc, sent)
+        try:
+            await asyncio.wait_for(proc.wait(), max(grace_period, 0))
+        except asyncio.TimeoutError:
+            sent = signal.SIGKILL
+            signal_group(proc, sent)
+            try:
+                await asyncio.wait_for(proc.wait(), KILL_WAIT)
+            except asyncio.TimeoutError:
+                pass
+    else:
+        # The leader is gone, but whatever it started may still be around
+        signal_group(proc, signal.SIGKILL)
+    return {
+        'signal': sent.name if sent is not None else None,
+        'seconds': round(time.monotonic() - started, 3),
+        'returncode': proc.returncode,
+        'exited': proc.returncode is not None,
+    }
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import NamedTuple, Callable, Dict, Union
+
+# Lines longer than that are cut into pieces of this size
+MAX_LINE_LENGTH = 16 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# Average time a monitor may spend on a line, above that it is worth a look
+LINE_OVERHEAD_BUDGET_NS = 20_000
+
+
+class LogLine(NamedTuple):
+    timestamp: float
+    source: str
+    text: str
+
+    def format(self) -> str:
+        return (f'{time.strftime("%H:%M:%S", time.localtime(self.timestamp))}'
+                f'.{int(self.timestamp * 1000) % 1000:03d} [{self.source}] {self.text}')
+
+
+class StreamMonitor:
+    """
+    Drains a single output stream of a process, independently of its other streams,
+    until EOF. A process that fills up a pipe nobody reads blocks, so every stream
+    of a simulator gets a monitor of its own.
+
+    The stream is read in chunks and split into lines here, so a line split across
+    chunks is glued back together, and a line without a newline in sight
+    is handed over in pieces of max_line_length.
+    Every line is tagged with the source and the time its chunk was read.
+    Empty lines are skipped
+    """
+    stream: asyncio.StreamReader
+    source: str
+    sink: Callable[[LogLine], None]
+
+    def __init__(self, stream: asyncio.StreamReader, source: str,
+                 sink: Callable[[LogLine], None], max_line_length: int = MAX_LINE_LENGTH):
+        self.stream = stream
+        self.source = source
+        self.sink = sink
+        self.max_line_length = max_line_length
+        self.lines = 0
+        self.bytes_read = 0
+        self.split_lines = 0
+        self.busy_ns = 0
+
+    async def run(self) -> None:
+        buffer = bytearray()
+        while chunk := await self.stream.read(READ_CHUNK_SIZE):
+            started = time.perf_counter_ns()
+            timestamp = time.time()
+            self.bytes_read += len(chunk)
+            buffer += chunk
+
+            start = 0
+            while (end := buffer.find(b'\n', start)) != -1:
+                self._emit(timestamp, buffer[start:end])
+                start = end + 1
+            del buffer[:start]
+
+            if len(buffer) >= self.max_line_length:
+                # Don't wait for the end of a very long line, pass on what fits
+                cut = len(buffer) - len(buffer) % self.max_line_length
+                self._emit(timestamp, buffer[:cut])
+                del buffer[:cut]
+            self.busy_ns += time.perf_counter_ns() - started
+
+        if buffer:
+            # The last line of the stream may have no newline
+            self._emit(time.time(), buffer)
+
+    def _emit(self, timestamp: float, raw: Union[bytes, bytearray]) -> None:
+        if len(raw) > self.max_line_length:
+            self.split_lines += 1
+            for start in range(0, len(raw), self.max_line_length):
+                self._emit(timestamp, raw[start:start + self.max_line_length])
+            return
+        text = raw.decode(errors='replace').rstrip()
+        if text:
+            self.lines += 1
+            self.sink(LogLine(timestamp, self.source, text))
+
+    def stats(self) -> Dict[str, Union[int, float, bool]]:
+        per_line = self.busy_ns / self.lines if self.lines else 0
+        return {
+            'lines': self.lines,
+            'bytes': self.bytes_read,
+            'split_lines': self.split_lines,
+            'ns_per_line': round(per_line),
+            'within_budget': per_line <= LINE_OVERHEAD_BUDGET_NS,
+        }
+
+
+def monitor_process(
+        proc: asyncio.subprocess.Process, name: str,
+        sink: Callable[[LogLine], None]) -> Dict[str, StreamMonitor]:
+    """Monitors for stdout and stderr of the process, their run() should be awaited"""
+    return {
+        f'{name}:stdout': StreamMonitor(proc.stdout, f'{name}:stdout', sink),
+        f'{name}:stderr': StreamMonitor(proc.stderr, f'{name}:stderr', sink),
+    }
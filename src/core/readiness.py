@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from abc import ABC, abstractmethod
+from asyncio.subprocess import Process
+from typing import Callable, Awaitable, Any, List, Dict, Optional, NamedTuple
+
+from .log_buffer import LogRingBuffer
+
+# How often probes that have to poll look again, in seconds
+PROBE_INTERVAL = 0.1
+# Time start_sim waits for all the probes to pass, in seconds
+START_SIM_TIMEOUT = 60
+
+
+class ReadinessProbe(ABC):
+    """A check that a simulator component is up. wait() returns once it is, or raises"""
+    name: str
+
+    @abstractmethod
+    async def wait(self) -> None:
+        pass
+
+
+class TcpPortProbe(ReadinessProbe):
+    """Ready once something accepts connections on the port"""
+
+    def __init__(self, name: str, host: str, port: int, interval: float = PROBE_INTERVAL):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.interval = interval
+
+    async def wait(self) -> None:
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(self.interval)
+                continue
+            writer.close()
+            return
+
+
+class LogPatternProbe(ReadinessProbe):
+    """Ready once a line matching the regular expression shows up in the log"""
+
+    def __init__(self, name: str, log: LogRingBuffer, pattern: str,
+                 start: Optional[int] = None, interval: float = PROBE_INTERVAL):
+        self.name = name
+        self.log = log
+        self.regex = re.compile(pattern)
+        # Only lines from this one on count, by default those written after the probe is made
+        self.start = log.next_line if start is None else start
+        self.interval = interval
+
+    async def wait(self) -> None:
+        seen = self.start
+        while True:
+            for _, line in self.log.range(seen):
+                if self.regex.search(line.text):
+                    return
+            seen = self.log.next_line
+            await asyncio.sleep(self.interval)
+
+
+class UptimeProbe(ReadinessProbe):
+    """Ready once the component has been running for a while, for when there is nothing to check"""
+
+    def __init__(self, name: str, seconds: float):
+        self.name = name
+        self.seconds = seconds
+
+    async def wait(self) -> None:
+        await asyncio.sleep(self.seconds)
+
+
+class CallableProbe(ReadinessProbe):
+    """Ready once the coroutine function returns. It may raise to say the component failed"""
+
+    def __init__(self, name: str, check: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.check = check
+
+    async def wait(self) -> None:
+        await self.check()
+
+
+class Readiness(NamedTuple):
+    ready: bool
+    # Seconds each component took to get ready, None for those that did not
+    latency: Dict[str, Optional[float]]
+    error: Optional[str] = None
+
+
+async def wait_ready(probes: List[ReadinessProbe], timeout: float,
+                     processes: Optional[Dict[str, Process]] = None) -> Readiness:
+    """
+    Run the probes concurrently until all of them pass. Gives up as soon as
+    a probe fails, one of the processes exits or the timeout runs out
+    """
+    started = time.monotonic()
+    latency: Dict[str, Optional[float]] = {probe.name: None for probe in probes}
+
+    async def run(probe: ReadinessProbe) -> None:
+        await probe.wait()
+        latency[probe.name] = round(time.monotonic() - started, 3)
+
+    probe_tasks = {asyncio.create_task(run(probe)): probe.name for probe in probes}
+    exit_tasks = {asyncio.create_task(proc.wait()): name
+                  for name, proc in (processes or {}).items()}
+    pending = set(probe_tasks)
+    error = None
+    try:
+        while pending and error is None:
+            done, _ = await asyncio.wait(
+                pending | set(exit_tasks),
+                timeout=started + timeout - time.monotonic(),
+                return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                error = f'not ready in {timeout} s: {sorted(probe_tasks[t] for t in pending)}'
+            for task in done:
+                if task in exit_tasks:
+                    error = f'{exit_tasks[task]} exited with code {task.result()}'
+                elif task.exception() is not None:
+                    error = f'{probe_tasks[task]} probe failed: {task.exception()!r}'
+            pending -= done
+    finally:
+        for task in [*probe_tasks, *exit_tasks]:
+            task.cancel()
+    return Readiness(ready=error is None, latency=latency, error=error)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from enum import auto
+from typing import Optional, Set, Dict, Union
+
+from strenum import StrEnum
+
+from ..utils import LatencyStats
+
+
+class SceneAction(StrEnum):
+    # The scene is loaded and nothing changed in it, no RPC is needed
+    none = auto()
+    reset = auto()
+    load = auto()
+
+
+@dataclass
+class SceneState:
+    """
+    What the 3D sim has loaded, as far as the worker knows, so that load_scene
+    does not have to ask over gRPC. current is None when it is not known, e.g. after
+    the 3D sim was restarted or a load failed. The scene is dirty once anything was
+    spawned, removed or flown in it since it was loaded or reset
+    """
+    current: Optional[str] = None
+    dirty: bool = True
+    preloaded: Set[str] = field(default_factory=set)
+    latency: Dict[SceneAction, LatencyStats] = field(default_factory=dict)
+
+    def plan(self, scene: str) -> SceneAction:
+        if self.current != scene:
+            return SceneAction.load
+        return SceneAction.reset if self.dirty else SceneAction.none
+
+    def loaded(self, scene: str) -> None:
+        self.current = scene
+        self.dirty = False
+
+    def reset(self) -> None:
+        """The scene is back the way it was loaded, if it is known which one it is"""
+        self.dirty = False
+
+    def touch(self) -> None:
+        self.dirty = True
+
+    def forget(self) -> None:
+        self.current = None
+        self.dirty = True
+
+    def record(self, action: SceneAction, seconds: float) -> None:
+        self.latency.setdefault(action, LatencyStats()).record(seconds)
+
+    def stats(self) -> Dict[str, Union[str, bool, list, dict, None]]:
+        return {
+            'current': self.current,
+            'dirty': self.dirty,
+            'preloaded': sorted(self.preloaded),
+            'latency': {str(action): stats.to_dict() for action, stats in self.latency.items()},
+        }
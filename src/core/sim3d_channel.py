@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Any, Optional, Dict, List, Tuple
+
+import grpc
+
+from ..logger import logger
+from ..utils import LatencyStats
+
+SIM_3D_HOST = '172.23.48.1'
+SIM_3D_PORT = 3258
+# Pings keep the connection alive through NATs and let a dead 3D sim be noticed
+# without waiting for an RPC to time out
+CHANNEL_OPTIONS: List[Tuple[str, int]] = [
+    ('grpc.keepalive_time_ms', 10_000),
+    ('grpc.keepalive_timeout_ms', 5_000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    # A restarted 3D sim is picked up within a couple of seconds
+    ('grpc.initial_reconnect_backoff_ms', 200),
+    ('grpc.max_reconnect_backoff_ms', 2_000),
+]
+
+channel_logger = logger.getChild('sim3d_channel')
+channel_logger.setLevel(logger.level)
+channel_logger.handlers = []
+
+
+class _MeasuredStub:
+    """Stub that times every RPC made through it"""
+
+    def __init__(self, stub: Any, channel: ManagedChannel):
+        self._stub = stub
+        self._channel = channel
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        method = getattr(self._stub, name)
+
+        async def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except grpc.aio.AioRpcError:
+                self._channel.counters['rpc_errors'] += 1
+                raise
+            finally:
+                self._channel.record(name, time.perf_counter() - started)
+
+        return call
+
+
+class ManagedChannel:
+    """
+    gRPC channel to the 3D sim with keepalive. Its connectivity state is watched
+    in the background, and reconnect() replaces it, e.g. after the 3D sim restarted,
+    so that nobody is left with a stub of a channel to the dead process.
+    Counts reconnects and keeps latency stats of every RPC method
+    """
+
+    def __init__(self, host: str, port: int, stub_factory: Callable[[grpc.aio.Channel], Any],
+                 options: Optional[List[Tuple[str, int]]] = None):
+        self.host = host
+        self.port = port
+        self.stub_factory = stub_factory
+        self.options = CHANNEL_OPTIONS if options is None else options
+        self.channel: Optional[grpc.aio.Channel] = None
+        self.state: Optional[grpc.ChannelConnectivity] = None
+        self._stub: Optional[_MeasuredStub] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.counters = {
+            'opened': 0,
+            'reconnects': 0,
+            'transient_failures': 0,
+            'rpcs': 0,
+            'rpc_errors': 0,
+        }
+        self.latency: Dict[str, LatencyStats] = {}
+
+    @property
+    def target(self) -> str:
+        return f'{self.host}:{self.port}'
+
+    def stub(self) -> Any:
+        if self.channel is None:
+            self._open()
+        return self._stub
+
+    async def ready(self) -> None:
+        """Returns once the channel is connected"""
+        self.stub()
+        await self.channel.channel_ready()
+
+    async def reconnect(self) -> None:
+        if self.channel is not None:
+            self.counters['reconnects'] += 1
+            await self.close()
+        self._open()
+
+    async def close(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        if self.channel is not None:
+            await self.channel.close()
+        self.channel = None
+        self._stub = None
+        self.state = None
+
+    def record(self, method: str, seconds: float) -> None:
+        self.counters['rpcs'] += 1
+        self.latency.setdefault(method, LatencyStats()).record(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'target': self.target,
+            'state': self.state.name if self.state is not None else None,
+            **self.counters,
+            'latency': {method: stats.to_dict(4) for method, stats in self.latency.items()},
+        }
+
+    def _open(self) -> None:
+        self.channel = grpc.aio.insecure_channel(self.target, options=self.options)
+        self._stub = _MeasuredStub(self.stub_factory(self.channel), self)
+        self.counters['opened'] += 1
+        self._watcher = asyncio.get_running_loop().create_task(self._watch(self.channel))
+
+    async def _watch(self, channel: grpc.aio.Channel) -> None:
+        state = channel.get_state(try_to_connect=False)
+        while state != grpc.ChannelConnectivity.SHUTDOWN:
+            self.state = state
+            await channel.wait_for_state_change(state)
+            state = channel.get_state(try_to_connect=False)
+            if state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+                self.counters['transient_failures'] += 1
+            channel_logger.debug(f'{self.target} is {state.name}')
+        self.state = state
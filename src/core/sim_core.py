@@ -6,79 +6,68 @@ import asyncio
 import dataclasses
 import logging
 import os.path
-import subprocess
 import tempfile
+import time
 from asyncio.subprocess import Process
-from collections import deque
-from logging import Handler, LogRecord, Logger
+from logging import Logger
 from shlex import quote
 from subprocess import PIPE
-from typing import List, Type, Callable, Set, Coroutine, Any, Optional, Union
-import grpc
+from typing import List, Type, Callable, Set, Coroutine, Any, Optional, Union, Dict, Tuple
+import yaml
 from autopilot_tools.logger import logger
 from autopilot_tools.enums import Devices
+from autopilot_tools.parameters import ParametersInterface
 from autopilot_tools.px4.px_uploader import px_uploader
 from autopilot_tools.utilities.autopilot_configurator import SERIAL_PORTS
 from autopilot_tools.vehicle import Vehicle
+from pymavlink import mavutil
 from simulator3d.API.zlrsimapi import api_pb2, api_pb2_grpc
-from ..api.core import AbstractSimCore, Result, Pose, ModeEnum, StatusCode
+from ..api.core import (
+    AbstractSimCore, Result, Pose, ModeEnum, StatusCode, AgentSpawn, AgentName, SceneName,
+    current_request_id)
 from ..communicators.base_communicator import BaseCommunicator
-from ..logger import logger
-MAX_LEN = 10000
-
-SIM_3D_HOST = '172.23.48.1'
-SIM_3D_PORT = 3258
-
-
-class WssLoggerHandler(Handler):
-    cb: Callable[[Result], None]
-
-    def __init__(
-            self, level: Union[str, int],
-            send_to_dest_cb: Callable[[Result], None]):
-        super().__init__(level)
-        self.cb = send_to_dest_cb
-
-    def emit(self, record: LogRecord):
-        print('got record')
-        self.cb(Result(
-            status=StatusCode.in_progress,
-            message={'logged_message': record.getMessage()}
-        ))
-
-
-def log_opcodes(
-        fun: Callable[..., Coroutine[Any, Any, Result]]
-        ) -> Callable[..., Coroutine[Any, Any, Result]]:
-    async def wrapper(instance: SimCore, *args, **kwargs):
-        instance.ws_logger.info(f'Opcode {fun.__name__} called with arguments: {args}, {kwargs}')
-        return await fun(instance, *args, **kwargs)
-    return wrapper
-
-
-def catch_errors_to_result(
-        fun: Callable[..., Coroutine[Any, Any, Result]]
-        ) -> Callable[..., Coroutine[Any, Any, Result]]:
-    async def wrapper(instance: SimCore, *args, **kwargs):
-        try:
-            return await fun(instance, *args, **kwargs)
-        except Exception as exc:  # pylint: disable=broad-exception-caught
-            instance.ws_logger.warning(f'{type(exc)}: {str(exc)}')
-            return Result(
-                status=StatusCode.error,
-                message={'exception': f'{type(exc)}: {str(exc)}'}
-            )
-    return wrapper
+from .log_forwarding import WssLoggerHandler, OverflowPolicy, LOG_QUEUE_SIZE
+from .opcode_decorators import log_opcodes, catch_errors_to_result
+from .autopilot_link import AutopilotIO, AutopilotLink, UdpPortMixin
+from .firmware_cache import FirmwareCache, FirmwareImage, BoardVersion
+from .mission_cache import MissionCache, read_mission
+from .log_buffer import LogRingBuffer, LogSpillFile
+from .param_cache import ParamCache, diff_params, needs_reboot
+from .process_control import stop_process_group, STOP_GRACE_PERIOD, STOP_DEADLINE
+from .process_monitor import StreamMonitor, monitor_process
+from .readiness import (
+    ReadinessProbe, LogPatternProbe, UptimeProbe, CallableProbe, TcpPortProbe, wait_ready,
+    START_SIM_TIMEOUT)
+from .scene_state import SceneState, SceneAction
+from .sim3d_channel import ManagedChannel, SIM_3D_HOST, SIM_3D_PORT
+from .sim_pool import SimPool, WARM_RECYCLE_SESSIONS, WARM_RECYCLE_MEMORY_GROWTH
+# Lines of simulator logs put into the Result of a failed start, the rest is there for get_logs
+LOG_ERROR_TAIL = 200
+# Most lines a single get_logs returns
+LOG_QUERY_LIMIT = 1000
+
+# Deadlines of the 3D sim RPCs, in seconds. Loading a scene takes a while
+SIM_3D_RPC_TIMEOUT = 5
+SIM_3D_LOAD_SCENE_TIMEOUT = 60
+AUTOPILOT_HEARTBEAT_TIMEOUT = 20
+AUTOPILOT_VERSION_TIMEOUT = 3
+# Without a pattern to look for in its log, the HITL sim is ready after running that long
+HITL_MIN_UPTIME = 1
+# Where SITL sends MAVLink to, the first PX4 instance that is
+MAVLINK_UDP_PORT = 14540
+
+
+class UdpVehicle(UdpPortMixin, Vehicle):
+    """Vehicle of a slot, listening on the MAVLink UDP port of that slot"""
 
 
 def requires_autopilot_connection(
         fun: Callable[..., Coroutine[Any, Any, Result]]
         ) -> Callable[..., Coroutine[Any, Any, Result]]:
     async def wrapper(instance: SimCore, *args, **kwargs):
-        if instance.vehicle_instance is None:
-            instance.vehicle_instance = Vehicle()
-            instance.vehicle_instance.connect(device=instance.connection_device)
-        return await fun(instance, *args, **kwargs)
+        # The link is usually made in the background by then, see AutopilotLink
+        async with instance.autopilot.use():
+            return await fun(instance, *args, **kwargs)
 
     return wrapper
 
@@ -87,9 +76,10 @@ def requires_sim3d_connection(
         fun: Callable[..., Coroutine[Any, Any, Result]]
         ) -> Callable[..., Coroutine[Any, Any, Result]]:
     async def wrapper(instance: SimCore, *args, **kwargs):
-        if instance.sim3d_connection is None:
-            channel = grpc.insecure_channel(f'{SIM_3D_HOST}:{SIM_3D_PORT}')
-            instance.sim3d_connection = api_pb2_grpc.APIStub(channel)
+        # Stub over an asyncio channel, its calls are awaited and do not block the loop.
+        # Any number of calls can be in flight over the same channel at once.
+        # Taken anew every time, the channel is replaced when the 3D sim restarts
+        instance.sim3d_connection = instance.sim3d.stub()
         return await fun(instance, *args, **kwargs)
 
     return wrapper
@@ -103,157 +93,503 @@ class SimCore(AbstractSimCore):
     sim_3d_process: Process = None
     hitl_sim_process: Process = None
 
-    sim_3d_log: deque
-    hitl_sim_log: deque
+    sim_3d_log: LogRingBuffer
+    hitl_sim_log: LogRingBuffer
 
     _monitor_tasks: Set[asyncio.Task]
-    _with_3d_sim: bool = True
+    _stream_monitors: Dict[str, StreamMonitor]
+    pool: Optional[SimPool] = None
+    scene: SceneState
+    stop_grace_period: float
+    stop_deadline: float
+    start_timeout: float
+    hitl_ready_pattern: Optional[str]
+    process_env: Optional[Dict[str, str]] = None
 
     connection_device: Devices
-    vehicle_instance: Optional[Vehicle] = None
+    mavlink_udp_port: int
+    autopilot: AutopilotLink
+    firmware_cache: FirmwareCache
+    param_cache: ParamCache
+    mission_cache: MissionCache
 
+    sim3d: ManagedChannel
     sim3d_connection: api_pb2_grpc.APIStub = None
 
     ws_logger: Logger
+    log_handler: WssLoggerHandler
+
+    autopilot_io: AutopilotIO
 
     def __init__(self, communicator: Type[BaseCommunicator],
-                 sim_3d_path: str, hitl_sim_path: str, *args, **kwargs):
+                 sim_3d_path: str, hitl_sim_path: str, *args,
+                 log_queue_size: int = LOG_QUEUE_SIZE,
+                 log_overflow_policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+                 log_spill_dir: Optional[str] = None,
+                 stop_grace_period: float = STOP_GRACE_PERIOD,
+                 stop_deadline: float = STOP_DEADLINE,
+                 start_timeout: float = START_SIM_TIMEOUT,
+                 hitl_ready_pattern: Optional[str] = None,
+                 warm_standby: bool = False,
+                 warm_recycle_sessions: int = WARM_RECYCLE_SESSIONS,
+                 warm_recycle_memory_growth: int = WARM_RECYCLE_MEMORY_GROWTH,
+                 sim_3d_host: str = SIM_3D_HOST,
+                 sim_3d_port: int = SIM_3D_PORT,
+                 mavlink_udp_port: int = MAVLINK_UDP_PORT,
+                 process_env: Optional[Dict[str, str]] = None, **kwargs):
         self.sim_3d_path = sim_3d_path
         self.hitl_sim_path = hitl_sim_path
-        self.sim_3d_log = deque([], maxlen=MAX_LEN)
-        self.hitl_sim_log = deque([], maxlen=MAX_LEN)
+        self.stop_grace_period = stop_grace_period
+        self.stop_deadline = stop_deadline
+        self.start_timeout = start_timeout
+        self.hitl_ready_pattern = hitl_ready_pattern
+        self.mavlink_udp_port = mavlink_udp_port
+        if process_env:
+            # On top of the environment of the worker, e.g. which slot the simulators are for
+            self.process_env = {**os.environ, **process_env}
+        if warm_standby:
+            self.pool = SimPool(warm_recycle_sessions, warm_recycle_memory_growth)
+        self.sim_3d_log = LogRingBuffer(spill=SimCore._spill_file(log_spill_dir, '3d_sim'))
+        self.hitl_sim_log = LogRingBuffer(spill=SimCore._spill_file(log_spill_dir, 'hitl'))
         self._monitor_tasks = set()
+        self._stream_monitors = {}
+        self.scene = SceneState()
+        self.sim3d = ManagedChannel(sim_3d_host, sim_3d_port, api_pb2_grpc.APIStub)
+        self.firmware_cache = FirmwareCache()
+        self.param_cache = ParamCache()
+        self.mission_cache = MissionCache()
+        self.autopilot = AutopilotLink(
+            connect=self._connect_autopilot,
+            heartbeat=self._autopilot_heartbeat,
+            close=SimCore._disconnect_vehicle
+        )
         super().__init__(communicator, *args, **kwargs)
-
-        def send_log_info(res: Result) -> None:
-            asyncio.ensure_future(
-                self.communicator.send(res), loop=asyncio.get_event_loop())
+        self.autopilot_io = AutopilotIO(send=self.communicator.send)
 
         self.ws_logger = logging.getLogger('autopilot_tools')
-        self.ws_logger.handlers.append(
-            WssLoggerHandler(
-                level=self.ws_logger.level,
-                send_to_dest_cb=send_log_info
-            )
+        self.log_handler = WssLoggerHandler(
+            level=self.ws_logger.level,
+            send=self.communicator.send,
+            queue_size=log_queue_size,
+            overflow_policy=log_overflow_policy
         )
+        self.ws_logger.handlers.append(self.log_handler)
 
     async def cleanup(self):
-        print(await self.stop_sim())
+        print(await self.teardown())
+        await self.disconnect_sim3d()
+        self.autopilot_io.shutdown()
+        await self.log_handler.stop()
+        for log in self.logs().values():
+            if log.spill is not None:
+                log.spill.close()
+
+    def logs(self) -> Dict[str, LogRingBuffer]:
+        return {'hitl': self.hitl_sim_log, '3d_sim': self.sim_3d_log}
+
+    @staticmethod
+    def _spill_file(log_spill_dir: Optional[str], source: str) -> Optional[LogSpillFile]:
+        if log_spill_dir is None:
+            return None
+        os.makedirs(log_spill_dir, exist_ok=True)
+        return LogSpillFile(os.path.join(log_spill_dir, f'{source}.log'))
+
+    async def run_autopilot_io(self, description: str, fun: Callable[..., Any],
+                               *args, **kwargs) -> Any:
+        """Run a blocking autopilot_tools call on the current vehicle, see AutopilotIO"""
+        return await self.autopilot_io.run(
+            self.connection_device, description, fun, *args, **kwargs)
 
     @catch_errors_to_result
     @log_opcodes
     async def start_sim(self, mode: ModeEnum, start_3d_sim: bool = True) -> Result:
-        self._with_3d_sim = start_3d_sim
         self.connection_device = Devices.serial if mode == ModeEnum.HITL else Devices.udp
-        self.hitl_sim_process = await asyncio.create_subprocess_shell(
-            f'{self.hitl_sim_path} {quote(mode)}',
-            stdout=PIPE,
-            stderr=PIPE,
-            shell=True,
-            executable='/bin/bash'
-        )
+        hitl_log_start = self.hitl_sim_log.next_line
+        # In warm standby, processes left from the previous session are used if they can be
+        warm = set()
+        if await self._take_warm('hitl', key=mode):
+            warm.add('hitl')
+        else:
+            self.hitl_sim_process = await self._spawn(
+                'hitl', f'{self.hitl_sim_path} {quote(mode)}', self.hitl_sim_log, key=mode)
         if start_3d_sim:
-            self.sim_3d_process = await asyncio.create_subprocess_shell(
-                self.sim_3d_path,
-                stdout=PIPE,
-                stderr=PIPE,
-                shell=True,
-                executable='/bin/bash'
-            )
-
-        async def monitor_process(proc: Process, log: deque):
-            line = await asyncio.gather(
-                proc.stdout.readline(), proc.stderr.readline()
-            )
-            line = list(filter(lambda x: x, map(lambda x: x.decode().strip(), line)))
-
-            while line:
-                log += line
-                line = await asyncio.gather(
-                    proc.stdout.readline(), proc.stderr.readline()
-                )
-                line = list(filter(lambda x: x, map(lambda x: x.decode().strip(), line)))
-
-        hitl_monitor_task = asyncio.create_task(
-            monitor_process(self.hitl_sim_process, self.hitl_sim_log))
-        hitl_monitor_task.add_done_callback(self._monitor_tasks.discard)
-
+            if await self._take_warm('3d_sim'):
+                warm.add('3d_sim')
+            else:
+                self.scene.forget()
+                self.sim_3d_process = await self._spawn('3d_sim', self.sim_3d_path, self.sim_3d_log)
+                # The old channel may be backing off after losing the previous process
+                await self.sim3d.reconnect()
+        # Connects while the rest is starting, retrying until the autopilot is up
+        self.autopilot.start()
+
+        processes = {'hitl': self.hitl_sim_process}
         if start_3d_sim:
-            monitor_3d_task = asyncio.create_task(
-                monitor_process(self.sim_3d_process, self.sim_3d_log))
-            monitor_3d_task.add_done_callback(self._monitor_tasks.discard)
-
-            self._monitor_tasks = {
-                hitl_monitor_task,
-                monitor_3d_task
+            processes['3d_sim'] = self.sim_3d_process
+        readiness = await wait_ready(
+            [probe for probe in self.readiness_probes(start_3d_sim, hitl_log_start)
+             if probe.name not in warm],
+            timeout=self.start_timeout,
+            processes=processes)
+
+        if readiness.ready:
+            message = {
+                'startup_latency': readiness.latency,
+                'warm': sorted(warm),
+                'autopilot_link': self.autopilot.stats(),
             }
-        else:
-            self._monitor_tasks = {
-                hitl_monitor_task
-            }
-        await asyncio.sleep(1)
-
-        if all([
-            self.sim_3d_process is None or self.sim_3d_process.returncode is None,
-                self.hitl_sim_process.returncode is None]):
+            if self.pool is not None:
+                message['pool'] = self.pool.stats()
             return Result(
                 status=StatusCode.ok,
+                message=message
             )
         return Result(
             status=StatusCode.error,
             message={
-                '3d_sim_log': list(self.sim_3d_log),
-                'hitl_sim_log': list(self.hitl_sim_log)
+                'error': readiness.error,
+                'startup_latency': readiness.latency,
+                '3d_sim_log': [
+                    line.format() for _, line in self.sim_3d_log.tail(LOG_ERROR_TAIL)],
+                'hitl_sim_log': [
+                    line.format() for _, line in self.hitl_sim_log.tail(LOG_ERROR_TAIL)],
+                'log_monitors': {
+                    source: stream_monitor.stats()
+                    for source, stream_monitor in self._stream_monitors.items()
+                }
             }
         )
 
+    async def _spawn(self, name: str, cmd: str, log: LogRingBuffer,
+                     key: Optional[str] = None) -> Process:
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdout=PIPE,
+            stderr=PIPE,
+            shell=True,
+            executable='/bin/bash',
+            env=self.process_env,
+            # A group of its own, so that stopping it stops whatever it started
+            start_new_session=True
+        )
+        stream_monitors = monitor_process(proc, name, log.append)
+        self._stream_monitors.update(stream_monitors)
+        for stream_monitor in stream_monitors.values():
+            task = asyncio.create_task(stream_monitor.run())
+            task.add_done_callback(self._monitor_tasks.discard)
+            self._monitor_tasks.add(task)
+        if self.pool is not None:
+            self.pool.add(name, proc, key)
+        return proc
+
+    async def _take_warm(self, name: str, key: Optional[str] = None) -> bool:
+        if self.pool is None:
+            return False
+        if self.pool.take(name, key) is not None:
+            return True
+        if name in self.pool:
+            # Started for another mode, or due for recycling
+            self.pool.evict(name, recycled=True)
+            deadline = time.monotonic() + self.stop_deadline
+            await (self._stop_hitl(deadline) if name == 'hitl' else self._stop_3d_sim(deadline))
+        return False
+
+    def readiness_probes(self, start_3d_sim: bool, hitl_log_start: int) -> List[ReadinessProbe]:
+        """What start_sim waits for, override to check more or less"""
+        if self.hitl_ready_pattern is not None:
+            hitl = LogPatternProbe(
+                'hitl', self.hitl_sim_log, self.hitl_ready_pattern, start=hitl_log_start)
+        else:
+            # Nothing to look for, so the script is given a moment to fail
+            hitl = UptimeProbe('hitl', HITL_MIN_UPTIME)
+        probes = [hitl, CallableProbe('autopilot', self.autopilot.ready)]
+        if start_3d_sim:
+            probes.append(TcpPortProbe('3d_sim', self.sim3d.host, self.sim3d.port))
+        return probes
+
+    @property
+    def vehicle_instance(self) -> Optional[Vehicle]:
+        return self.autopilot.vehicle
+
+    async def wait_autopilot_heartbeat(self) -> None:
+        vehicle = await self.autopilot.ready()
+        if not await self._autopilot_heartbeat(vehicle):
+            raise TimeoutError(
+                f'no heartbeat from the autopilot in {AUTOPILOT_HEARTBEAT_TIMEOUT} s')
+
+    async def _connect_autopilot(self) -> Vehicle:
+        # A new link may well be to a vehicle that was restarted in the meantime
+        self.mission_cache.forget()
+        if self.connection_device == Devices.udp and self.mavlink_udp_port != MAVLINK_UDP_PORT:
+            vehicle = UdpVehicle(udp_port=self.mavlink_udp_port)
+        else:
+            vehicle = Vehicle()
+        await self.run_autopilot_io('connect', vehicle.connect, self.connection_device)
+        return vehicle
+
+    async def _autopilot_heartbeat(self, vehicle: Vehicle) -> bool:
+        heartbeat = await self.run_autopilot_io(
+            'wait for heartbeat', vehicle.master.wait_heartbeat,
+            timeout=AUTOPILOT_HEARTBEAT_TIMEOUT)
+        return heartbeat is not None
+
     @catch_errors_to_result
     @log_opcodes
     async def stop_sim(self) -> Result:
-        res = subprocess.Popen(f'{self.hitl_sim_path} kill', shell=True).wait()
-        if self._with_3d_sim:
-            try:
-                self.sim_3d_process.kill()
-            except ProcessLookupError:
-                pass
+        if self.pool is None:
+            return await self.teardown()
+        return await self._release_to_pool()
 
-        try:
-            self.hitl_sim_process.kill()
-        except ProcessLookupError:
-            pass
-        self.disconnect_autopilot()
-
-        while (self.hitl_sim_process.returncode is None
-                or self.sim_3d_process.returncode is None):
-            await asyncio.sleep(1)
-
-        if res == 0:
+    @catch_errors_to_result
+    async def teardown(self) -> Result:
+        """
+        Stops the HITL sim, running its kill script first, and the 3D sim at the same time.
+        Each process group gets SIGTERM, and SIGKILL if it is still around after
+        the grace period. All of it is done by stop_deadline
+        """
+        started = time.monotonic()
+        deadline = started + self.stop_deadline
+        hitl, sim_3d = await asyncio.gather(
+            self._stop_hitl(deadline), self._stop_3d_sim(deadline))
+        kill_script_res = hitl.pop('kill_script')
+        kill_script_seconds = hitl.pop('kill_script_seconds')
+
+        message = {
+            'timings': {
+                'hitl_kill_script': kill_script_seconds,
+                '3d_sim': sim_3d['seconds'],
+                'hitl': hitl['seconds'],
+                'total': round(time.monotonic() - started, 3),
+            },
+            'processes': {'3d_sim': sim_3d, 'hitl': hitl},
+        }
+        failed = [name for name, failure in [
+            ('hitl kill script', kill_script_res != 0),
+            ('3d_sim', not sim_3d['exited']),
+            ('hitl', not hitl['exited']),
+        ] if failure]
+        if not failed:
             return Result(
                 status=StatusCode.ok,
+                message=message
             )
         return Result(
             status=StatusCode.error,
-            message={'error': 'failed to kill hitl sim'}
+            message={'error': f'failed to stop {", ".join(failed)}', **message}
         )
 
+    async def _release_to_pool(self) -> Result:
+        """
+        Ends a session in warm standby. Processes that can serve another session are kept,
+        the 3D sim is reset for it. The rest are stopped, and so is a 3D sim that fails to reset
+        """
+        started = time.monotonic()
+        deadline = started + self.stop_deadline
+        recycled = {}
+        failed = []
+        for name in list(self.pool.processes):
+            if reason := self.pool.release(name):
+                recycled[name] = reason
+        if '3d_sim' in self.pool and '3d_sim' not in recycled:
+            try:
+                await self.reset_sim3d()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                recycled['3d_sim'] = f'reset failed: {exc!r}'
+                failed.append('reset 3d_sim')
+
+        stops = []
+        for name in recycled:
+            self.pool.evict(name, recycled=True)
+            stops.append(
+                self._stop_hitl(deadline) if name == 'hitl' else self._stop_3d_sim(deadline))
+        reports = await asyncio.gather(*stops)
+        failed += [f'stop {name}' for name, report in zip(recycled, reports)
+                   if not report['exited']]
+        message = {
+            'recycled': recycled,
+            'timings': {'total': round(time.monotonic() - started, 3)},
+            'pool': self.pool.stats(),
+        }
+        if failed:
+            return Result(
+                status=StatusCode.error,
+                message={'error': f'failed to {", ".join(failed)}', **message}
+            )
+        return Result(
+            status=StatusCode.ok,
+            message=message
+        )
+
+    async def _stop_hitl(self, deadline: float) -> Dict[str, Any]:
+        async def run_kill_script() -> Optional[int]:
+            kill = await asyncio.create_subprocess_shell(
+                f'{self.hitl_sim_path} kill',
+                executable='/bin/bash',
+                env=self.process_env,
+                start_new_session=True
+            )
+            try:
+                return await asyncio.wait_for(kill.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                await stop_process_group(kill, grace_period=0)
+                return None
+
+        kill_script_res, kill_script_seconds = await SimCore._timed(run_kill_script())
+        report = await stop_process_group(
+            self.hitl_sim_process, min(self.stop_grace_period, deadline - time.monotonic()))
+        await self.autopilot.stop()
+        self.hitl_sim_process = None
+        if self.pool is not None:
+            self.pool.evict('hitl')
+        return {
+            **report,
+            'kill_script': kill_script_res,
+            'kill_script_seconds': kill_script_seconds,
+        }
+
+    async def _stop_3d_sim(self, deadline: float) -> Dict[str, Any]:
+        self.scene.forget()
+        report = await stop_process_group(
+            self.sim_3d_process, min(self.stop_grace_period, deadline - time.monotonic()))
+        self.sim_3d_process = None
+        if self.pool is not None:
+            self.pool.evict('3d_sim')
+        return report
+
+    @staticmethod
+    async def _timed(coro: Coroutine[Any, Any, Any]) -> Tuple[Any, float]:
+        started = time.monotonic()
+        res = await coro
+        return res, round(time.monotonic() - started, 3)
+
+    @catch_errors_to_result
     @requires_sim3d_connection
     @log_opcodes
     async def load_scene(self, scene_name: str) -> Result:
-        if self.sim3d_connection.GetCurrentScene(
-                api_pb2.GetCurrentSceneRequest()).scene == scene_name:
-            self.sim3d_connection.Reset(api_pb2.ResetRequest())
-        else:
-            self.sim3d_connection.LoadScene(api_pb2.LoadSceneRequest(scene=scene_name))
-        self.sim3d_connection.Run(api_pb2.RunRequest(timeLimit=0))
+        started = time.monotonic()
+        action = await self._switch_scene(scene_name)
         return Result(
             status=StatusCode.ok,
+            message={
+                'scene': scene_name,
+                'action': action,
+                'latency': round(time.monotonic() - started, 3),
+                'preloaded': scene_name in self.scene.preloaded,
+            }
+        )
+
+    @catch_errors_to_result
+    @requires_sim3d_connection
+    @log_opcodes
+    async def preload_scenes(self, scenes: Optional[List[str]] = None) -> Result:
+        """
+        Loads every scene once, so that switching to it later finds its assets warm,
+        then goes back to the scene that was there before. It holds the 3D sim
+        until it is done, so it is best sent while the worker is idle
+        """
+        scenes = list(SceneName) if scenes is None else scenes
+        previous = await self._known_scene()
+        latency = {}
+        for scene_name in scenes:
+            started = time.monotonic()
+            await self._switch_scene(scene_name)
+            latency[scene_name] = round(time.monotonic() - started, 3)
+            self.scene.preloaded.add(scene_name)
+            await self.communicator.send(Result(
+                status=StatusCode.in_progress,
+                message={'preloaded': scene_name, 'latency': latency[scene_name]},
+                request_id=current_request_id.get()
+            ))
+        if previous and previous != self.scene.current:
+            await self._switch_scene(previous)
+        return Result(
+            status=StatusCode.ok,
+            message={'latency': latency, 'scene': self.scene.stats()}
         )
 
+    async def _known_scene(self) -> str:
+        if self.scene.current is None:
+            # Not known yet, e.g. the 3D sim was started by someone else
+            current_scene = await self.sim3d_connection.GetCurrentScene(
+                api_pb2.GetCurrentSceneRequest(), timeout=SIM_3D_RPC_TIMEOUT)
+            self.scene.current = current_scene.scene
+        return self.scene.current
+
+    async def _switch_scene(self, scene_name: str) -> SceneAction:
+        await self._known_scene()
+        action = self.scene.plan(scene_name)
+        started = time.monotonic()
+        try:
+            if action == SceneAction.reset:
+                await self.sim3d_connection.Reset(
+                    api_pb2.ResetRequest(), timeout=SIM_3D_RPC_TIMEOUT)
+            elif action == SceneAction.load:
+                await self.sim3d_connection.LoadScene(
+                    api_pb2.LoadSceneRequest(scene=scene_name), timeout=SIM_3D_LOAD_SCENE_TIMEOUT)
+            if action != SceneAction.none:
+                await self.sim3d_connection.Run(
+                    api_pb2.RunRequest(timeLimit=0), timeout=SIM_3D_RPC_TIMEOUT)
+        except Exception:
+            self.scene.forget()
+            raise
+        self.scene.loaded(scene_name)
+        self.scene.record(action, time.monotonic() - started)
+        return action
+
+    @catch_errors_to_result
     @requires_sim3d_connection
     @log_opcodes
     async def spawn_agent(self, agent_name: str, position: Pose) -> Result:
-        _ = self.sim3d_connection.GetSpawn(api_pb2.GetSpawnRequest())
-        agent_uid = self.sim3d_connection.SpawnAgent(api_pb2.SpawnAgentRequest(state=api_pb2.State(
+        self.scene.touch()
+        _ = await self.sim3d_connection.GetSpawn(
+            api_pb2.GetSpawnRequest(), timeout=SIM_3D_RPC_TIMEOUT)
+        agent_uid = (await self.sim3d_connection.SpawnAgent(
+            SimCore._spawn_agent_request(agent_name, position),
+            timeout=SIM_3D_RPC_TIMEOUT)).uid
+        await self.sim3d_connection.Run(api_pb2.RunRequest(timeLimit=0), timeout=SIM_3D_RPC_TIMEOUT)
+
+        return Result(
+            status=StatusCode.ok,
+            message={'uid': agent_uid}
+        )
+
+    @catch_errors_to_result
+    @requires_sim3d_connection
+    @log_opcodes
+    async def spawn_agents(self, agents: List[AgentSpawn]) -> Result:
+        # All agents are spawned at once and the simulation is resumed only once
+        self.scene.touch()
+        _ = await self.sim3d_connection.GetSpawn(
+            api_pb2.GetSpawnRequest(), timeout=SIM_3D_RPC_TIMEOUT)
+        responses = await asyncio.gather(*[
+            self.sim3d_connection.SpawnAgent(
+                SimCore._spawn_agent_request(agent.agent_name, agent.position),
+                timeout=SIM_3D_RPC_TIMEOUT)
+            for agent in agents
+        ])
+        await self.sim3d_connection.Run(api_pb2.RunRequest(timeLimit=0), timeout=SIM_3D_RPC_TIMEOUT)
+
+        return Result(
+            status=StatusCode.ok,
+            message={'uids': [response.uid for response in responses]}
+        )
+
+    @staticmethod
+    def _agent_name(agent_name: Union[str, Dict[str, str]]) -> AgentName:
+        """
+        Agents are named by an AgentName member or its value. An AgentName sent
+        over websockets comes as {member: value}
+        """
+        if isinstance(agent_name, dict):
+            (agent_name, _), = agent_name.items()
+        if agent_name in AgentName.__members__:
+            return AgentName[agent_name]
+        return AgentName(agent_name)
+
+    @staticmethod
+    def _spawn_agent_request(agent_name: Union[str, Dict[str, str]],
+                             position: Pose) -> api_pb2.SpawnAgentRequest:
+        return api_pb2.SpawnAgentRequest(state=api_pb2.State(
             transform=api_pb2.Transform(
                 position=api_pb2.Vector3(x=(v := position.transform.position).x, y=v.y, z=v.z),
                 rotation=api_pb2.Vector3(x=(v := position.transform.rotation).x, y=v.y, z=v.z),
@@ -261,22 +597,19 @@ class SimCore(AbstractSimCore):
             velocity=api_pb2.Vector3(x=(v := position.velocity).x, y=v.y, z=v.z),
             angularVelocity=api_pb2.Vector3(x=(v := position.angular_velocity).x, y=v.y, z=v.z)),
             type=1,
-            name='Quadcopter-M690')).uid
-        self.sim3d_connection.Run(api_pb2.RunRequest(timeLimit=0))
-
-        return Result(
-            status=StatusCode.ok,
-            message={'uid': agent_uid}
-        )
+            name=SimCore._agent_name(agent_name).value)
 
+    @catch_errors_to_result
     @requires_sim3d_connection
     @log_opcodes
     async def remove_agent(self, agent_id: str) -> Result:
-        remove_agent_request = api_pb2.RemoveAgentRequest(uid=self.uid)
-        remove_agent_response = self.sim3d_connection.RemoveAgent(remove_agent_request)
+        self.scene.touch()
+        remove_agent_request = api_pb2.RemoveAgentRequest(uid=agent_id)
+        remove_agent_response = await self.sim3d_connection.RemoveAgent(
+            remove_agent_request, timeout=SIM_3D_RPC_TIMEOUT)
         return Result(
             status=StatusCode.ok,
-            message={'message': remove_agent_response}
+            message={'message': str(remove_agent_response)}
         )
 
     @catch_errors_to_result
@@ -284,58 +617,170 @@ class SimCore(AbstractSimCore):
     @log_opcodes
     async def configure_autopilot(
             self, firmware: Union[str, os.PathLike, None],
-            config: List[Union[str, os.PathLike]]) -> Result:
-
-        if os.path.exists(firmware):
-            px_uploader([firmware], SERIAL_PORTS)
-        elif firmware is not None:
-            # this should be dealt with without os.path.exists hackery
-            # If user indeed specifies a path but makes a typo, the control will go here
-            # And the uploader will try to parse that path as a valid content of a firmware file
-            # That will fail. Spectacularly. Obviously
-
-            # Use PathLike typehint as a clue?
-            temp_file = tempfile.NamedTemporaryFile('w', delete=False)
-            with open(temp_file.name, 'w', encoding='utf-8') as f:
-                f.write(firmware)
-            px_uploader(  # if you provided a path and stuck here, check your path
-                [temp_file.name], SERIAL_PORTS
-            )
-            os.remove(temp_file.name)
-
-        self.vehicle_instance.reset_params_to_default()
-        for config_file in config:
-            # Same hackery here
-            if os.path.exists(config_file):
-                self.vehicle_instance.configure(config_file)
-            else:
-                self.vehicle_instance.configures(  # if stuck here, check your path
-                    config_file
+            config: List[Union[str, os.PathLike]], force_flash: bool = False,
+            incremental: bool = False) -> Result:
+        version = await self.run_autopilot_io('read version', self._read_board_version)
+        board = version.uid if version is not None else str(self.connection_device)
+
+        def flash_firmware() -> Dict[str, Any]:
+            # The same image is not flashed again, unless forced to
+            if firmware is None:
+                return {'flashed': False}
+            image = FirmwareImage.of(firmware)
+            if not force_flash and self.firmware_cache.is_flashed(board, image, version):
+                self.firmware_cache.skipped()
+                return {'flashed': False, 'firmware_sha256': image.sha256}
+
+            started = time.monotonic()
+            self.firmware_cache.forget(board)
+            self.param_cache.forget(board)
+            self.mission_cache.forget()
+            upload_firmware()
+            duration = round(time.monotonic() - started, 3)
+            self.firmware_cache.record(board, image, duration)
+            return {'flashed': True, 'flash_duration': duration, 'firmware_sha256': image.sha256}
+
+        def upload_firmware():
+            if os.path.exists(firmware):
+                px_uploader([firmware], SERIAL_PORTS)
+            elif firmware is not None:
+                # this should be dealt with without os.path.exists hackery
+                # If user indeed specifies a path but makes a typo, the control will go here
+                # And the uploader will try to parse that path as a valid content of a firmware file
+                # That will fail. Spectacularly. Obviously
+
+                # Use PathLike typehint as a clue?
+                temp_file = tempfile.NamedTemporaryFile('w', delete=False)
+                with open(temp_file.name, 'w', encoding='utf-8') as f:
+                    f.write(firmware)
+                px_uploader(  # if you provided a path and stuck here, check your path
+                    [temp_file.name], SERIAL_PORTS
                 )
-        self.vehicle_instance.reboot()
+                os.remove(temp_file.name)
+
+        def apply_config():
+            self.mission_cache.forget()
+            self.vehicle_instance.reset_params_to_default()
+            for config_file in config:
+                # Same hackery here
+                if os.path.exists(config_file):
+                    self.vehicle_instance.configure(config_file)
+                else:
+                    self.vehicle_instance.configures(  # if stuck here, check your path
+                        config_file
+                    )
+
+        def apply_config_diff() -> Dict[str, Any]:
+            # Only parameters that differ from what the board has are written. The result is
+            # the same as after a reset to default and applying the config in full
+            requested = {}
+            for config_item in config:
+                requested.update(SimCore._read_config(config_item))
+            params = self.param_cache.get(board)
+            reset = params is None
+            if reset:
+                self.mission_cache.forget()
+                self.vehicle_instance.reset_params_to_default()
+                params = self.param_cache.reset(
+                    board, self.vehicle_instance.params.read_all() or {})
+            changed = diff_params(params.current, params.target(requested))
+            failed = []
+            for name, value in changed.items():
+                if self.vehicle_instance.params.set(name, value):
+                    params.current[name] = value
+                else:
+                    failed.append(name)
+            if failed:
+                # Not sure what the board has now
+                self.param_cache.forget(board)
+            return {
+                'incremental': True,
+                'reset': reset,
+                'changed': sorted(changed),
+                'failed': failed,
+                # A reset to defaults takes effect on reboot
+                'reboot': reset or needs_reboot(changed),
+            }
+
+        firmware_report = await self.run_autopilot_io('flash firmware', flash_firmware)
+        started = time.monotonic()
+        if incremental:
+            config_report = await self.run_autopilot_io('configure', apply_config_diff)
+        else:
+            await self.run_autopilot_io('configure', apply_config)
+            # Parameters were set behind the cache
+            self.param_cache.forget(board)
+            config_report = {'incremental': False, 'reboot': True}
+        if config_report['reboot']:
+            self.mission_cache.forget()
+            await self.run_autopilot_io('reboot', self.vehicle_instance.reboot)
+        config_report['duration'] = round(time.monotonic() - started, 3)
         return Result(
-            status=StatusCode.ok
+            status=StatusCode.error if config_report.get('failed') else StatusCode.ok,
+            message={'firmware': firmware_report, 'config': config_report}
         )
 
+    @staticmethod
+    def _read_config(config_item: Union[str, os.PathLike]) -> Dict[str, Union[int, float]]:
+        if os.path.exists(config_item):
+            return ParametersInterface.yaml_to_dict(str(config_item)) or {}
+        return yaml.safe_load(str(config_item)) or {}
+
+    def _read_board_version(self) -> Optional[BoardVersion]:
+        """Asks the autopilot for AUTOPILOT_VERSION, blocks, None if it does not answer"""
+        master = self.vehicle_instance.master
+        master.mav.command_long_send(
+            master.target_system, master.target_component,
+            mavutil.mavlink.MAV_CMD_REQUEST_AUTOPILOT_CAPABILITIES, 0, 1, 0, 0, 0, 0, 0, 0)
+        msg = master.recv_match(
+            type='AUTOPILOT_VERSION', blocking=True, timeout=AUTOPILOT_VERSION_TIMEOUT)
+        if msg is None or not msg.uid:
+            return None
+        # PX4 puts the first 8 bytes of its git hash there, as a little endian number
+        custom_version = int.from_bytes(bytes(msg.flight_custom_version), 'little')
+        return BoardVersion(
+            uid=str(msg.uid),
+            git_hash=f'{custom_version:016x}' if custom_version else None)
+
     @catch_errors_to_result
     @requires_autopilot_connection
     @log_opcodes
     async def upload_mission(self, mission: Union[str, os.PathLike]) -> Result:
+        # The vehicle keeps the mission, the same one is not uploaded again
+        plan = self.mission_cache.plan(read_mission(mission))
+        if self.mission_cache.is_loaded(plan):
+            self.mission_cache.skipped()
+            return Result(
+                status=StatusCode.ok,
+                message={'uploaded': False, 'mission_sha256': plan.sha256}
+            )
+
+        started = time.monotonic()
+        # Not sure what the vehicle has if the upload fails halfway
+        self.mission_cache.forget()
         if os.path.exists(mission):
-            self.vehicle_instance.load_mission(mission)
+            await self.run_autopilot_io(
+                'upload mission', self.vehicle_instance.load_mission, mission)
         else:
-            self.vehicle_instance.loads_mission(  # if stuck here, check your path
-                mission
-            )
+            await self.run_autopilot_io(  # if stuck here, check your path
+                'upload mission', self.vehicle_instance.loads_mission, mission)
+        self.mission_cache.record(plan)
         return Result(
-            status=StatusCode.ok
+            status=StatusCode.ok,
+            message={
+                'uploaded': True,
+                'upload_duration': round(time.monotonic() - started, 3),
+                'mission_sha256': plan.sha256,
+                'items': plan.items,
+            }
         )
 
     @catch_errors_to_result
     @requires_autopilot_connection
     @log_opcodes
     async def reboot_autopilot(self) -> Result:
-        self.vehicle_instance.reboot()
+        self.mission_cache.forget()
+        await self.run_autopilot_io('reboot', self.vehicle_instance.reboot)
         return Result(
             status=StatusCode.ok
         )
@@ -344,7 +789,9 @@ class SimCore(AbstractSimCore):
     @requires_autopilot_connection
     @log_opcodes
     async def start_mission(self) -> Result:
-        await asyncio.sleep(3)
+        # Instead of waiting a fixed time, make sure the autopilot is up before arming
+        await self.wait_autopilot_heartbeat()
+        self.scene.touch()
         # res = await self.vehicle_instance.arun_mission(timeout=40)
         res = await self.vehicle_instance.arun_mission(timeout=20)
         return Result(
@@ -356,83 +803,70 @@ class SimCore(AbstractSimCore):
     async def abort_mission(self) -> Result:
         pass
 
-    def disconnect_autopilot(self):
-        if self.vehicle_instance is not None:
-            self.vehicle_instance.master.close()
-        self.vehicle_instance = None
-
-
-class DummySimCore(AbstractSimCore):
-    communicator: BaseCommunicator
-
-    def __init__(self, communicator: Type[BaseCommunicator], *args, **kwargs):
-        super().__init__(communicator, *args, **kwargs)
-        self.ws_logger = logger.getChild('sim_core')
-        self.ws_logger.setLevel(logger.level)
-        self.ws_logger.handlers = []
-
-        def send_log_info(res: Result) -> None:
-            asyncio.ensure_future(
-                self.communicator.send(res), loop=asyncio.get_event_loop())
-
-        self.ws_logger.handlers.append(
-            WssLoggerHandler(
-                level=self.ws_logger.level,
-                send_to_dest_cb=send_log_info
+    @catch_errors_to_result
+    async def get_logs(self, source: str, start: Optional[int] = None, end: Optional[int] = None,
+                       tail: Optional[int] = None, pattern: Optional[str] = None) -> Result:
+        """
+        Lines of a simulator log, source is either 'hitl' or '3d_sim'.
+        Lines are numbered from the start of the log, so a client that wants the next page
+        asks for start=next_line. With tail, the last lines are returned, with pattern,
+        the last lines matching the regular expression.
+        No more than LOG_QUERY_LIMIT lines are returned at once
+        """
+        if source not in self.logs():
+            return Result(
+                status=StatusCode.error,
+                message={'error': f'unknown log {source}, expected one of {list(self.logs())}'}
+            )
+        negative = [name for name, value in [('start', start), ('end', end), ('tail', tail)]
+                    if value is not None and value < 0]
+        if negative:
+            return Result(
+                status=StatusCode.error,
+                message={'error': f'{", ".join(negative)} can not be negative'}
             )
+        log = self.logs()[source]
+        if pattern is not None:
+            limit = LOG_QUERY_LIMIT if tail is None else min(tail, LOG_QUERY_LIMIT)
+            lines = log.grep(pattern, limit=limit)
+        elif tail is not None:
+            lines = log.tail(min(tail, LOG_QUERY_LIMIT))
+        else:
+            start = log.first_line if start is None else start
+            end = start + LOG_QUERY_LIMIT if end is None else min(end, start + LOG_QUERY_LIMIT)
+            lines = log.range(start, end)
+        return Result(
+            status=StatusCode.ok,
+            message={
+                'source': source,
+                'first_line': log.first_line,
+                'next_line': log.next_line,
+                'lines': [[n, line.format()] for n, line in lines]
+            }
         )
 
-    async def cleanup(self):
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def start_sim(self, mode: ModeEnum, start_3d_sim: bool = True) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def stop_sim(self) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def load_scene(self, scene_name: str) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def spawn_agent(self, agent_name: str, position: Pose) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def remove_agent(self, agent_id: str) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def configure_autopilot(
-            self, firmware: Union[str, os.PathLike, None],
-            config: List[Union[str, os.PathLike]]) -> Result:
-
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def upload_mission(self, mission: Union[str, os.PathLike]) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def reboot_autopilot(self) -> Result:
-        pass
-
-    @catch_errors_to_result
-    @log_opcodes
-    async def start_mission(self) -> Result:
-        pass
+    async def get_sim3d_stats(self) -> Result:
+        return Result(
+            status=StatusCode.ok,
+            message={'channel': self.sim3d.stats(), 'scene': self.scene.stats()}
+        )
 
-    @log_opcodes
-    async def abort_mission(self) -> Result:
-        pass
+    @requires_sim3d_connection
+    async def reset_sim3d(self) -> None:
+        """Puts the loaded scene back the way it was loaded, as load_scene does"""
+        try:
+            await self.sim3d_connection.Reset(api_pb2.ResetRequest(), timeout=SIM_3D_RPC_TIMEOUT)
+            await self.sim3d_connection.Run(
+                api_pb2.RunRequest(timeLimit=0), timeout=SIM_3D_RPC_TIMEOUT)
+        except Exception:
+            self.scene.forget()
+            raise
+        self.scene.reset()
+
+    async def disconnect_sim3d(self):
+        await self.sim3d.close()
+        self.sim3d_connection = None
+
+    @staticmethod
+    def _disconnect_vehicle(vehicle: Vehicle) -> None:
+        vehicle.master.close()
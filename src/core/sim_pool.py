@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import os
+import time
+from asyncio.subprocess import Process
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
+
+# A warm process is restarted after serving that many sessions
+WARM_RECYCLE_SESSIONS = 20
+# or once its process group uses that many bytes more than after its first session
+WARM_RECYCLE_MEMORY_GROWTH = 1024 * 1024 * 1024
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def group_rss(pgid: int) -> int:
+    """Resident memory of all processes in the group, in bytes. 0 where there is no /proc"""
+    total = 0
+    try:
+        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat', encoding='utf-8', errors='replace') as f:
+                stat = f.read()
+        except OSError:
+            # Exited while we were looking
+            continue
+        # The command name may contain anything, fields are counted from its closing paren
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * PAGE_SIZE
+    return total
+
+
+@dataclass
+class PooledProcess:
+    name: str
+    proc: Process
+    # What the process was started for, it is only reused for the same
+    key: Optional[str] = None
+    started: float = field(default_factory=time.monotonic)
+    sessions: int = 0
+    baseline_rss: Optional[int] = None
+    rss: int = 0
+
+    def measure(self) -> None:
+        self.rss = group_rss(self.proc.pid)
+        if self.baseline_rss is None:
+            self.baseline_rss = self.rss
+
+    def recycle_reason(self, max_sessions: int, max_memory_growth: int) -> Optional[str]:
+        if self.proc.returncode is not None:
+            return f'exited with code {self.proc.returncode}'
+        if self.sessions >= max_sessions:
+            return f'served {self.sessions} sessions'
+        if self.baseline_rss is not None and self.rss - self.baseline_rss > max_memory_growth:
+            return f'memory grew by {(self.rss - self.baseline_rss) // 2 ** 20} MiB'
+        return None
+
+    def stats(self) -> Dict[str, Union[str, int, float, None]]:
+        return {
+            'pid': self.proc.pid,
+            'key': self.key,
+            'uptime': round(time.monotonic() - self.started, 1),
+            'sessions': self.sessions,
+            'rss': self.rss,
+            'baseline_rss': self.baseline_rss,
+        }
+
+
+class SimPool:
+    """
+    Simulator processes kept running between sessions. A process is handed out again
+    only if it is alive, was started for the same key and is not due for recycling.
+    Memory is measured at the end of every session, the first measurement is the baseline
+    """
+
+    def __init__(self, max_sessions: int = WARM_RECYCLE_SESSIONS,
+                 max_memory_growth: int = WARM_RECYCLE_MEMORY_GROWTH):
+        self.max_sessions = max_sessions
+        self.max_memory_growth = max_memory_growth
+        self.processes: Dict[str, PooledProcess] = {}
+        self.counters = {
+            'started': 0,
+            'reused': 0,
+            'recycled': 0,
+        }
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.processes
+
+    def add(self, name: str, proc: Process, key: Optional[str] = None) -> PooledProcess:
+        self.processes[name] = pooled = PooledProcess(name, proc, key)
+        self.counters['started'] += 1
+        return pooled
+
+    def take(self, name: str, key: Optional[str] = None) -> Optional[PooledProcess]:
+        pooled = self.processes.get(name)
+        if (pooled is None or pooled.key != key
+                or pooled.recycle_reason(self.max_sessions, self.max_memory_growth)):
+            return None
+        self.counters['reused'] += 1
+        return pooled
+
+    def release(self, name: str) -> Optional[str]:
+        """Ends a session of the process, returns why it should be recycled, if it should"""
+        pooled = self.processes[name]
+        pooled.sessions += 1
+        pooled.measure()
+        return pooled.recycle_reason(self.max_sessions, self.max_memory_growth)
+
+    def evict(self, name: str, recycled: bool = False) -> Optional[PooledProcess]:
+        if recycled:
+            self.counters['recycled'] += 1
+        return self.processes.pop(name, None)
+
+    def stats(self) -> Dict[str, Union[int, Dict]]:
+        return {
+            **self.counters,
+            'processes': {name: pooled.stats() for name, pooled in self.processes.items()},
+        }
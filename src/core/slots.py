@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from contextvars import ContextVar
+from typing import Callable, Awaitable, Type, Dict, Any, List, Optional, Set
+
+from ..api.core import AbstractSimCore, Command, Result, StatusCode, Opcodes
+from ..communicators.base_communicator import BaseCommunicator
+from ..logger import logger
+
+# CPUs a SITL slot takes, the autopilot, the physics and the 3D sim together
+SLOT_CORES = 4
+# Slot commands go to when they name none
+DEFAULT_SLOT = 0
+
+# Slot of the command being executed, so that log records end up in the right slot
+current_slot: ContextVar[Optional[int]] = ContextVar('current_slot', default=None)
+
+slots_logger = logger.getChild('slots')
+slots_logger.setLevel(logger.level)
+slots_logger.handlers = []
+
+
+def cpu_slot_limit(cores_per_slot: int = SLOT_CORES) -> int:
+    """How many slots this process can run at once on the CPUs it may use"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, cpus // max(1, cores_per_slot))
+
+
+class SlotCommunicator(BaseCommunicator):
+    """Stands in for the communicator of a slot, tags its Results with the slot"""
+
+    def __init__(self, *args, slot: int, send: Callable[[Result], Awaitable[None]],
+                 sequential: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slot = slot
+        self._send = send
+        self.sequential = sequential
+
+    async def send(self, msg: Result):
+        msg.slot = self.slot
+        await self._send(msg)
+
+
+class SlotFilter(logging.Filter):
+    """Lets through the records logged on behalf of one slot, see current_slot"""
+
+    def __init__(self, slot: int):
+        super().__init__()
+        self.slot = slot
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        slot = current_slot.get()
+        return (DEFAULT_SLOT if slot is None else slot) == self.slot
+
+
+class MultiSlotCore:
+    """
+    Runs several independent sim cores, slots, behind one communicator.
+    Each slot has a scheduler of its own, so slots never wait for each other,
+    and its own processes, ports, logs and autopilot link, as given by slot_options.
+    Commands are routed by their slot, DEFAULT_SLOT if they name none.
+
+    No more than max_active slots run a simulation at once, by default as many
+    as there are CPUs for, see cpu_slot_limit. A start_sim over the limit fails
+    right away, so that whoever sent it can try another worker
+    """
+    communicator: BaseCommunicator
+    slots: List[AbstractSimCore]
+
+    def __init__(self, communicator: Type[BaseCommunicator], core: Type[AbstractSimCore],
+                 slots: int, slot_options: Callable[[int], Dict[str, Any]], *args,
+                 max_active: Optional[int] = None, **kwargs):
+        self.max_active = cpu_slot_limit() if max_active is None else max_active
+        # The server gives the worker no more jobs than it may run at once
+        self.communicator = communicator(*args, capacity=min(slots, self.max_active), **kwargs)
+        self.active: Set[int] = set()
+        self.counters = {
+            'rejected': 0,
+            'unknown_slot': 0,
+        }
+        self.slots = []
+        for slot in range(slots):
+            core_instance = core(
+                SlotCommunicator,
+                slot=slot,
+                send=self.communicator.send,
+                sequential=self.communicator.sequential,
+                **slot_options(slot))
+            core_instance.log_handler.addFilter(SlotFilter(slot))
+            core_instance.scheduler.execute = self._slot_execute(slot, core_instance)
+            self.slots.append(core_instance)
+        slots_logger.info(f'{slots} slots, up to {self.max_active} running at once')
+
+    def submit(self, command: Command) -> Optional[asyncio.Task]:
+        slot = DEFAULT_SLOT if command.slot is None else command.slot
+        if not 0 <= slot < len(self.slots):
+            self.counters['unknown_slot'] += 1
+            return asyncio.create_task(self._reply(command, {
+                'error': f'no slot {slot}, there are {len(self.slots)}'}))
+        # The task of the command copies the context, and so does whatever it starts
+        current_slot.set(slot)
+        return self.slots[slot].scheduler.submit(command)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'slots': len(self.slots),
+            'max_active': self.max_active,
+            'active': sorted(self.active),
+            **self.counters,
+        }
+
+    async def serve(self) -> None:
+
+        async def recv_commands():
+            async for command in self.communicator.receive():
+                self.submit(command)
+            for core_instance in self.slots:
+                await core_instance.scheduler.join()
+
+        await self.communicator.setup()
+
+        await asyncio.gather(
+            self.communicator.run(),
+            recv_commands())
+        for core_instance in self.slots:
+            await core_instance.cleanup()
+
+    def run(self) -> None:
+        asyncio.run(self.serve())
+
+    def _slot_execute(self, slot: int,
+                      core_instance: AbstractSimCore) -> Callable[[Command], Awaitable[None]]:
+        # Results of the commands being executed, to tell whether start_sim failed
+        outcomes: Dict[int, Optional[Result]] = {}
+        dispatch = core_instance.dispatch
+
+        async def dispatch_in_slot(command: Command) -> Optional[Result]:
+            res = outcomes[id(command)] = await dispatch(command)
+            return res
+
+        core_instance.dispatch = dispatch_in_slot
+
+        async def execute(command: Command) -> None:
+            reserved = False
+            if command.opcode == Opcodes.start_sim and slot not in self.active:
+                if len(self.active) >= self.max_active:
+                    self.counters['rejected'] += 1
+                    await self._reply(command, {
+                        'error': f'{len(self.active)} slots are running already, '
+                                 f'that is as many as there are CPUs for',
+                        'slots': self.stats(),
+                    })
+                    return
+                self.active.add(slot)
+                reserved = True
+            try:
+                await core_instance.execute(command)
+            finally:
+                res = outcomes.pop(id(command), None)
+                if reserved and (res is None or res.status == StatusCode.error):
+                    # A slot that failed to start runs nothing
+                    self.active.discard(slot)
+            if command.opcode == Opcodes.stop_sim:
+                self.active.discard(slot)
+
+        return execute
+
+    async def _reply(self, command: Command, message: Dict[str, Any]) -> None:
+        await self.communicator.send(Result(
+            status=StatusCode.error,
+            message=message,
+            request_id=command.request_id,
+            slot=command.slot
+        ))
@@ -1,7 +1,11 @@
 import asyncio
-from typing import List, TypeVar, Awaitable
+from collections import deque
+from dataclasses import dataclass
+from typing import (
+    List, TypeVar, Awaitable, Generic, Dict, Deque, Optional, AsyncIterator, Tuple, Union)
 
 T = TypeVar('T')
+K = TypeVar('K')
 
 
 async def exec_one_task(
@@ -13,3 +17,90 @@ async def exec_one_task(
 
     for task in done:
         return task.result()
+
+
+@dataclass
+class LatencyStats:
+    """Count, last, max and average of the durations recorded, in seconds"""
+    count: int = 0
+    last: float = 0.0
+    max: float = 0.0
+    total: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.last = seconds
+        self.max = max(self.max, seconds)
+        self.total += seconds
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self, digits: int = 3) -> Dict[str, Union[int, float]]:
+        return {
+            'count': self.count,
+            'last': round(self.last, digits),
+            'max': round(self.max, digits),
+            'avg': round(self.avg, digits),
+        }
+
+
+class FairMerge(Generic[K, T]):
+    """
+    Items from several sources as one async iterator of (source, item).
+    Sources take turns, so a busy one can't hold the others up, and each of them
+    buffers at most size items, put() waits for room beyond that.
+    After fail(), the items already there are still given out, then the exception is raised
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._queues: Dict[K, asyncio.Queue] = {}
+        # Sources with items, in the order they get their turn
+        self._ready: Deque[K] = deque()
+        self._wakeup = asyncio.Event()
+        self._error: Optional[BaseException] = None
+
+    async def put(self, source: K, item: T) -> None:
+        queue = self._queues.get(source)
+        if queue is None:
+            queue = self._queues[source] = asyncio.Queue(self.size)
+        await queue.put(item)
+        if source not in self._ready:
+            self._ready.append(source)
+            self._wakeup.set()
+
+    async def pump(self, source: K, items: AsyncIterator[T]) -> None:
+        async for item in items:
+            await self.put(source, item)
+
+    def discard(self, source: K) -> None:
+        """Forgets a source that is gone, once everything it sent is taken"""
+        queue = self._queues.get(source)
+        if queue is not None and queue.empty():
+            del self._queues[source]
+
+    def fail(self, exc: BaseException) -> None:
+        self._error = exc
+        self._wakeup.set()
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[K, T]:
+        while not self._ready:
+            if self._error is not None:
+                raise self._error
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        source = self._ready.popleft()
+        queue = self._queues[source]
+        item = queue.get_nowait()
+        if not queue.empty():
+            # Back of the line
+            self._ready.append(source)
+        return source, item
@@ -0,0 +1,93 @@
+"""
+Stand-ins for autopilot_tools, pymavlink and simulator3d, so that SimCore can be imported
+where they are not installed. Only what sim_core imports is there, tests replace the rest
+"""
+import importlib
+import logging
+import sys
+from enum import StrEnum
+from types import ModuleType
+from typing import Any, Dict
+
+
+class Devices(StrEnum):
+    serial = 'serial'
+    udp = 'udp'
+
+
+class ParametersInterface:
+    @staticmethod
+    def yaml_to_dict(path: str) -> Dict[str, Any]:
+        import yaml  # pylint: disable=import-outside-toplevel
+        with open(path, encoding='utf-8') as f:
+            return yaml.safe_load(f)
+
+
+class Vehicle:
+    def connect(self, device: str = 'serial'):
+        raise ConnectionError(f'no autopilot on {device} in tests')
+
+
+class Message:
+    """A protobuf message, fields take scalars or other messages only"""
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            if not isinstance(value, (int, float, str, bytes, Message)):
+                raise TypeError(
+                    f'bad argument type for {name} field of {type(self).__name__}: '
+                    f'{type(value).__name__}')
+            setattr(self, name, value)
+
+
+def message_class(name: str) -> type:
+    if name.startswith('_'):
+        raise AttributeError(name)
+    return type(name, (Message,), {})
+
+
+class APIStub:
+    def __init__(self, channel: Any):
+        self.channel = channel
+
+
+def px_uploader(firmware, ports):
+    raise RuntimeError(f'no board to flash {firmware} to through {ports} in tests')
+
+
+STUBS: Dict[str, Dict[str, Any]] = {
+    'autopilot_tools.logger': {'logger': logging.getLogger('autopilot_tools')},
+    'autopilot_tools.enums': {'Devices': Devices},
+    'autopilot_tools.parameters': {'ParametersInterface': ParametersInterface},
+    'autopilot_tools.px4.px_uploader': {'px_uploader': px_uploader},
+    'autopilot_tools.utilities.autopilot_configurator': {'SERIAL_PORTS': ['/dev/ttyACM0']},
+    'autopilot_tools.vehicle': {'Vehicle': Vehicle},
+    'pymavlink.mavutil': {'mavlink': type('mavlink', (), {
+        'MAV_CMD_REQUEST_AUTOPILOT_CAPABILITIES': 520})},
+    'simulator3d.API.zlrsimapi.api_pb2': {'__getattr__': message_class},
+    'simulator3d.API.zlrsimapi.api_pb2_grpc': {'APIStub': APIStub},
+}
+
+
+def install_stub(name: str, attributes: Dict[str, Any]) -> None:
+    try:
+        importlib.import_module(name)
+        return
+    except ImportError:
+        pass
+    parent = None
+    for depth in range(1, name.count('.') + 2):
+        module_name = '.'.join(name.split('.')[:depth])
+        module = sys.modules.get(module_name)
+        if module is None:
+            module = sys.modules[module_name] = ModuleType(module_name)
+            module.__path__ = []
+        if parent is not None:
+            setattr(parent, module_name.rsplit('.', 1)[-1], module)
+        parent = module
+    for attribute, value in attributes.items():
+        setattr(parent, attribute, value)
+
+
+for stub_name, stub_attributes in STUBS.items():
+    install_stub(stub_name, stub_attributes)
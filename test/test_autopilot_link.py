@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from typing import List, Optional
+
+import pytest
+
+from src.api.core import Result, StatusCode, current_request_id
+from src.core.autopilot_link import AutopilotIO, AutopilotLink, UdpPortMixin
+
+
+class FakeAutopilot:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.alive = True
+        self.vehicles = 0
+        self.closed: List[int] = []
+        self.checks = 0
+
+    async def connect(self) -> int:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('not up yet')
+        self.vehicles += 1
+        return self.vehicles
+
+    async def heartbeat(self, _vehicle: int) -> bool:
+        self.checks += 1
+        return self.alive
+
+    def close(self, vehicle: int) -> None:
+        self.closed.append(vehicle)
+
+
+class Vehicle:
+    """Connects the way autopilot_tools.vehicle.Vehicle does"""
+
+    def __init__(self):
+        self.device_path: Optional[str] = None
+        self.opened: List[str] = []
+        self.mav = None
+
+    def connect(self, device: str = 'serial'):
+        if device == 'udp':
+            self.device_path = 'udpin:localhost:14540'
+            self._connect_once()
+        self.mav = object()
+
+    def _connect_once(self):
+        self.opened.append(self.device_path)
+
+
+class OtherVehicle(Vehicle):
+    """Opens the default path no matter what"""
+
+    def connect(self, device: str = 'serial'):
+        self.device_path = 'udpin:localhost:14540'
+        self.opened.append(self.device_path)
+
+
+class NoConnectOnceVehicle:
+    """Opens the path in connect itself"""
+
+    def __init__(self):
+        self.device_path: Optional[str] = None
+
+    def connect(self, device: str = 'serial'):
+        self.device_path = 'udpin:localhost:14540'
+
+
+class UdpVehicle(UdpPortMixin, Vehicle):
+    pass
+
+
+class OtherUdpVehicle(UdpPortMixin, OtherVehicle):
+    pass
+
+
+class NoConnectOnceUdpVehicle(UdpPortMixin, NoConnectOnceVehicle):
+    pass
+
+
+def make_link(autopilot: FakeAutopilot) -> AutopilotLink:
+    return AutopilotLink(autopilot.connect, autopilot.heartbeat, autopilot.close,
+                         check_period=0.01, missed_heartbeats=2)
+
+
+class TestAutopilotLink:
+
+    def test_connects_in_background(self):
+        autopilot = FakeAutopilot(failures=2)
+        link = make_link(autopilot)
+
+        async def main():
+            link.start()
+            vehicle = await asyncio.wait_for(link.ready(), 5)
+            async with link.use() as used:
+                assert used == vehicle == 1
+            await link.stop()
+
+        asyncio.run(main())
+        assert link.stats()['connect_failures'] == 2
+        assert link.stats()['connects'] == 1
+        assert autopilot.closed == [1]
+        assert link.vehicle is None
+
+    def test_reconnects_without_heartbeat(self):
+        autopilot = FakeAutopilot()
+        link = make_link(autopilot)
+
+        async def main():
+            assert await link.ready() == 1
+            autopilot.alive = False
+            await asyncio.sleep(0.1)
+            autopilot.alive = True
+            vehicle = await asyncio.wait_for(link.ready(), 5)
+            await link.stop()
+            return vehicle
+
+        assert asyncio.run(main()) > 1
+        assert link.stats()['reconnects'] >= 1
+        assert link.stats()['missed_heartbeats'] >= 2
+
+    def test_no_checks_while_in_use(self):
+        autopilot = FakeAutopilot()
+        link = make_link(autopilot)
+
+        async def main():
+            async with link.use():
+                checks = autopilot.checks
+                await asyncio.sleep(0.1)
+                assert autopilot.checks == checks
+            await asyncio.sleep(0.1)
+            assert autopilot.checks > checks
+            await link.stop()
+
+        asyncio.run(main())
+
+
+class TestUdpPortMixin:
+
+    def test_port(self):
+        vehicle = UdpVehicle(udp_port=14541)
+        vehicle.connect('udp')
+        assert vehicle.opened == ['udpin:localhost:14541']
+        assert vehicle.mav is not None
+        vehicle.connect('udp')
+        assert vehicle.opened[-1] == 'udpin:localhost:14541'
+
+    def test_serial(self):
+        vehicle = UdpVehicle(udp_port=14541)
+        vehicle.connect('serial')
+        assert vehicle.opened == []
+        assert vehicle.mav is not None
+
+    def test_unsupported(self):
+        with pytest.raises(RuntimeError):
+            NoConnectOnceUdpVehicle(udp_port=14541)
+        with pytest.raises(RuntimeError):
+            OtherUdpVehicle(udp_port=14541).connect('udp')
+
+
+class TestAutopilotIO:
+
+    @staticmethod
+    def make_io(sent: List[Result]) -> AutopilotIO:
+        async def send(res: Result):
+            sent.append(res)
+        return AutopilotIO(send, progress_period=0.02)
+
+    def test_one_at_a_time(self):
+        calls = []
+
+        def call(name: str):
+            calls.append(f'{name} start')
+            time.sleep(0.05)
+            calls.append(f'{name} end')
+            return name
+
+        async def main():
+            io = self.make_io([])
+            results = await asyncio.gather(
+                io.run('serial', 'first', call, 'a'), io.run('serial', 'second', call, 'b'))
+            io.shutdown()
+            return results
+
+        assert asyncio.run(main()) == ['a', 'b']
+        assert calls == ['a start', 'a end', 'b start', 'b end']
+
+    def test_device_kept_after_cancel(self):
+        calls = []
+        release = threading.Event()
+
+        def blocked():
+            calls.append('blocked start')
+            release.wait(5)
+            calls.append('blocked end')
+
+        async def main():
+            io = self.make_io([])
+            first = asyncio.create_task(io.run('serial', 'blocked', blocked))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            second = asyncio.create_task(io.run('serial', 'next', calls.append, 'next'))
+            await asyncio.sleep(0.05)
+            # Still running in its thread, so the device is not free yet
+            assert calls == ['blocked start']
+            release.set()
+            await asyncio.wait_for(second, 5)
+            io.shutdown()
+
+        asyncio.run(main())
+        assert calls == ['blocked start', 'blocked end', 'next']
+
+    def test_progress(self):
+        sent = []
+
+        async def command():
+            current_request_id.set('42')
+            await io.run('udp', 'flash firmware', time.sleep, 0.1)
+
+        async def main():
+            await asyncio.create_task(command())
+            count = len(sent)
+            # Nobody waits for calls made in the background
+            await io.run('udp', 'heartbeat', time.sleep, 0.1)
+            assert len(sent) == count
+            io.shutdown()
+
+        io = self.make_io(sent)
+        asyncio.run(main())
+        assert sent
+        assert all(res.status == StatusCode.in_progress and res.request_id == '42'
+                   for res in sent)
+        assert sent[0].message['autopilot_io'] == 'flash firmware'
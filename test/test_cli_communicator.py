@@ -0,0 +1,40 @@
+import asyncio
+import json
+
+from src.api.core import AgentSpawn, Opcodes, Pose
+from src.api.packable_dataclass import BaseEvent
+from src.communicators.cli_communicator import CliCommunicator
+
+POSITION = {
+    'transform': {
+        'position': {'x': 10, 'y': 0, 'z': 0},
+        'rotation': {'x': 0, 'y': 0, 'z': 0}
+    },
+    'velocity': {'x': 0, 'y': 0, 'z': 0},
+    'angular_velocity': {'x': 0, 'y': 0, 'z': 0}
+}
+
+
+class TestCliCommunicator:
+
+    def test_spawn_agents(self):
+        opcode = {'spawn_agents': {'agents': [
+            {'agent_name': 'octo_amazon', 'position': POSITION},
+            {'agent_name': 'vtol_seeker', 'position': POSITION},
+        ]}}
+        com = CliCommunicator([[json.dumps(opcode)]])
+        asyncio.run(com.setup())
+
+        cmd, = com.command_list
+        assert cmd.opcode == Opcodes.spawn_agents
+        assert [type(a) for a in cmd.kwargs['agents']] == [AgentSpawn, AgentSpawn]
+        assert isinstance(cmd.kwargs['agents'][1].position, Pose)
+        assert BaseEvent.unpack(cmd.pack()) == cmd
+
+    def test_optional_args_left_out(self):
+        opcode = {'get_logs': {'source': 'hitl', 'tail': 20}}
+        com = CliCommunicator([[json.dumps(opcode)]])
+        asyncio.run(com.setup())
+
+        cmd, = com.command_list
+        assert cmd.kwargs == {'source': 'hitl', 'tail': 20}
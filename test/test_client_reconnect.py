@@ -0,0 +1,215 @@
+import asyncio
+from typing import List
+
+import websockets
+
+from src.api.core import Command, Opcodes, Result, StatusCode
+from src.api.websocket_connection import websocket_client
+from src.api.websocket_connection.messages import Greeting
+from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.wire_format import encode
+from src.api.websocket_connection.websocket_server import Server
+
+
+def result(i: int) -> Result:
+    return Result(status=StatusCode.ok, message={'i': i}, request_id=str(i))
+
+
+def reconnecting_client(port: int, **kwargs) -> Client:
+    return Client(host='localhost', port=port, uuid='w', name='worker', reconnect=True,
+                  backoff_min=0.05, backoff_max=0.1, **kwargs)
+
+
+async def received(srv: Server, n: int) -> List[str]:
+    return [(await asyncio.wait_for(srv.recv(), 5))[1].request_id for _ in range(n)]
+
+
+async def wait_online(client: Client):
+    while not client.stats()['connected']:
+        await asyncio.sleep(0.01)
+
+
+class TestClientReconnect:
+
+    def test_resume(self):
+        async def main():
+            srv = Server(host='localhost', port=18777)
+            ws_srv = await srv.run(blocking=False)
+            client = reconnecting_client(18777)
+            await client.connect()
+            for i in range(3):
+                await client.send(result(i))
+            got = await received(srv, 3)
+            await srv.workers['w'].connection.close()
+            await asyncio.sleep(0.01)
+            # Sent while there is no connection
+            for i in range(3, 6):
+                await client.send(result(i))
+            await wait_online(client)
+            got += await received(srv, 3)
+            stats = client.stats()
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got, stats, srv.stats()
+
+        got, stats, srv_stats = asyncio.run(main())
+        assert got == [str(i) for i in range(6)]
+        assert stats['reconnects'] == 1
+        assert stats['last_reconnect_time'] > 0
+        assert stats['resent'] == 0
+        assert srv_stats['resumed'] == 1
+
+    def test_resend_lost(self):
+        async def main():
+            srv = Server(host='localhost', port=18778)
+            ws_srv = await srv.run(blocking=False)
+            client = reconnecting_client(18778)
+            await client.connect()
+            for i in range(3):
+                await client.send(result(i))
+            got = await received(srv, 3)
+            await srv.workers['w'].connection.close()
+            # As if the last message did not make it before the connection dropped
+            srv.sessions['w'].received -= 1
+            await asyncio.sleep(0.01)
+            await wait_online(client)
+            await client.send(result(3))
+            got += await received(srv, 2)
+            stats = client.stats()
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got, stats
+
+        got, stats = asyncio.run(main())
+        # Got twice, but only because the server lost it
+        assert got == ['0', '1', '2', '2', '3']
+        assert stats['resent'] == 1
+
+    def test_request_across_resume(self):
+        async def main():
+            srv = Server(host='localhost', port=18789)
+            ws_srv = await srv.run(blocking=False)
+            client = reconnecting_client(18789)
+            await client.connect()
+            while 'w' not in srv.workers:
+                await asyncio.sleep(0.01)
+            request = asyncio.create_task(srv.request('w', Command(opcode=Opcodes.noop)))
+            cmd = await asyncio.wait_for(client.recv(), 5)
+            await srv.workers['w'].connection.close()
+            await asyncio.sleep(0.01)
+            # The reply is sent once the link is back, over the new connection
+            await client.send(Result(status=StatusCode.ok, request_id=cmd.request_id))
+            got = await asyncio.wait_for(request, 5)
+            stats = client.stats()
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got, stats, srv.stats()
+
+        got, stats, srv_stats = asyncio.run(main())
+        assert got.status == StatusCode.ok
+        assert stats['reconnects'] == 1
+        assert srv_stats['resumed'] == 1
+
+    def test_server_restart(self):
+        async def main():
+            srv = Server(host='localhost', port=18779)
+            ws_srv = await srv.run(blocking=False)
+            client = reconnecting_client(18779)
+            await client.connect()
+            await client.send(result(0))
+            await received(srv, 1)
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            await asyncio.sleep(0.01)
+            await client.send(result(1))
+            await asyncio.sleep(0.2)
+            srv = Server(host='localhost', port=18779)
+            ws_srv = await srv.run(blocking=False)
+            await wait_online(client)
+            await client.send(result(2))
+            got = await received(srv, 2)
+            stats = client.stats()
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got, stats
+
+        got, stats = asyncio.run(main())
+        # Nothing the old server got is sent to the new one
+        assert got == ['1', '2']
+        assert stats['connect_failures'] > 0
+
+    def test_outbox_file(self, tmp_path):
+        path = str(tmp_path / 'outbox')
+
+        async def offline():
+            client = reconnecting_client(18780, outbox_path=path)
+            connecting = asyncio.create_task(client.connect())
+            await asyncio.sleep(0.01)
+            for i in range(2):
+                await client.send(result(i))
+            connecting.cancel()
+
+        async def online():
+            srv = Server(host='localhost', port=18780)
+            ws_srv = await srv.run(blocking=False)
+            client = reconnecting_client(18780, outbox_path=path)
+            await client.connect()
+            got = await received(srv, 2)
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got
+
+        asyncio.run(offline())
+        assert asyncio.run(online()) == ['0', '1']
+        assert not (tmp_path / 'outbox').exists()
+
+    def test_outbox_size(self):
+        async def main():
+            client = reconnecting_client(18781, outbox_size=2)
+            connecting = asyncio.create_task(client.connect())
+            await asyncio.sleep(0.01)
+            for i in range(3):
+                await client.send(result(i))
+            connecting.cancel()
+            return client.stats()
+
+        stats = asyncio.run(main())
+        assert stats['dropped'] == 1
+        assert stats['unsent'] == 2
+
+    def test_drop_while_resuming(self, monkeypatch):
+        monkeypatch.setattr(websocket_client, 'RESUME_TIMEOUT', 0.2)
+        connections = []
+
+        async def handler(websocket):
+            connections.append(websocket)
+            await websocket.recv()
+            if len(connections) == 2:
+                # Dropped before the worker knows where the session stands
+                return
+            await websocket.send(encode(Greeting(name='', uuid='', session='s', delivered=0)))
+            await websocket.wait_closed()
+
+        async def main():
+            ws_srv = await websockets.serve(handler, 'localhost', 18788)
+            client = reconnecting_client(18788)
+            await client.connect()
+            await connections[0].close()
+            await asyncio.sleep(0.01)
+            await asyncio.wait_for(wait_online(client), 5)
+            # Longer than the resume timeout, for a second reconnect loop to show up
+            await asyncio.sleep(0.5)
+            stats = client.stats()
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return len(connections), stats
+
+        connections_made, stats = asyncio.run(main())
+        assert connections_made == 3
+        assert stats['reconnects'] == 1
@@ -0,0 +1,89 @@
+import asyncio
+from typing import Tuple
+
+from src.api.core import Result, StatusCode, Opcodes, current_opcode
+from src.api.websocket_connection.compression import Compression
+from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.websocket_server import Server
+
+MISSION_RESULT = Result(
+    status=StatusCode.ok,
+    message={'mission': [{'item': i, 'reached': True, 'error_m': 0.5} for i in range(200)]})
+
+
+async def send_result(port: int, result: Result, client_compression: Compression,
+                      server_compression: Compression) -> Tuple[Result, Client]:
+    srv = Server(host='localhost', port=port, compression=server_compression)
+    ws_srv = await srv.run(blocking=False)
+    client = Client(host='localhost', port=port, uuid='w', compression=client_compression)
+    await client.connect()
+    current_opcode.set(Opcodes.start_mission)
+    await client.send(result)
+    _, got = await asyncio.wait_for(srv.recv(), 5)
+    await client.close()
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return got, client
+
+
+class TestCompression:
+
+    def test_compressed(self):
+        got, client = asyncio.run(send_result(
+            18782, MISSION_RESULT, Compression(), Compression()))
+        assert got == MISSION_RESULT
+        sizes = client.frame_sizes.stats()[Opcodes.start_mission]
+        assert sizes['compressed'] == 1
+        assert sizes['wire_bytes'] * 5 < sizes['raw_bytes']
+        assert client.stats()['frames']['Greeting']['compressed'] == 0
+
+    def test_below_threshold(self):
+        small = Result(status=StatusCode.ok, message={'ok': True})
+        got, client = asyncio.run(send_result(
+            18783, small, Compression(threshold=10 ** 6), Compression()))
+        assert got == small
+        sizes = client.frame_sizes.stats()[Opcodes.start_mission]
+        assert sizes['compressed'] == 0
+        assert sizes['wire_bytes'] == sizes['raw_bytes']
+
+    def test_off(self):
+        for port, client_compression, server_compression in [
+                (18784, Compression(window_bits=0), Compression()),
+                (18785, Compression(), Compression(window_bits=0))]:
+            got, client = asyncio.run(send_result(
+                port, MISSION_RESULT, client_compression, server_compression))
+            assert got == MISSION_RESULT
+            assert client.frame_sizes.stats()[Opcodes.start_mission]['ratio'] == 1
+
+    def test_outbox_under_opcode(self):
+        async def main():
+            client = Client(host='localhost', port=18791, uuid='w', reconnect=True,
+                            backoff_min=0.05, backoff_max=0.1)
+            connecting = asyncio.create_task(client.connect())
+            await asyncio.sleep(0.01)
+
+            async def command():
+                current_opcode.set(Opcodes.start_mission)
+                await client.send(MISSION_RESULT)
+
+            # Sent from the outbox once connected, after the command is over
+            await asyncio.create_task(command())
+            srv = Server(host='localhost', port=18791)
+            ws_srv = await srv.run(blocking=False)
+            await connecting
+            _, got = await asyncio.wait_for(srv.recv(), 5)
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return got, client.frame_sizes.stats()
+
+        got, frames = asyncio.run(main())
+        assert got == MISSION_RESULT
+        assert frames[Opcodes.start_mission]['messages'] == 1
+        assert 'Result' not in frames
+
+    def test_window_and_level(self):
+        got, client = asyncio.run(send_result(
+            18786, MISSION_RESULT, Compression(window_bits=9, level=1), Compression()))
+        assert got == MISSION_RESULT
+        assert client.frame_sizes.stats()[Opcodes.start_mission]['compressed'] == 1
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from src.utils import FairMerge
+
+
+class TestFairMerge:
+
+    def test_sources_take_turns(self):
+        async def main():
+            merge = FairMerge(size=100)
+            for i in range(10):
+                await merge.put('busy', i)
+            await merge.put('quiet', 0)
+            await merge.put('quiet', 1)
+            return [await merge.__anext__() for _ in range(5)]
+
+        assert asyncio.run(main()) == [
+            ('busy', 0), ('quiet', 0), ('busy', 1), ('quiet', 1), ('busy', 2)]
+
+    def test_bounded(self):
+        async def main():
+            merge = FairMerge(size=3)
+            producer = asyncio.create_task(merge.pump('source', aiter_range(10)))
+            await asyncio.sleep(0.01)
+            buffered = len(merge)
+            received = [item async for _, item in take(merge, 10)]
+            await producer
+            return buffered, received
+
+        buffered, received = asyncio.run(main())
+        assert buffered == 3
+        assert received == list(range(10))
+
+    def test_fail_after_drain(self):
+        async def main():
+            merge = FairMerge(size=10)
+            await merge.put('source', 1)
+            merge.fail(ConnectionError('gone'))
+            assert await merge.__anext__() == ('source', 1)
+            await merge.__anext__()
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(main())
+
+
+async def aiter_range(n):
+    for i in range(n):
+        yield i
+
+
+async def take(merge, n):
+    for _ in range(n):
+        yield await merge.__anext__()
@@ -0,0 +1,35 @@
+import json
+
+from src.core.firmware_cache import FirmwareCache, FirmwareImage, BoardVersion
+
+GIT_HASH = '0123456789abcdef0123456789abcdef01234567'
+
+
+class TestFirmwareCache:
+
+    def test_fingerprint(self, tmp_path):
+        px4 = json.dumps({'board_id': 50, 'git_hash': GIT_HASH, 'image': 'eJw='})
+        path = tmp_path / 'fw.px4'
+        path.write_text(px4)
+        from_file = FirmwareImage.of(str(path))
+        assert from_file == FirmwareImage.of(px4)
+        assert from_file.git_hash == GIT_HASH
+        assert FirmwareImage.of('not json').git_hash is None
+
+    def test_skip_same_image(self):
+        cache = FirmwareCache()
+        image = FirmwareImage('sha', GIT_HASH)
+        assert not cache.is_flashed('board', image)
+        cache.record('board', image, 12.5)
+        assert cache.is_flashed('board', image)
+        assert cache.is_flashed('board', image, BoardVersion('board', GIT_HASH[:16]))
+        assert not cache.is_flashed('board', FirmwareImage('other', GIT_HASH))
+        assert not cache.is_flashed('other board', image)
+
+    def test_flashed_by_someone_else(self):
+        cache = FirmwareCache()
+        image = FirmwareImage('sha', GIT_HASH)
+        cache.record('board', image, 12.5)
+        assert not cache.is_flashed('board', image, BoardVersion('board', 'fedcba9876543210'))
+        # Nothing to compare with, the content hash decides
+        assert cache.is_flashed('board', image, BoardVersion('board', None))
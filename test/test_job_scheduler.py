@@ -0,0 +1,121 @@
+import asyncio
+from typing import List, Tuple
+
+from src.api.core import Command, Opcodes, StatusCode
+from src.api.websocket_connection.job_scheduler import JobScheduler
+from src.api.websocket_connection.websocket_server import Server
+from src.communicators.wss_communicator import WssCommunicator
+from src.core.dummy_sim_core import DummySimCore
+
+JOB = [
+    Command(opcode=Opcodes.start_sim, kwargs={'mode': 'sitl'}),
+    Command(opcode=Opcodes.upload_mission, kwargs={'mission': 'plan'}),
+    Command(opcode=Opcodes.stop_sim),
+]
+
+
+async def start_workers(port: int, n: int, opcode_delay: float = 0.01,
+                        capacity: int = 1) -> Tuple[List[DummySimCore], List[asyncio.Task]]:
+    workers = [
+        DummySimCore(
+            WssCommunicator, remote_host='localhost', remote_port=port,
+            name=f'worker {i}', uuid=str(i), cert=None, is_local_wss_enabled=False,
+            capacity=capacity, opcode_delay=opcode_delay)
+        for i in range(n)
+    ]
+    tasks = [asyncio.create_task(worker.serve()) for worker in workers]
+    return workers, tasks
+
+
+async def wait_joined(scheduler: JobScheduler, n: int):
+    while len(scheduler.loads) < n:
+        await asyncio.sleep(0.01)
+
+
+async def stop(tasks: List[asyncio.Task], ws_srv):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    ws_srv.close()
+    await ws_srv.wait_closed()
+
+
+class TestJobScheduler:
+
+    def test_many_workers(self):
+        async def main():
+            srv = Server(host='localhost', port=18770)
+            scheduler = JobScheduler(srv)
+            ws_srv = await srv.run(blocking=False)
+            _, tasks = await start_workers(18770, 200)
+            await wait_joined(scheduler, 200)
+            results = await asyncio.gather(*[scheduler.run(JOB) for _ in range(600)])
+            stats = scheduler.stats()
+            await stop(tasks, ws_srv)
+            return results, stats
+
+        results, stats = asyncio.run(main())
+        assert all(r.status == StatusCode.ok for job in results for r in job)
+        assert stats['done'] == 600
+        # Least loaded first, so the jobs are spread over all of the workers, about evenly
+        done = [worker['jobs_done'] for worker in stats['workers'].values()]
+        assert sum(done) == 600
+        assert min(done) > 0 and max(done) <= 6
+        assert all(worker['utilization'] > 0 for worker in stats['workers'].values())
+
+    def test_queue_and_capacity(self):
+        async def main():
+            srv = Server(host='localhost', port=18771)
+            scheduler = JobScheduler(srv)
+            ws_srv = await srv.run(blocking=False)
+            _, tasks = await start_workers(18771, 2, capacity=2)
+            await wait_joined(scheduler, 2)
+            jobs = [scheduler.submit(JOB) for _ in range(6)]
+            queued = scheduler.stats()['queued']
+            await asyncio.gather(*[job.future for job in jobs])
+            await stop(tasks, ws_srv)
+            return jobs, queued
+
+        jobs, queued = asyncio.run(main())
+        # Two slots on each of the two workers
+        assert queued == 2
+        assert {(job.worker, job.slot) for job in jobs[:4]} == {
+            ('0', 0), ('0', 1), ('1', 0), ('1', 1)}
+
+    def test_requeue_on_disconnect(self):
+        async def main():
+            srv = Server(host='localhost', port=18772)
+            scheduler = JobScheduler(srv)
+            ws_srv = await srv.run(blocking=False)
+            workers, tasks = await start_workers(18772, 3, opcode_delay=0.1)
+            await wait_joined(scheduler, 3)
+            jobs = [scheduler.submit(JOB) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            # Gone for good, instead of connecting again
+            workers[0].communicator.wss_client.reconnect = False
+            await workers[0].communicator.wss_client.connection.close()
+            results = await asyncio.gather(*[job.future for job in jobs])
+            stats = scheduler.stats()
+            await stop(tasks, ws_srv)
+            return jobs, results, stats
+
+        jobs, results, stats = asyncio.run(main())
+        assert all(r.status == StatusCode.ok for job in results for r in job)
+        assert stats['requeued'] == 1
+        assert '0' not in stats['workers']
+        assert sorted(job.attempts for job in jobs) == [0, 0, 1]
+
+    def test_eligible(self):
+        async def main():
+            srv = Server(host='localhost', port=18773)
+            scheduler = JobScheduler(srv)
+            ws_srv = await srv.run(blocking=False)
+            _, tasks = await start_workers(18773, 3)
+            await wait_joined(scheduler, 3)
+            jobs = [scheduler.submit(JOB, eligible=lambda worker: worker.uuid == '2')
+                    for _ in range(3)]
+            await asyncio.gather(*[job.future for job in jobs])
+            await stop(tasks, ws_srv)
+            return jobs
+
+        assert {job.worker for job in asyncio.run(main())} == {'2'}
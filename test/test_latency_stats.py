@@ -0,0 +1,13 @@
+from src.utils import LatencyStats
+
+
+class TestLatencyStats:
+
+    def test_record(self):
+        stats = LatencyStats()
+        assert stats.to_dict() == {'count': 0, 'last': 0.0, 'max': 0.0, 'avg': 0.0}
+        for seconds in [0.2, 0.6, 0.1]:
+            stats.record(seconds)
+        assert stats.to_dict() == {'count': 3, 'last': 0.1, 'max': 0.6, 'avg': 0.3}
+        stats.record(0.00012)
+        assert stats.to_dict(4)['last'] == 0.0001
@@ -0,0 +1,67 @@
+import os
+
+from src.core.log_buffer import LogRingBuffer, LogSpillFile
+from src.core.process_monitor import LogLine
+
+
+def line(i: int, source: str = 'test') -> LogLine:
+    return LogLine(float(i), source, f'line {i}')
+
+
+def texts(lines) -> list:
+    return [log_line.text for _, log_line in lines]
+
+
+class TestLogRingBuffer:
+
+    def test_range_and_tail(self):
+        log = LogRingBuffer(capacity=1024, max_lines=100)
+        for i in range(10):
+            log.append(line(i, 'a' if i % 2 else 'b'))
+        assert len(log) == 10
+        assert texts(log.range(3, 6)) == ['line 3', 'line 4', 'line 5']
+        assert [n for n, _ in log.tail(2)] == [8, 9]
+        assert log.range(9)[0][1] == LogLine(9.0, 'a', 'line 9')
+        assert log.range(8, 9)[0][1].source == 'b'
+
+    def test_evicted_by_bytes(self):
+        log = LogRingBuffer(capacity=64, max_lines=100)
+        for i in range(100):
+            log.append(line(i))
+        # Lines wrap around the end of the buffer and are still read back whole
+        assert list(log)[-1].text == 'line 99'
+        assert sum(len(log_line.text) for log_line in log) <= 64
+        assert log.next_line == 100
+        assert texts(log.range(0, 3)) == []
+        assert all(log_line.text == f'line {n}' for n, log_line in log.range())
+
+    def test_evicted_by_lines(self):
+        log = LogRingBuffer(capacity=1024, max_lines=5)
+        for i in range(12):
+            log.append(line(i))
+        assert log.first_line == 7
+        assert texts(log.range()) == [f'line {i}' for i in range(7, 12)]
+
+    def test_grep(self):
+        log = LogRingBuffer(capacity=4096, max_lines=1000)
+        for i in range(100):
+            log.append(line(i))
+        assert texts(log.grep(r'line \d*7$')) == [f'line {i}' for i in range(7, 100, 10)]
+        assert texts(log.grep(r'line \d*7$', limit=2)) == ['line 87', 'line 97']
+
+    def test_line_longer_than_buffer(self):
+        log = LogRingBuffer(capacity=16, max_lines=10)
+        log.append(LogLine(0.0, 'test', 'x' * 40))
+        assert list(log) == [LogLine(0.0, 'test', 'x' * 16)]
+
+    def test_spill(self, tmp_path):
+        path = str(tmp_path / 'sim.log')
+        spill = LogSpillFile(path, max_bytes=200, backups=2)
+        log = LogRingBuffer(capacity=64, max_lines=10, spill=spill)
+        for i in range(100):
+            log.append(line(i))
+        spill.close()
+        assert os.path.exists(f'{path}.1') and os.path.exists(f'{path}.2')
+        assert not os.path.exists(f'{path}.3')
+        with open(path, encoding='utf-8') as f:
+            assert f.read().splitlines()[-1].endswith('[test] line 99')
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import threading
+from typing import List
+
+from src.api.core import Result, StatusCode, Opcodes, current_request_id, current_opcode
+from src.core.log_forwarding import WssLoggerHandler, OverflowPolicy
+
+
+class SlowLink:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent: List[Result] = []
+        self.opcodes: List[str] = []
+
+    async def send(self, res: Result):
+        await asyncio.sleep(self.delay)
+        self.sent.append(res)
+        self.opcodes.append(current_opcode.get())
+
+    def messages(self) -> List[str]:
+        return [m for res in self.sent for m in res.message['logged_messages']]
+
+
+def make_logger(handler: WssLoggerHandler, name: str) -> logging.Logger:
+    log = logging.getLogger(f'test_log_forwarding.{name}')
+    log.handlers = [handler]
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    return log
+
+
+class TestLogForwarding:
+
+    def test_batching(self):
+        link = SlowLink()
+        handler = WssLoggerHandler(logging.INFO, link.send, batch_size=100, flush_interval=0.05)
+        log = make_logger(handler, 'batching')
+
+        async def main():
+            for i in range(1000):
+                log.info(f'line {i}')
+            await asyncio.sleep(0.2)
+            await handler.stop()
+
+        asyncio.run(main())
+        assert link.messages() == [f'line {i}' for i in range(1000)]
+        assert len(link.sent) == 10
+        assert all(res.status == StatusCode.in_progress for res in link.sent)
+        assert handler.stats()['sent'] == 1000
+
+    def test_stop_while_sending(self):
+        link = SlowLink(delay=0.1)
+        handler = WssLoggerHandler(logging.INFO, link.send, flush_interval=0.01)
+        log = make_logger(handler, 'stop')
+
+        async def main():
+            for i in range(10):
+                log.info(f'line {i}')
+            # The flusher has taken the batch and is sending it
+            await asyncio.sleep(0.05)
+            log.info('last line')
+            await handler.stop()
+
+        asyncio.run(main())
+        assert link.messages() == [f'line {i}' for i in range(10)] + ['last line']
+        assert link.sent[-1].message['logged_message'] == 'last line'
+
+    def test_time_window(self):
+        link = SlowLink()
+        handler = WssLoggerHandler(logging.INFO, link.send, flush_interval=0.01)
+        log = make_logger(handler, 'time_window')
+
+        async def main():
+            log.info('lonely line')
+            await asyncio.sleep(0.1)
+            assert link.messages() == ['lonely line']
+            await handler.stop()
+
+        asyncio.run(main())
+
+    def test_grouped_by_request(self):
+        link = SlowLink()
+        handler = WssLoggerHandler(logging.INFO, link.send, flush_interval=0.01)
+        log = make_logger(handler, 'grouped')
+
+        async def command(request_id: str):
+            current_request_id.set(request_id)
+            for i in range(3):
+                log.info(f'{request_id} {i}')
+
+        async def main():
+            await asyncio.gather(
+                asyncio.create_task(command('a')), asyncio.create_task(command('b')))
+            await handler.stop()
+
+        asyncio.run(main())
+        by_request = {res.request_id: res.message['logged_messages'] for res in link.sent}
+        assert by_request == {'a': ['a 0', 'a 1', 'a 2'], 'b': ['b 0', 'b 1', 'b 2']}
+
+    def test_sent_under_opcode(self):
+        link = SlowLink()
+        handler = WssLoggerHandler(logging.INFO, link.send, flush_interval=0.01)
+        log = make_logger(handler, 'opcode')
+
+        async def command(opcode: str):
+            current_opcode.set(opcode)
+            log.info(opcode)
+
+        async def main():
+            # Both are logged before the flusher runs, it sends them in one go
+            await asyncio.create_task(command(Opcodes.start_sim))
+            await asyncio.create_task(command(Opcodes.start_mission))
+            await handler.stop()
+            return current_opcode.get()
+
+        assert asyncio.run(main()) is None
+        assert link.opcodes == [Opcodes.start_sim, Opcodes.start_mission]
+        assert [res.message['logged_messages'] for res in link.sent] == [
+            [Opcodes.start_sim], [Opcodes.start_mission]]
+
+    def run_overflow(self, policy: OverflowPolicy):
+        link = SlowLink(delay=0.05)
+        handler = WssLoggerHandler(
+            logging.INFO, link.send, queue_size=100, overflow_policy=policy,
+            batch_size=50, flush_interval=0.01)
+        log = make_logger(handler, str(policy))
+
+        async def main():
+            for i in range(1000):
+                log.info(f'line {i}')
+            await handler.stop()
+
+        asyncio.run(main())
+        stats = handler.stats()
+        assert stats['received'] == 1000
+        assert stats['sent'] + stats['dropped'] + stats['sampled_out'] == 1000
+        assert sum(res.message['dropped'] for res in link.sent) == \
+            stats['dropped'] + stats['sampled_out']
+        return link.messages(), stats
+
+    def test_drop_oldest(self):
+        messages, stats = self.run_overflow(OverflowPolicy.drop_oldest)
+        assert messages == [f'line {i}' for i in range(900, 1000)]
+        assert stats['dropped'] == 900
+
+    def test_drop_newest(self):
+        messages, stats = self.run_overflow(OverflowPolicy.drop_newest)
+        assert messages == [f'line {i}' for i in range(100)]
+        assert stats['dropped'] == 900
+
+    def test_sample(self):
+        messages, stats = self.run_overflow(OverflowPolicy.sample)
+        assert messages[:50] == [f'line {i}' for i in range(50)]
+        assert stats['sampled_out'] > 0
+        # Sampled records are spread across the whole run
+        assert messages[-1] != 'line 99'
+
+    def test_from_threads(self):
+        link = SlowLink()
+        handler = WssLoggerHandler(logging.INFO, link.send, flush_interval=0.01)
+        log = make_logger(handler, 'threads')
+
+        def worker(n: int):
+            for i in range(100):
+                log.info(f'{n} {i}')
+
+        async def main():
+            log.info('start')
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+            for t in threads:
+                t.start()
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [t.join() for t in threads])
+            await handler.stop()
+
+        asyncio.run(main())
+        assert len(link.messages()) == 401
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from src.core.mission_cache import MissionCache, read_mission, parse_mission
+
+PLAN = {
+    'fileType': 'Plan',
+    'groundStation': 'QGroundControl',
+    'geoFence': {'circles': [], 'polygons': [{'polygon': [[0, 0], [0, 1], [1, 1]]}]},
+    'mission': {'items': [{'command': 22}, {'command': 16}, {'command': 20}]},
+    'rallyPoints': {'points': []},
+}
+
+
+class TestMissionCache:
+
+    def test_same_plan_written_differently(self, tmp_path):
+        path = tmp_path / 'mission.plan'
+        path.write_text(json.dumps(PLAN, indent=4))
+        from_file = parse_mission(read_mission(str(path)))
+        assert from_file == parse_mission(read_mission(json.dumps(PLAN)))
+        assert from_file.items == {'mission': 3, 'geofence': 1, 'rally': 0}
+
+    def test_not_a_plan(self):
+        with pytest.raises(ValueError):
+            parse_mission(b'{"mission": {}}')
+        with pytest.raises(ValueError):
+            parse_mission(b'not json')
+
+    def test_skip_loaded(self):
+        cache = MissionCache()
+        plan = cache.plan(json.dumps(PLAN).encode())
+        assert not cache.is_loaded(plan)
+        cache.record(plan)
+        assert cache.is_loaded(cache.plan(json.dumps(PLAN).encode()))
+        other = cache.plan(json.dumps({**PLAN, 'mission': {'items': []}}).encode())
+        assert not cache.is_loaded(other)
+        cache.forget()
+        assert not cache.is_loaded(plan)
+
+    def test_plans_lru(self):
+        cache = MissionCache(max_plans=2)
+        contents = [json.dumps({**PLAN, 'version': i}).encode() for i in range(3)]
+        cache.plan(contents[0])
+        cache.plan(contents[1])
+        cache.plan(contents[0])
+        cache.plan(contents[2])
+        assert cache.counters['parsed'] == 3
+        assert cache.counters['plan_hits'] == 1
+        cache.plan(contents[0])
+        cache.plan(contents[1])
+        assert cache.counters['parsed'] == 4
+        assert cache.stats()['plans'] == 2
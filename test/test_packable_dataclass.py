@@ -1,9 +1,11 @@
 import math
+import timeit
 from dataclasses import dataclass
+from enum import Enum
 from math import pi, e, tau
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-from src.api.packable_dataclass import BaseEvent
+from src.api.packable_dataclass import BaseEvent, optional_field
 
 
 @dataclass
@@ -35,6 +37,33 @@ class AContainerRecurseDataclass(BaseEvent):
     dataclass_list_recursive: List[AContainerDataclass]
 
 
+class Color(Enum):
+    red = 'red'
+    green = 'green'
+
+
+@dataclass
+class AEnum(BaseEvent):
+    color: Color
+    a_field: A
+
+
+# Only bare containers here, so that the reflective reference implementation can handle it
+@dataclass
+class ALog(BaseEvent):
+    color: Color
+    a_field: A
+    message: dict
+    lines: list
+
+
+@dataclass
+class AOptional(BaseEvent):
+    int_field: int
+    added_later: Optional[int] = optional_field(default=None)
+    added_list: List[int] = optional_field(default_factory=list)
+
+
 phi = (1 + math.sqrt(5)) / 2
 
 
@@ -125,3 +154,59 @@ class TestPackable:
             ]
         )
         assert TestPackable.assert_pack_unpack(a)
+
+    def test_enum_restored(self):
+        a = AEnum(color=Color.green, a_field=A(int_field=1, float_field=pi))
+        packed = a.pack()
+        assert packed['data']['color'] == {'green': 'green'}
+        assert BaseEvent.unpack(packed) == a
+
+    def test_optional_fields(self):
+        packed = AOptional(int_field=1).pack()
+        assert packed['data'] == {'int_field': 1}
+        assert packed['data'] == BaseEvent._to_dict_recurse({}, AOptional(int_field=1))
+        assert BaseEvent.unpack(packed) == AOptional(int_field=1)
+        a = AOptional(int_field=1, added_later=0, added_list=[2])
+        assert a.pack()['data'] == {'int_field': 1, 'added_later': 0, 'added_list': [2]}
+        assert BaseEvent.unpack(a.pack()) == a
+
+    def test_unknown_fields_ignored(self):
+        packed = A(int_field=1, float_field=pi).pack()
+        packed['data']['field_from_the_future'] = 42
+        assert BaseEvent.unpack(packed) == A(int_field=1, float_field=pi)
+
+
+class TestCodec:
+    N = 2000
+
+    @staticmethod
+    def make_message() -> ALog:
+        return ALog(
+            color=Color.red,
+            a_field=A(int_field=1, float_field=pi),
+            message={'logged_message': 'x' * 80, 'nested': {'answer': 42, 'a': A(2, e)}},
+            lines=[f'[INFO] line {i}' for i in range(50)]
+        )
+
+    @staticmethod
+    def reference_pack(a: BaseEvent):
+        return {
+            'type': type(a).__name__,
+            'data': BaseEvent._to_dict_recurse({}, a)
+        }
+
+    def test_wire_compatible(self):
+        a = TestCodec.make_message()
+        assert a.pack() == TestCodec.reference_pack(a)
+
+    def test_round_trip(self):
+        a = TestCodec.make_message()
+        assert BaseEvent.unpack(a.pack()) == a
+
+    def test_throughput(self):
+        # Only prints the timings, which depend on how loaded the machine is
+        a = TestCodec.make_message()
+        old = timeit.timeit(
+            lambda: BaseEvent._from_dict_recurse(TestCodec.reference_pack(a)), number=self.N)
+        new = timeit.timeit(lambda: BaseEvent.unpack(a.pack()), number=self.N)
+        print(f'\nreflective: {self.N / old:.0f} msg/s, compiled: {self.N / new:.0f} msg/s')
@@ -0,0 +1,37 @@
+from src.core.param_cache import ParamCache, diff_params, needs_reboot, same_value
+
+DEFAULTS = {'MPC_XY_VEL_MAX': 12.0, 'SYS_AUTOSTART': 0, 'COM_RC_IN_MODE': 0, 'NAV_ACC_RAD': 2.0}
+
+
+class TestParamCache:
+
+    def test_float32_compare(self):
+        # What comes back from the autopilot is a float32
+        assert same_value(0.10000000149011612, 0.1)
+        assert not same_value(0.1, 0.2)
+        assert not same_value(None, 0)
+        assert same_value(3, 3.0)
+
+    def test_diff(self):
+        assert diff_params(DEFAULTS, {'MPC_XY_VEL_MAX': 12.0, 'NAV_ACC_RAD': 3}) == \
+            {'NAV_ACC_RAD': 3}
+
+    def test_previous_config_is_reverted(self):
+        cache = ParamCache()
+        board = cache.reset('board', DEFAULTS)
+        config = {'SYS_AUTOSTART': 4001, 'COM_RC_IN_MODE': 1}
+        first = diff_params(board.current, board.target(config))
+        board.current.update(first)
+        assert first == config
+
+        # The same config again costs nothing
+        assert not diff_params(board.current, board.target(config))
+        # Whatever the next config does not mention goes back to its default
+        second = diff_params(board.current, board.target({'SYS_AUTOSTART': 4001, 'NAV_ACC_RAD': 5}))
+        assert second == {'COM_RC_IN_MODE': 0, 'NAV_ACC_RAD': 5}
+
+    def test_needs_reboot(self):
+        assert needs_reboot(['NAV_ACC_RAD', 'SYS_AUTOSTART'])
+        assert needs_reboot(['MAV_0_CONFIG'])
+        assert not needs_reboot(['NAV_ACC_RAD', 'MPC_XY_VEL_MAX'])
+        assert not needs_reboot([])
@@ -0,0 +1,56 @@
+import asyncio
+import os
+from typing import Tuple
+
+from src.core.process_control import stop_process_group
+
+
+async def spawn(script: str) -> Tuple[asyncio.subprocess.Process, int]:
+    proc = await asyncio.create_subprocess_shell(
+        script, executable='/bin/bash', start_new_session=True,
+        stdout=asyncio.subprocess.PIPE)
+    # Wait for the script to get going, it prints the pid of its child
+    return proc, int((await proc.stdout.readline()).decode())
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Might be a zombie of an exited child, those don't count
+    with open(f'/proc/{pid}/stat', encoding='utf-8') as f:
+        return f.read().split()[2] != 'Z'
+
+
+class TestStopProcessGroup:
+
+    def test_sigterm(self):
+        async def main():
+            proc, child = await spawn('sleep 60 & echo $!; wait')
+            report = await stop_process_group(proc, grace_period=5)
+            await asyncio.sleep(0.1)
+            return report, child
+
+        report, child = asyncio.run(main())
+        assert report['signal'] == 'SIGTERM'
+        assert report['exited']
+        assert report['seconds'] < 5
+        assert not is_alive(child)
+
+    def test_escalates_to_sigkill(self):
+        async def main():
+            proc, child = await spawn("trap '' TERM; sleep 60 & echo $!; wait")
+            report = await stop_process_group(proc, grace_period=0.3)
+            await asyncio.sleep(0.1)
+            return report, child
+
+        report, child = asyncio.run(main())
+        assert report['signal'] == 'SIGKILL'
+        assert report['exited']
+        assert report['seconds'] < 3
+        assert not is_alive(child)
+
+    def test_not_started(self):
+        report = asyncio.run(stop_process_group(None))
+        assert report['exited'] and report['signal'] is None
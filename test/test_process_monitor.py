@@ -0,0 +1,75 @@
+import asyncio
+import sys
+from typing import List
+
+from src.core.process_monitor import StreamMonitor, LogLine, monitor_process
+
+
+def feed(chunks: List[bytes], max_line_length: int = 16) -> List[LogLine]:
+    lines = []
+
+    async def main():
+        stream = asyncio.StreamReader()
+        for chunk in chunks:
+            stream.feed_data(chunk)
+        stream.feed_eof()
+        await StreamMonitor(stream, 'test', lines.append, max_line_length=max_line_length).run()
+
+    asyncio.run(main())
+    return lines
+
+
+class TestStreamMonitor:
+
+    def test_partial_lines(self):
+        lines = feed([b'fir', b'st\nsecond\r\n\n', b'thi', b'rd'])
+        assert [line.text for line in lines] == ['first', 'second', 'third']
+        assert {line.source for line in lines} == {'test'}
+
+    def test_long_lines(self):
+        lines = feed([b'a' * 40 + b'\nshort\n'])
+        assert [line.text for line in lines] == ['a' * 16, 'a' * 16, 'a' * 8, 'short']
+
+    def test_broken_utf8(self):
+        assert feed([b'\xff\xfeok\n'])[0].text.endswith('ok')
+
+    def test_quiet_stderr_does_not_stall_stdout(self):
+        # The process writes way more than a pipe holds to stdout, and exits only
+        # after it is done, so it would hang if stdout was not drained on its own
+        script = ('import sys\n'
+                  'for i in range(200000): sys.stdout.write(f"line {i}\\n")\n'
+                  'sys.stdout.flush()\n'
+                  'sys.stderr.write("done\\n")\n')
+        lines = []
+
+        async def main():
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, '-c', script,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            monitors = monitor_process(proc, 'proc', lines.append)
+            await asyncio.wait_for(
+                asyncio.gather(*[m.run() for m in monitors.values()], proc.wait()), 30)
+            return monitors
+
+        monitors = asyncio.run(main())
+        stdout = [line.text for line in lines if line.source == 'proc:stdout']
+        assert stdout == [f'line {i}' for i in range(200000)]
+        assert [line.text for line in lines if line.source == 'proc:stderr'] == ['done']
+        assert monitors['proc:stdout'].stats()['lines'] == 200000
+
+    def test_overhead_budget(self):
+        lines = []
+
+        async def main():
+            stream = asyncio.StreamReader(limit=2 ** 24)
+            stream.feed_data(b''.join(f'[INFO] frame {i} rendered\n'.encode()
+                                      for i in range(100000)))
+            stream.feed_eof()
+            monitor = StreamMonitor(stream, 'bench', lines.append)
+            await monitor.run()
+            return monitor.stats()
+
+        stats = asyncio.run(main())
+        print(f'\n{stats["ns_per_line"]} ns per line')
+        assert stats['lines'] == 100000
+        assert stats['within_budget']
@@ -0,0 +1,67 @@
+import asyncio
+import sys
+
+from src.core.log_buffer import LogRingBuffer
+from src.core.process_monitor import LogLine
+from src.core.readiness import (
+    TcpPortProbe, LogPatternProbe, UptimeProbe, CallableProbe, wait_ready)
+
+PORT = 18768
+
+
+class TestReadiness:
+
+    def test_all_probes_pass(self):
+        log = LogRingBuffer(capacity=1024, max_lines=100)
+        log.append(LogLine(0, 'hitl', 'ready from an earlier run'))
+
+        async def main():
+            async def late_start():
+                await asyncio.sleep(0.2)
+                log.append(LogLine(0, 'hitl', 'starting'))
+                log.append(LogLine(0, 'hitl', 'simulator is ready'))
+                return await asyncio.start_server(lambda r, w: w.close(), '127.0.0.1', PORT)
+
+            server_task = asyncio.create_task(late_start())
+            readiness = await wait_ready([
+                LogPatternProbe('hitl', log, 'is ready$'),
+                TcpPortProbe('3d_sim', '127.0.0.1', PORT, interval=0.05),
+                UptimeProbe('uptime', 0.1),
+            ], timeout=5)
+            (await server_task).close()
+            return readiness
+
+        readiness = asyncio.run(main())
+        assert readiness.ready, readiness.error
+        assert 0.2 <= readiness.latency['hitl'] < 1
+        assert 0.2 <= readiness.latency['3d_sim'] < 1
+        assert readiness.latency['uptime'] < 0.2
+
+    def test_timeout(self):
+        async def never():
+            await asyncio.sleep(10)
+
+        readiness = asyncio.run(wait_ready(
+            [CallableProbe('autopilot', never), UptimeProbe('uptime', 0)], timeout=0.2))
+        assert not readiness.ready
+        assert 'autopilot' in readiness.error
+        assert readiness.latency['autopilot'] is None
+        assert readiness.latency['uptime'] is not None
+
+    def test_probe_failed(self):
+        async def no_heartbeat():
+            raise TimeoutError('no heartbeat')
+
+        readiness = asyncio.run(wait_ready([CallableProbe('autopilot', no_heartbeat)], timeout=5))
+        assert not readiness.ready
+        assert 'no heartbeat' in readiness.error
+
+    def test_process_exited(self):
+        async def main():
+            proc = await asyncio.create_subprocess_exec(sys.executable, '-c', 'exit(3)')
+            return await wait_ready(
+                [UptimeProbe('hitl', 5)], timeout=10, processes={'hitl': proc})
+
+        readiness = asyncio.run(main())
+        assert not readiness.ready
+        assert readiness.error == 'hitl exited with code 3'
@@ -0,0 +1,145 @@
+import asyncio
+import random
+
+from src.api.core import Command, Opcodes, Result, StatusCode
+from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.websocket_server import Server
+
+
+async def fake_worker(client: Client):
+    # Replies out of order, with a couple of in_progress frames first
+    async def reply(cmd: Command):
+        await asyncio.sleep(random.random() / 20)
+        for i in range(2):
+            await client.send(Result(
+                status=StatusCode.in_progress, message={'step': i}, request_id=cmd.request_id))
+        await client.send(Result(
+            status=StatusCode.ok, message={'n': cmd.kwargs['n']}, request_id=cmd.request_id))
+
+    tasks = set()
+    while True:
+        cmd = await client.recv()
+        task = asyncio.create_task(reply(cmd))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+async def pipelined(port: int, n: int):
+    srv = Server(host='localhost', port=port)
+    ws_srv = await srv.run(blocking=False)
+    client = Client(host='localhost', port=port, uuid='1', name='w')
+    await client.connect()
+    while '1' not in srv.workers:
+        await asyncio.sleep(0.01)
+    worker = asyncio.create_task(fake_worker(client))
+
+    progress = []
+    results = await asyncio.gather(*[
+        srv.request('1', Command(opcode=Opcodes.noop, kwargs={'n': i}), on_progress=progress.append)
+        for i in range(n)
+    ])
+
+    # Unsolicited messages still go to recv()
+    await client.send(Result(status=StatusCode.ok, message={'unsolicited': True}))
+    _, unsolicited = await srv.recv()
+
+    worker.cancel()
+    await client.close()
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return results, progress, unsolicited, len(srv.workers)
+
+
+async def fan_in(port: int, workers: int, n: int, inbox_size: int):
+    srv = Server(host='localhost', port=port, inbox_size=inbox_size)
+    ws_srv = await srv.run(blocking=False)
+    clients = [Client(host='localhost', port=port, uuid=str(i), name='w') for i in range(workers)]
+    for client in clients:
+        await client.connect()
+    while len(srv.workers) < workers:
+        await asyncio.sleep(0.01)
+    for client in clients:
+        for i in range(n):
+            await client.send(Result(status=StatusCode.ok, message={'n': i}))
+
+    received = {}
+    largest_inbox = 0
+    async for uuid, msg in srv:
+        largest_inbox = max(largest_inbox, srv.stats()['inbox'])
+        received.setdefault(uuid, []).append(msg.message['n'])
+        if sum(map(len, received.values())) == workers * n:
+            break
+    stats = srv.stats()
+    for client in clients:
+        await client.close()
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return received, largest_inbox, stats
+
+
+async def reply_past_full_inbox(port: int):
+    srv = Server(host='localhost', port=port, inbox_size=2)
+    ws_srv = await srv.run(blocking=False)
+    client = Client(host='localhost', port=port, uuid='1', name='w')
+    await client.connect()
+    while '1' not in srv.workers:
+        await asyncio.sleep(0.01)
+    # Nobody calls recv(), as with a scheduler that only sends requests
+    for i in range(4):
+        await client.send(Result(status=StatusCode.ok, message={'n': i}))
+    while not srv.stats()['inbox_full']:
+        await asyncio.sleep(0.01)
+
+    async def reply():
+        cmd = await client.recv()
+        await client.send(Result(status=StatusCode.ok, request_id=cmd.request_id))
+        await client.send(Result(status=StatusCode.ok, message={'n': 4}))
+
+    replying = asyncio.create_task(reply())
+    result = await asyncio.wait_for(srv.request('1', Command(opcode=Opcodes.noop)), 5)
+    await replying
+    inbox = [(await asyncio.wait_for(srv.recv(), 5))[1].message['n'] for _ in range(5)]
+    stats = srv.stats()
+    await client.close()
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return result, inbox, stats
+
+
+class TestRequests:
+
+    def test_fan_in(self):
+        received, largest_inbox, stats = asyncio.run(fan_in(18774, 20, 50, inbox_size=10))
+        # Keyed by uuid, in the order each worker sent them
+        assert received == {str(i): list(range(50)) for i in range(20)}
+        # Workers wait for room instead of piling messages up
+        assert largest_inbox <= 10
+        assert stats['inbox_full'] > 0
+
+    def test_reply_past_full_inbox(self):
+        result, inbox, stats = asyncio.run(reply_past_full_inbox(18790))
+        assert result.status == StatusCode.ok
+        # Nothing is lost on the way, and the order is kept
+        assert inbox == [0, 1, 2, 3, 4]
+        assert stats['replies'] == 1
+
+    def test_pipelined_requests(self):
+        results, progress, unsolicited, _ = asyncio.run(pipelined(18767, 50))
+        assert [r.message['n'] for r in results] == list(range(50))
+        assert all(r.status == StatusCode.ok for r in results)
+        assert len(progress) == 100
+        assert unsolicited.message == {'unsolicited': True}
+
+    def test_request_id_round_trip(self):
+        cmd = Command(opcode=Opcodes.noop, request_id='42')
+        assert Command.unpack(cmd.pack()).request_id == '42'
+        # Commands of peers that know nothing about request ids
+        assert Command.unpack({'type': 'Command', 'data': {
+            'opcode': {'noop': 'noop'}, 'args': [], 'kwargs': {}}}).request_id is None
+
+    def test_plain_messages_for_old_peers(self):
+        # Peers that know nothing about request ids and slots build messages with cls(**data)
+        assert Command(opcode=Opcodes.noop).pack()['data'].keys() == {'opcode', 'args', 'kwargs'}
+        assert Result(status=StatusCode.ok).pack()['data'].keys() == {'status', 'message'}
+        assert Result(status=StatusCode.ok, request_id='42', slot=0).pack()['data'].keys() == {
+            'status', 'message', 'request_id', 'slot'}
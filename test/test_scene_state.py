@@ -0,0 +1,28 @@
+from src.core.scene_state import SceneState, SceneAction
+
+
+class TestSceneState:
+
+    def test_plan(self):
+        scene = SceneState()
+        assert scene.plan('MainScene') == SceneAction.load
+        scene.loaded('MainScene')
+        assert scene.plan('MainScene') == SceneAction.none
+        assert scene.plan('ConstructionScene') == SceneAction.load
+        scene.touch()
+        assert scene.plan('MainScene') == SceneAction.reset
+        scene.reset()
+        assert scene.plan('MainScene') == SceneAction.none
+        scene.forget()
+        assert scene.plan('MainScene') == SceneAction.load
+        scene.reset()
+        assert scene.plan('MainScene') == SceneAction.load
+
+    def test_latency(self):
+        scene = SceneState()
+        scene.record(SceneAction.load, 2.0)
+        scene.record(SceneAction.load, 4.0)
+        scene.record(SceneAction.none, 0.0)
+        stats = scene.stats()['latency']
+        assert stats['load'] == {'count': 2, 'last': 4.0, 'max': 4.0, 'avg': 3.0}
+        assert stats['none']['count'] == 1
@@ -0,0 +1,79 @@
+import asyncio
+from typing import List, Tuple
+
+from src.api.core import Command, Opcodes, AbstractSimCore
+from src.api.scheduler import OpcodeScheduler, ResourceClass
+
+
+class Recorder:
+    """Fake executor that records when every command started and finished"""
+    DURATIONS = {
+        Opcodes.start_sim: 0.05,
+        Opcodes.start_mission: 0.2,
+        Opcodes.upload_mission: 0.05,
+        Opcodes.spawn_agent: 0.01,
+        Opcodes.load_scene: 0.05,
+    }
+
+    def __init__(self):
+        self.events: List[Tuple[str, int, str]] = []
+
+    async def execute(self, command: Command):
+        self.events.append(('start', command.kwargs['n'], command.opcode))
+        await asyncio.sleep(self.DURATIONS.get(command.opcode, 0))
+        self.events.append(('end', command.kwargs['n'], command.opcode))
+
+    def index(self, kind: str, n: int) -> int:
+        return next(i for i, e in enumerate(self.events) if e[:2] == (kind, n))
+
+
+def resource_of(command: Command) -> ResourceClass:
+    return AbstractSimCore.opcode_resources().get(command.opcode, ResourceClass.none)
+
+
+async def run_commands(
+        opcodes: List[Opcodes], sequential: bool = False) -> Tuple[Recorder, OpcodeScheduler]:
+    recorder = Recorder()
+    scheduler = OpcodeScheduler(recorder.execute, resource_of, sequential=sequential)
+    for n, opcode in enumerate(opcodes):
+        scheduler.submit(Command(opcode=opcode, kwargs={'n': n}))
+    await scheduler.join()
+    return recorder, scheduler
+
+
+class TestScheduler:
+
+    def test_different_resources_overlap(self):
+        rec, _ = asyncio.run(run_commands([Opcodes.start_mission, Opcodes.spawn_agent]))
+        # spawn_agent completes while the mission is still running
+        assert rec.index('end', 1) < rec.index('end', 0)
+
+    def test_same_resource_in_order(self):
+        rec, _ = asyncio.run(run_commands([
+            Opcodes.upload_mission, Opcodes.start_mission,
+            Opcodes.load_scene, Opcodes.spawn_agent]))
+        assert rec.index('end', 0) < rec.index('start', 1)
+        assert rec.index('end', 2) < rec.index('start', 3)
+
+    def test_process_is_a_barrier(self):
+        rec, _ = asyncio.run(run_commands([
+            Opcodes.load_scene, Opcodes.start_sim, Opcodes.spawn_agent, Opcodes.upload_mission]))
+        assert rec.index('end', 0) < rec.index('start', 1)
+        assert rec.index('end', 1) < rec.index('start', 2)
+        assert rec.index('end', 1) < rec.index('start', 3)
+
+    def test_abort_does_not_wait(self):
+        rec, _ = asyncio.run(run_commands([Opcodes.start_mission, Opcodes.abort_mission]))
+        assert rec.index('end', 1) < rec.index('end', 0)
+
+    def test_sequential(self):
+        opcodes = [Opcodes.start_mission, Opcodes.spawn_agent, Opcodes.abort_mission]
+        rec, _ = asyncio.run(run_commands(opcodes, sequential=True))
+        assert [e[1] for e in rec.events] == [0, 0, 1, 1, 2, 2]
+
+    def test_stats(self):
+        _, scheduler = asyncio.run(run_commands([Opcodes.start_mission, Opcodes.upload_mission]))
+        stats = scheduler.snapshot()[ResourceClass.autopilot]
+        assert stats['executed'] == 2
+        assert stats['queue_depth'] == 0
+        assert stats['max_wait'] >= 0.2
@@ -0,0 +1,68 @@
+import asyncio
+
+import grpc
+
+from src.core.sim3d_channel import ManagedChannel
+
+PORT = 18769
+
+
+class EchoStub:
+    def __init__(self, channel: grpc.aio.Channel):
+        self.Ping = channel.unary_unary('/test.Echo/Ping')
+
+
+async def start_server() -> grpc.aio.Server:
+    async def ping(request: bytes, _context) -> bytes:
+        return request
+
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler('test.Echo', {
+        'Ping': grpc.unary_unary_rpc_method_handler(ping)
+    })])
+    server.add_insecure_port(f'127.0.0.1:{PORT}')
+    await server.start()
+    return server
+
+
+class TestManagedChannel:
+
+    def test_rpc_stats_and_reconnect(self):
+        async def main():
+            server = await start_server()
+            channel = ManagedChannel('127.0.0.1', PORT, EchoStub)
+            await asyncio.wait_for(channel.ready(), 5)
+            assert await channel.stub().Ping(b'hi', timeout=5) == b'hi'
+
+            # The server restarts, the channel is replaced and works right away
+            await server.stop(None)
+            server = await start_server()
+            await channel.reconnect()
+            assert await channel.stub().Ping(b'again', timeout=5) == b'again'
+            await asyncio.sleep(0.05)
+            stats = channel.stats()
+            await channel.close()
+            await server.stop(None)
+            return stats
+
+        stats = asyncio.run(main())
+        assert stats['reconnects'] == 1
+        assert stats['opened'] == 2
+        assert stats['rpcs'] == 2
+        assert stats['latency']['Ping']['count'] == 2
+        assert stats['state'] == 'READY'
+
+    def test_rpc_errors_counted(self):
+        async def main():
+            channel = ManagedChannel('127.0.0.1', PORT, EchoStub)
+            try:
+                await channel.stub().Ping(b'hi', timeout=0.2)
+            except grpc.aio.AioRpcError:
+                pass
+            stats = channel.stats()
+            await channel.close()
+            return stats
+
+        stats = asyncio.run(main())
+        assert stats['rpc_errors'] == 1
+        assert stats['latency']['Ping']['count'] == 1
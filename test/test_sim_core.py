@@ -0,0 +1,721 @@
+import asyncio
+import json
+import stat
+from types import SimpleNamespace
+from typing import List, Dict, Set, Optional, Callable
+
+import pytest
+
+from src.api.core import (
+    Result, ModeEnum, StatusCode, Command, Opcodes, AgentName, AgentSpawn, Pose, Transform,
+    Vector3, INCLUDE_FILE_OPCODE)
+from src.api.packable_dataclass import BaseEvent
+from src.communicators.base_communicator import BaseCommunicator
+from src.communicators.cli_communicator import CliCommunicator
+from src.core import sim_core
+from src.core.process_monitor import LogLine
+from src.core.sim_core import SimCore
+
+# Exits at once when asked to kill, otherwise runs until stopped
+HITL_SCRIPT = '''#!/bin/bash
+[ "$1" = kill ] && exit 0
+echo ready
+exec sleep 30
+'''
+
+DEFAULT_PARAMS = {'MPC_XY_VEL_MAX': 12.0, 'NAV_DLL_ACT': 0, 'SYS_AUTOSTART': 4001}
+
+MISSION = json.dumps({
+    'mission': {'items': [{'command': 22}, {'command': 16}]},
+    'geoFence': {'circles': [], 'polygons': []},
+    'rallyPoints': {'points': []},
+})
+
+
+class Recorder(BaseCommunicator):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent: List[Result] = []
+
+    async def send(self, msg: Result):
+        self.sent.append(msg)
+
+
+class Sim3d:
+    """ManagedChannel to a 3D sim that answers at once"""
+    host = 'localhost'
+    port = 1
+
+    def __init__(self, scene: str = 'MainScene'):
+        self.scene = scene
+        self.calls: List[str] = []
+        self.failing: Set[str] = set()
+        self.agents: List[str] = []
+
+    def _call(self, method: str) -> None:
+        self.calls.append(method)
+        if method in self.failing:
+            raise ConnectionError(f'{method} failed')
+
+    def stub(self) -> 'Sim3d':
+        return self
+
+    def stats(self) -> Dict:
+        return {}
+
+    async def reconnect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def GetCurrentScene(self, _request, timeout: float):
+        self._call('GetCurrentScene')
+        return SimpleNamespace(scene=self.scene)
+
+    async def LoadScene(self, request, timeout: float):
+        self._call('LoadScene')
+        self.scene = request.scene
+
+    async def Reset(self, _request, timeout: float):
+        self._call('Reset')
+
+    async def Run(self, _request, timeout: float):
+        self._call('Run')
+
+    async def GetSpawn(self, _request, timeout: float):
+        self._call('GetSpawn')
+
+    async def SpawnAgent(self, request, timeout: float):
+        self._call('SpawnAgent')
+        self.agents.append(request.name)
+        return SimpleNamespace(uid=str(len(self.agents)))
+
+    async def RemoveAgent(self, request, timeout: float):
+        self._call('RemoveAgent')
+        return request.uid
+
+
+class Board:
+    """The autopilot behind every Vehicle the worker makes"""
+
+    def __init__(self):
+        self.uid = 42
+        self.git_hash = 0
+        self.params = dict(DEFAULT_PARAMS)
+        self.failing: Set[str] = set()
+        self.calls: List[str] = []
+        self.flashed: List[str] = []
+        self.vehicles: List[Vehicle] = []
+
+    def vehicle(self) -> 'Vehicle':
+        vehicle = Vehicle(self)
+        self.vehicles.append(vehicle)
+        return vehicle
+
+    def udp_vehicle(self, udp_port: int) -> 'Vehicle':
+        vehicle = self.vehicle()
+        vehicle.udp_port = udp_port
+        return vehicle
+
+    def flash(self, firmware: List[str], _ports: List[str]) -> None:
+        with open(firmware[0], encoding='utf-8') as f:
+            self.flashed.append(f.read())
+
+
+class Master:
+    def __init__(self, board: Board):
+        self.board = board
+        self.mav = self
+        self.target_system = 1
+        self.target_component = 1
+        self.alive = True
+        self.closed = False
+
+    def command_long_send(self, *_args) -> None:
+        pass
+
+    def recv_match(self, **_kwargs):
+        return SimpleNamespace(
+            uid=self.board.uid, flight_custom_version=self.board.git_hash.to_bytes(8, 'little'))
+
+    def wait_heartbeat(self, timeout: float):
+        return object() if self.alive else None
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class Params:
+    def __init__(self, board: Board):
+        self.board = board
+
+    def read_all(self) -> Dict:
+        return dict(self.board.params)
+
+    def set(self, name: str, value) -> bool:
+        self.board.calls.append(f'set {name}')
+        if name in self.board.failing:
+            return False
+        self.board.params[name] = value
+        return True
+
+
+class Vehicle:
+    def __init__(self, board: Board):
+        self.board = board
+        self.master = Master(board)
+        self.params = Params(board)
+        self.device: Optional[str] = None
+        self.udp_port: Optional[int] = None
+
+    def connect(self, device: str) -> None:
+        self.device = device
+
+    def reset_params_to_default(self) -> None:
+        self.board.calls.append('reset')
+        self.board.params = dict(DEFAULT_PARAMS)
+
+    def configures(self, _content: str) -> None:
+        self.board.calls.append('configure')
+
+    def reboot(self) -> None:
+        self.board.calls.append('reboot')
+
+    def loads_mission(self, _content: str) -> None:
+        self.board.calls.append('mission')
+        if 'mission' in self.board.failing:
+            raise TimeoutError('no MISSION_ACK')
+
+
+@pytest.fixture(name='board')
+def board_fixture(monkeypatch) -> Board:
+    board = Board()
+    monkeypatch.setattr(sim_core, 'Vehicle', board.vehicle)
+    monkeypatch.setattr(sim_core, 'UdpVehicle', board.udp_vehicle)
+    monkeypatch.setattr(sim_core, 'px_uploader', board.flash)
+    return board
+
+
+def make_core(tmp_path, **kwargs) -> SimCore:
+    script = tmp_path / 'hitl.sh'
+    script.write_text(HITL_SCRIPT)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    core = SimCore(Recorder, sim_3d_path='exec sleep 30', hitl_sim_path=str(script),
+                   hitl_ready_pattern='ready', stop_grace_period=1, start_timeout=10,
+                   **kwargs)
+    core.connection_device = sim_core.Devices.udp
+    core.sim3d = Sim3d()
+    return core
+
+
+async def close(core: SimCore) -> None:
+    await core.cleanup()
+    core.ws_logger.handlers.remove(core.log_handler)
+
+
+async def until(condition: Callable[[], bool], timeout: float = 5) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+class TestSpawnAgents:
+    position = Pose(Transform(Vector3(10, 0, 0), Vector3(0, 0, 0)),
+                    Vector3(0, 0, 0), Vector3(0, 0, 0))
+
+    def test_agents_sent_over_websockets(self, tmp_path, board):
+        commands = [
+            Command(opcode=Opcodes.spawn_agent, args=[], kwargs={
+                'agent_name': AgentName.octo_amazon, 'position': self.position}),
+            Command(opcode=Opcodes.spawn_agents, args=[], kwargs={'agents': [
+                AgentSpawn(AgentName.vtol_seeker, self.position),
+                AgentSpawn('quad_m690', self.position),
+                AgentSpawn('Vtol-T300', self.position),
+            ]}),
+        ]
+
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                for command in commands:
+                    await core.execute(BaseEvent.unpack(command.pack()))
+                assert [res.status for res in core.communicator.sent] == [StatusCode.ok] * 2
+            finally:
+                await close(core)
+            return core.sim3d.agents
+
+        assert asyncio.run(main()) == [
+            'Octocopter-Amazon', 'Vtol-Seeker', 'Quadcopter-M690', 'Vtol-T300']
+
+    def test_agents_of_opcode_file(self, tmp_path, board):
+        opcode = {INCLUDE_FILE_OPCODE: 'config/opcode_file.json'}
+        com = CliCommunicator([[json.dumps(opcode)]])
+        asyncio.run(com.setup())
+        commands = [command for command in com.command_list
+                    if command.opcode in (Opcodes.spawn_agent, Opcodes.spawn_agents)]
+
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                for command in commands:
+                    await core.execute(command)
+                assert [res.status for res in core.communicator.sent] == [StatusCode.ok] * 3
+            finally:
+                await close(core)
+            return core.sim3d.agents
+
+        assert asyncio.run(main()) == ['Octocopter-Amazon'] * 3 + ['Vtol-Seeker']
+
+    def test_unknown_agent(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                res = await core.spawn_agent('octo_amazon02', self.position)
+                assert res.status == StatusCode.error
+            finally:
+                await close(core)
+            return core.sim3d.agents
+
+        assert asyncio.run(main()) == []
+
+
+class TestWarmPool:
+
+    def test_reuses_processes(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path, warm_standby=True)
+            try:
+                res = await core.start_sim(ModeEnum.SITL, start_3d_sim=False)
+                assert res.status == StatusCode.ok
+                assert res.message['warm'] == []
+                proc = core.hitl_sim_process
+
+                res = await core.stop_sim()
+                assert res.status == StatusCode.ok
+                assert res.message['recycled'] == {}
+                assert proc.returncode is None
+
+                res = await core.start_sim(ModeEnum.SITL, start_3d_sim=False)
+                assert res.status == StatusCode.ok
+                assert res.message['warm'] == ['hitl']
+                assert core.hitl_sim_process is proc
+                assert core.pool.counters == {'started': 1, 'reused': 1, 'recycled': 0}
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert len(board.vehicles) == 1
+
+    def test_restarts_for_another_mode(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path, warm_standby=True)
+            try:
+                await core.start_sim(ModeEnum.SITL, start_3d_sim=False)
+                proc = core.hitl_sim_process
+                await core.stop_sim()
+
+                res = await core.start_sim(ModeEnum.HITL, start_3d_sim=False)
+                assert res.status == StatusCode.ok
+                assert res.message['warm'] == []
+                assert proc.returncode is not None
+                assert core.hitl_sim_process is not proc
+                assert core.pool.counters == {'started': 2, 'reused': 0, 'recycled': 1}
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_recycles_after_sessions(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path, warm_standby=True, warm_recycle_sessions=1)
+            try:
+                await core.start_sim(ModeEnum.SITL, start_3d_sim=False)
+                proc = core.hitl_sim_process
+
+                res = await core.stop_sim()
+                assert res.status == StatusCode.ok
+                assert 'hitl' in res.message['recycled']
+                assert proc.returncode is not None
+                assert 'hitl' not in core.pool
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_resets_3d_sim(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path, warm_standby=True)
+            try:
+                core.sim_3d_process = proc = await core._spawn(
+                    '3d_sim', core.sim_3d_path, core.sim_3d_log)
+                core.scene.loaded('MainScene')
+                core.scene.touch()
+
+                res = await core.stop_sim()
+                assert res.status == StatusCode.ok
+                assert core.sim3d.calls == ['Reset', 'Run']
+                assert core.scene.current == 'MainScene'
+                assert not core.scene.dirty
+                assert proc.returncode is None
+                assert await core._take_warm('3d_sim')
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_stops_3d_sim_that_fails_to_reset(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path, warm_standby=True)
+            try:
+                core.sim_3d_process = proc = await core._spawn(
+                    '3d_sim', core.sim_3d_path, core.sim_3d_log)
+                core.scene.loaded('MainScene')
+                core.sim3d.failing.add('Reset')
+
+                res = await core.stop_sim()
+                assert res.status == StatusCode.error
+                assert res.message['error'] == 'failed to reset 3d_sim'
+                assert '3d_sim' in res.message['recycled']
+                assert proc.returncode is not None
+                assert core.scene.current is None
+                assert not await core._take_warm('3d_sim')
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+
+class TestScenes:
+
+    def test_load_scene(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                res = await core.load_scene('ConstructionScene')
+                assert res.message['action'] == 'load'
+                assert core.sim3d.calls == ['GetCurrentScene', 'LoadScene', 'Run']
+
+                core.sim3d.calls.clear()
+                res = await core.load_scene('ConstructionScene')
+                assert res.message['action'] == 'none'
+                assert core.sim3d.calls == []
+
+                await core.remove_agent('1')
+                core.sim3d.calls.clear()
+                res = await core.load_scene('ConstructionScene')
+                assert res.message['action'] == 'reset'
+                assert core.sim3d.calls == ['Reset', 'Run']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_failed_load_forgets_scene(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                await core.load_scene('MainScene')
+                core.sim3d.failing.add('LoadScene')
+                res = await core.load_scene('ConstructionScene')
+                assert res.status == StatusCode.error
+                assert core.scene.current is None
+
+                core.sim3d.failing.clear()
+                core.sim3d.calls.clear()
+                res = await core.load_scene('MainScene')
+                assert res.message['action'] == 'reset'
+                assert core.sim3d.calls == ['GetCurrentScene', 'Reset', 'Run']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_preload_scenes(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                res = await core.preload_scenes(['ConstructionScene', 'MainScene'])
+                assert res.status == StatusCode.ok
+                assert list(res.message['latency']) == ['ConstructionScene', 'MainScene']
+                assert core.sim3d.calls == [
+                    'GetCurrentScene', 'LoadScene', 'Run', 'LoadScene', 'Run']
+                assert [msg.message['preloaded'] for msg in core.communicator.sent] == [
+                    'ConstructionScene', 'MainScene']
+
+                core.sim3d.calls.clear()
+                res = await core.preload_scenes(['ConstructionScene'])
+                assert core.sim3d.calls == ['LoadScene', 'Run', 'LoadScene', 'Run']
+                assert core.scene.current == 'MainScene'
+                assert core.scene.stats()['preloaded'] == ['ConstructionScene', 'MainScene']
+
+                res = await core.load_scene('ConstructionScene')
+                assert res.message['preloaded']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+
+class TestAutopilotConnection:
+
+    def test_keeps_vehicle(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            core.autopilot.check_period = 0.01
+            try:
+                core.autopilot.start()
+                vehicle = await core.autopilot.ready()
+                await until(lambda: core.autopilot.counters['heartbeats'] >= 3)
+                res = await core.reboot_autopilot()
+                assert res.status == StatusCode.ok
+                assert core.vehicle_instance is vehicle
+                assert core.autopilot.counters['reconnects'] == 0
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert len(board.vehicles) == 1
+        assert board.vehicles[0].device == 'udp'
+
+    def test_slot_port(self, tmp_path, board):
+        async def main():
+            for port in [14540, 14541]:
+                core = make_core(tmp_path, mavlink_udp_port=port)
+                try:
+                    await core.autopilot.ready()
+                finally:
+                    await close(core)
+
+        asyncio.run(main())
+        assert [vehicle.udp_port for vehicle in board.vehicles] == [None, 14541]
+
+    def test_reconnects_without_heartbeats(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            core.autopilot.check_period = 0.01
+            try:
+                res = await core.upload_mission(MISSION)
+                assert res.message['uploaded']
+                first = core.vehicle_instance
+                first.master.alive = False
+
+                await until(lambda: core.vehicle_instance not in (None, first))
+                assert first.master.closed
+                assert core.autopilot.counters['reconnects'] == 1
+                # The restarted vehicle may have lost the mission
+                assert core.mission_cache.loaded is None
+                res = await core.upload_mission(MISSION)
+                assert res.message['uploaded']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert board.calls == ['mission', 'mission']
+
+
+class TestFirmware:
+
+    def test_skips_flashed_image(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                flashed = []
+                for firmware, force_flash in [('firmware-1', False), ('firmware-1', False),
+                                              ('firmware-1', True), ('firmware-2', False)]:
+                    res = await core.configure_autopilot(firmware, [], force_flash=force_flash)
+                    assert res.status == StatusCode.ok
+                    flashed.append(res.message['firmware']['flashed'])
+                assert flashed == [True, False, True, True]
+                assert core.firmware_cache.counters == {'flashed': 3, 'skipped': 1}
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert board.flashed == ['firmware-1', 'firmware-1', 'firmware-2']
+
+    def test_flashes_board_running_another_build(self, tmp_path, board):
+        firmware = json.dumps({'git_hash': '0123456789abcdef0123'})
+        board.git_hash = 0x0123456789abcdef
+
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                res = await core.configure_autopilot(firmware, [])
+                assert res.message['firmware']['flashed']
+                res = await core.configure_autopilot(firmware, [])
+                assert not res.message['firmware']['flashed']
+
+                # Flashed by someone else since
+                board.git_hash = 0xfedcba9876543210
+                res = await core.configure_autopilot(firmware, [])
+                assert res.message['firmware']['flashed']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert len(board.flashed) == 2
+
+
+class TestIncrementalConfig:
+
+    def test_sets_what_changed(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                res = await core.configure_autopilot(None, ['MPC_XY_VEL_MAX: 10.0'],
+                                                     incremental=True)
+                config = res.message['config']
+                assert (config['reset'], config['changed'], config['reboot']) == (
+                    True, ['MPC_XY_VEL_MAX'], True)
+                assert board.calls == ['reset', 'set MPC_XY_VEL_MAX', 'reboot']
+
+                board.calls.clear()
+                res = await core.configure_autopilot(None, ['MPC_XY_VEL_MAX: 10.0'],
+                                                     incremental=True)
+                config = res.message['config']
+                assert (config['reset'], config['changed'], config['reboot']) == (
+                    False, [], False)
+                assert board.calls == []
+
+                # What the previous config set goes back to its default
+                res = await core.configure_autopilot(None, ['NAV_DLL_ACT: 2'], incremental=True)
+                config = res.message['config']
+                assert config['changed'] == ['MPC_XY_VEL_MAX', 'NAV_DLL_ACT']
+                assert not config['reboot']
+                assert board.params == {**DEFAULT_PARAMS, 'NAV_DLL_ACT': 2}
+
+                board.calls.clear()
+                res = await core.configure_autopilot(
+                    None, ['NAV_DLL_ACT: 2', 'SYS_AUTOSTART: 4010'], incremental=True)
+                assert res.message['config']['reboot']
+                assert board.calls == ['set SYS_AUTOSTART', 'reboot']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_forgets_board_after_failure(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                await core.configure_autopilot(None, ['MPC_XY_VEL_MAX: 10.0'], incremental=True)
+                board.failing.add('NAV_DLL_ACT')
+                res = await core.configure_autopilot(None, ['NAV_DLL_ACT: 2'], incremental=True)
+                assert res.status == StatusCode.error
+                assert res.message['config']['failed'] == ['NAV_DLL_ACT']
+
+                board.failing.clear()
+                board.calls.clear()
+                res = await core.configure_autopilot(None, ['NAV_DLL_ACT: 2'], incremental=True)
+                assert res.message['config']['reset']
+                assert board.calls == ['reset', 'set NAV_DLL_ACT', 'reboot']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+    def test_resets_after_full_config_or_flash(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            config = ['NAV_DLL_ACT: 2']
+            try:
+                await core.configure_autopilot(None, config, incremental=True)
+                await core.configure_autopilot(None, config)
+                res = await core.configure_autopilot(None, config, incremental=True)
+                assert res.message['config']['reset']
+
+                res = await core.configure_autopilot('firmware-1', config, incremental=True)
+                assert res.message['config']['reset']
+                res = await core.configure_autopilot(None, config, incremental=True)
+                assert not res.message['config']['reset']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+
+class TestMissions:
+
+    def test_skips_loaded_mission(self, tmp_path, board):
+        other = json.dumps({**json.loads(MISSION), 'rallyPoints': {'points': [[0, 0, 10]]}})
+
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                uploaded = []
+                # The same plan written another way is the same mission
+                for mission in [MISSION, json.dumps(json.loads(MISSION), indent=2), other, MISSION]:
+                    res = await core.upload_mission(mission)
+                    assert res.status == StatusCode.ok
+                    uploaded.append(res.message['uploaded'])
+                assert uploaded == [True, False, True, True]
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+        assert board.calls == ['mission'] * 3
+
+    def test_uploads_again_when_vehicle_may_have_lost_it(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                for invalidate in [core.reboot_autopilot,
+                                   lambda: core.configure_autopilot(None, []),
+                                   lambda: core.configure_autopilot(None, [], incremental=True)]:
+                    await core.upload_mission(MISSION)
+                    await invalidate()
+                    res = await core.upload_mission(MISSION)
+                    assert res.message['uploaded']
+                # Nothing to reset or reboot for
+                await core.configure_autopilot(None, [], incremental=True)
+                res = await core.upload_mission(MISSION)
+                assert not res.message['uploaded']
+
+                board.failing.add('mission')
+                res = await core.upload_mission(MISSION.replace('22', '21'))
+                assert res.status == StatusCode.error
+                board.failing.clear()
+                res = await core.upload_mission(MISSION)
+                assert res.message['uploaded']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
+
+
+class TestGetLogs:
+
+    def test_limits(self, tmp_path, board):
+        async def main():
+            core = make_core(tmp_path)
+            try:
+                for i in range(10):
+                    core.hitl_sim_log.append(LogLine(float(i), 'hitl:stdout', f'line {i}'))
+                queries = [
+                    {'tail': 3},
+                    {'tail': 0},
+                    {'pattern': 'line [0-8]', 'tail': 2},
+                    {'pattern': 'line', 'tail': 0},
+                    {'pattern': 'line 1'},
+                    {'start': 8},
+                    {'start': 2, 'end': 4},
+                ]
+                numbers = []
+                for query in queries:
+                    res = await core.get_logs('hitl', **query)
+                    assert res.status == StatusCode.ok
+                    numbers.append([n for n, _ in res.message['lines']])
+                assert numbers == [[7, 8, 9], [], [7, 8], [], [1], [8, 9], [2, 3]]
+
+                for query in [{'tail': -1}, {'pattern': 'line', 'tail': -1}, {'start': -2},
+                              {'start': 0, 'end': -1}]:
+                    res = await core.get_logs('hitl', **query)
+                    assert res.status == StatusCode.error
+                    assert 'can not be negative' in res.message['error']
+            finally:
+                await close(core)
+
+        asyncio.run(main())
@@ -0,0 +1,57 @@
+import asyncio
+import sys
+
+from src.core.process_control import stop_process_group
+from src.core.sim_pool import SimPool, group_rss
+
+SLEEPER = 'import time; time.sleep(60)'
+
+
+async def spawn() -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        sys.executable, '-c', SLEEPER, start_new_session=True)
+
+
+class TestSimPool:
+
+    def test_reused_until_recycled(self):
+        async def main():
+            pool = SimPool(max_sessions=2)
+            proc = await spawn()
+            pool.add('3d_sim', proc)
+            assert pool.take('3d_sim') is not None
+            assert pool.release('3d_sim') is None
+            assert pool.take('3d_sim').proc is proc
+            assert pool.release('3d_sim') == 'served 2 sessions'
+            assert pool.take('3d_sim') is None
+            await stop_process_group(proc)
+            return pool
+
+        pool = asyncio.run(main())
+        assert pool.stats()['reused'] == 2
+
+    def test_key_and_exit(self):
+        async def main():
+            pool = SimPool()
+            proc = await spawn()
+            pool.add('hitl', proc, key='sitl')
+            assert pool.take('hitl', key='hitl') is None
+            await stop_process_group(proc)
+            assert pool.take('hitl', key='sitl') is None
+            assert pool.release('hitl').startswith('exited')
+
+        asyncio.run(main())
+
+    def test_memory_growth(self):
+        async def main():
+            pool = SimPool(max_memory_growth=2 ** 20)
+            proc = await spawn()
+            pooled = pool.add('3d_sim', proc)
+            assert pool.release('3d_sim') is None
+            assert pooled.baseline_rss > 0 and group_rss(proc.pid) > 0
+            pooled.baseline_rss -= 2 ** 21
+            reason = pool.release('3d_sim')
+            await stop_process_group(proc)
+            return reason
+
+        assert asyncio.run(main()).startswith('memory grew by')
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import List, AsyncIterable
+
+from src.api.core import AbstractSimCore, Command, Result, Opcodes, StatusCode
+from src.communicators.base_communicator import BaseCommunicator
+from src.core.slots import MultiSlotCore, SlotFilter, current_slot, cpu_slot_limit
+
+
+class Link(BaseCommunicator):
+    def __init__(self, commands: List[Command], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = commands
+        self.sent: List[Result] = []
+
+    async def receive(self) -> AsyncIterable[Command]:
+        for command in self.commands:
+            yield command
+
+    async def send(self, msg: Result):
+        self.sent.append(msg)
+
+
+class SlotCore(AbstractSimCore):
+    """Takes a while to start, answers with its slot options"""
+    # Starts in flight across all slots, now and at most
+    starting = 0
+    most_starting = 0
+
+    def __init__(self, communicator, *args, port: int, **kwargs):
+        super().__init__(communicator, *args, **kwargs)
+        self.port = port
+        self.log_handler = logging.Handler()
+
+    async def start_sim(self, mode, start_3d_sim=True) -> Result:
+        if mode == 'broken':
+            return Result(status=StatusCode.error, message={'error': 'no such mode'})
+        SlotCore.starting += 1
+        SlotCore.most_starting = max(SlotCore.most_starting, SlotCore.starting)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            SlotCore.starting -= 1
+        return Result(status=StatusCode.ok, message={'port': self.port})
+
+    async def stop_sim(self) -> Result:
+        return Result(status=StatusCode.ok)
+
+    async def cleanup(self):
+        pass
+
+
+# The rest of the opcodes are not used here
+SlotCore.__abstractmethods__ = frozenset()
+
+
+def run_slots(commands: List[Command], slots: int = 3, max_active: int = 2) -> MultiSlotCore:
+    core = MultiSlotCore(
+        Link, SlotCore, slots, lambda slot: {'port': 3258 + slot}, commands,
+        max_active=max_active)
+    core.run()
+    return core
+
+
+def start(slot, request_id=None):
+    return Command(opcode=Opcodes.start_sim, kwargs={'mode': 'sitl'}, slot=slot,
+                   request_id=request_id or f'start {slot}')
+
+
+class TestSlots:
+
+    def test_routing(self):
+        core = run_slots([start(0), start(1)])
+        by_request = {res.request_id: res for res in core.communicator.sent}
+        assert by_request['start 0'].message == {'port': 3258}
+        assert by_request['start 0'].slot == 0
+        assert by_request['start 1'].message == {'port': 3259}
+        assert core.stats()['active'] == [0, 1]
+
+    def test_slots_run_at_once(self):
+        async def main():
+            core = MultiSlotCore(
+                Link, SlotCore, 2, lambda slot: {'port': slot}, [], max_active=2)
+            SlotCore.most_starting = 0
+            await asyncio.gather(core.submit(start(0)), core.submit(start(1)))
+            return SlotCore.most_starting
+
+        # Both starts were in flight at once
+        assert asyncio.run(main()) == 2
+
+    def test_cpu_limit(self):
+        async def main():
+            core = MultiSlotCore(
+                Link, SlotCore, 3, lambda slot: {'port': slot}, [], max_active=2)
+            await asyncio.gather(core.submit(start(0)), core.submit(start(1)))
+            await core.submit(start(2))
+            await core.submit(Command(opcode=Opcodes.stop_sim, slot=0))
+            await core.submit(start(2, 'start 2 again'))
+            return core
+
+        core = asyncio.run(main())
+        by_request = {res.request_id: res for res in core.communicator.sent}
+        assert by_request['start 2'].status == StatusCode.error
+        assert by_request['start 2 again'].status == StatusCode.ok
+        assert core.stats()['rejected'] == 1
+        assert core.stats()['active'] == [1, 2]
+        assert cpu_slot_limit(1) >= cpu_slot_limit(10 ** 6) == 1
+
+    def test_failed_start_frees_slot(self):
+        async def main():
+            core = MultiSlotCore(
+                Link, SlotCore, 3, lambda slot: {'port': slot}, [], max_active=2)
+            for slot in range(2):
+                await core.submit(Command(
+                    opcode=Opcodes.start_sim, kwargs={'mode': 'broken'}, slot=slot))
+            await core.submit(start(2))
+            return core
+
+        core = asyncio.run(main())
+        by_request = {res.request_id: res for res in core.communicator.sent}
+        assert by_request['start 2'].status == StatusCode.ok
+        assert core.stats()['active'] == [2]
+        assert core.stats()['rejected'] == 0
+
+    def test_unknown_slot(self):
+        core = run_slots([start(7)])
+        assert core.communicator.sent[0].status == StatusCode.error
+        assert core.counters['unknown_slot'] == 1
+
+    def test_default_slot(self):
+        core = run_slots([Command(opcode=Opcodes.start_sim, kwargs={'mode': 'sitl'})])
+        assert core.communicator.sent[0].slot == 0
+
+    def test_log_filter(self):
+        record = logging.LogRecord('test', logging.INFO, '', 0, 'message', None, None)
+        assert SlotFilter(0).filter(record)
+        current_slot.set(1)
+        assert SlotFilter(1).filter(record)
+        assert not SlotFilter(0).filter(record)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import timeit
+from dataclasses import dataclass
+from math import pi
+
+import pytest
+import websockets
+
+from src.api.core import Command, Opcodes, Pose, Transform, Vector3, Result, StatusCode, AgentName
+from src.api.packable_dataclass import BaseEvent
+from src.api.websocket_connection import wire_format
+from src.api.websocket_connection.messages import Greeting
+from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.websocket_server import Server
+from src.api.websocket_connection.wire_format import WireFormat, encode, decode
+from src.exceptions import DataclassJsonException
+
+
+def make_pose() -> Pose:
+    return Pose(
+        transform=Transform(
+            position=Vector3(20, 0, 1.5),
+            rotation=Vector3(0, 0, pi)),
+        velocity=Vector3(0, 0, 0),
+        angular_velocity=Vector3(0, 0, 0))
+
+
+def make_command() -> Command:
+    return Command(
+        opcode=Opcodes.spawn_agent,
+        kwargs={'agent_name': AgentName.octo_amazon, 'position': make_pose()})
+
+
+def make_log_result() -> Result:
+    return Result(
+        status=StatusCode.error,
+        message={
+            '3d_sim_log': [f'[Unity] frame {i} rendered in {i % 17}.{i % 10} ms'
+                           for i in range(2000)],
+            'hitl_sim_log': [f'INFO  [px4] heartbeat {i}, armed: false' for i in range(2000)]
+        })
+
+
+@dataclass
+class BaselineGreeting:
+    # Greeting as unmodified servers know it, they build it with cls(**data)
+    name: str
+    uuid: str
+
+
+SAMPLES = {
+    'command': make_command,
+    'pose': make_pose,
+    'log_result': make_log_result,
+}
+
+
+class TestWireFormat:
+
+    @pytest.mark.parametrize('sample', SAMPLES)
+    @pytest.mark.parametrize('fmt', list(WireFormat))
+    def test_round_trip(self, sample: str, fmt: WireFormat):
+        event = SAMPLES[sample]()
+        assert decode(encode(event, fmt)).pack() == event.pack()
+
+    def test_frame_kinds(self):
+        assert isinstance(encode(make_pose(), WireFormat.json), str)
+        assert isinstance(encode(make_pose(), WireFormat.msgpack), bytes)
+
+    @pytest.mark.parametrize('value', [
+        0, 127, 128, 255, 256, 65536, 2 ** 32, 2 ** 64 - 1,
+        -1, -32, -33, -128, -129, -2 ** 15 - 1, -2 ** 31 - 1, -2 ** 63,
+        0.5, True, False, None, '', 'a' * 31, 'b' * 32, 'c' * 300, 'ю' * 70000,
+        b'\x00\x01', list(range(20)), {str(i): i for i in range(20)}
+    ])
+    def test_fallback_scalars(self, value):
+        buf = bytearray()
+        wire_format._pack_into(buf, value)  # pylint: disable=protected-access
+        assert wire_format._unpack_from(bytes(buf), 0) == (value, len(buf))  # pylint: disable=protected-access
+
+    def test_truncated_frame(self):
+        frame = encode(make_command(), WireFormat.msgpack)
+        with pytest.raises(DataclassJsonException):
+            decode(frame[:-3])
+
+    def test_choose(self):
+        assert wire_format.choose_wire_format(['cbor', 'msgpack', 'json']) == WireFormat.msgpack
+        assert wire_format.choose_wire_format(['cbor']) == WireFormat.json
+        assert wire_format.choose_wire_format([]) == WireFormat.json
+
+
+class TestNegotiation:
+
+    @staticmethod
+    async def exchange(offered, port: int):
+        srv = Server(host='localhost', port=port)
+        ws_srv = await srv.run(blocking=False)
+        client = Client(host='localhost', port=port, uuid='1', name='w', wire_formats=offered)
+        await client.connect()
+        while '1' not in srv.workers:
+            await asyncio.sleep(0.01)
+        await srv.send_message('1', make_command())
+        received = await client.recv()
+        frames = []
+        send = client.connection.send
+
+        async def spy(frame, *args, **kwargs):
+            frames.append(frame)
+            await send(frame, *args, **kwargs)
+
+        client.connection.send = spy
+        await client.send(Result(status=StatusCode.ok))
+        reply = await srv.recv()
+        await client.close()
+        ws_srv.close()
+        await ws_srv.wait_closed()
+        assert received.pack() == make_command().pack()
+        assert reply[0] == '1'
+        assert isinstance(reply[1], Result)
+        return client.wire_format, type(frames[0])
+
+    def test_binary_negotiated(self):
+        assert asyncio.run(TestNegotiation.exchange(
+            ['msgpack', 'json'], 18765)) == (WireFormat.msgpack, bytes)
+
+    def test_old_peer_keeps_json(self):
+        assert asyncio.run(TestNegotiation.exchange(['json'], 18766)) == (WireFormat.json, str)
+
+    def test_old_greeting(self):
+        # Greeting of a worker that knows nothing about wire formats
+        greeting = BaseEvent.unpack({'type': 'Greeting', 'data': {'name': 'w', 'uuid': '1'}})
+        assert greeting == Greeting(name='w', uuid='1', wire_formats=['json'])
+
+    def test_new_greeting_for_baseline(self):
+        packed = Greeting(name='w', uuid='1').pack()
+        assert BaselineGreeting(**packed['data']) == BaselineGreeting(name='w', uuid='1')
+        assert BaseEvent.unpack(packed) == Greeting(name='w', uuid='1')
+        # Only what an old server can't make sense of anyway is sent
+        assert Greeting(name='w', uuid='1', wire_formats=['msgpack', 'json'],
+                        capacity=2).pack()['data'].keys() == {
+            'name', 'uuid', 'wire_formats', 'capacity'}
+
+    def test_baseline_server(self):
+        async def main():
+            greetings = []
+
+            async def connected(websocket):
+                greetings.append(BaselineGreeting(**json.loads(await websocket.recv())['data']))
+                await websocket.wait_closed()
+
+            ws_srv = await websockets.serve(connected, 'localhost', 18787)
+            client = Client(host='localhost', port=18787, uuid='1', name='w', reconnect=True)
+            await client.connect()
+            await client.send(Result(status=StatusCode.ok))
+            await client.close()
+            ws_srv.close()
+            await ws_srv.wait_closed()
+            return greetings
+
+        assert asyncio.run(main()) == [BaselineGreeting(name='w', uuid='1')]
+
+
+class TestWireFormatBenchmark:
+    N = 20
+
+    def test_benchmark(self):
+        print(f'\n{"sample":<12}{"format":<9}{"bytes":>9}{"encode, us":>12}{"decode, us":>12}')
+        for sample, make in SAMPLES.items():
+            event = make()
+            sizes = {}
+            for fmt in WireFormat:
+                frame = encode(event, fmt)
+                sizes[fmt] = len(frame.encode() if isinstance(frame, str) else frame)
+                enc = timeit.timeit(lambda: encode(event, fmt), number=self.N) / self.N  # pylint: disable=cell-var-from-loop
+                dec = timeit.timeit(lambda: decode(frame), number=self.N) / self.N  # pylint: disable=cell-var-from-loop
+                print(f'{sample:<12}{fmt:<9}{sizes[fmt]:>9}{enc * 1e6:>12.1f}{dec * 1e6:>12.1f}')
+            assert sizes[WireFormat.msgpack] < sizes[WireFormat.json]
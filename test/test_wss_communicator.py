@@ -0,0 +1,76 @@
+import asyncio
+
+from src.api.core import Command, Opcodes, StatusCode
+from src.api.websocket_connection.websocket_client import Client
+from src.api.websocket_connection.websocket_server import Server
+from src.communicators.wss_communicator import WssCommunicator
+from src.core.dummy_sim_core import DummySimCore
+
+
+async def start_worker(remote_port: int, local_port: int):
+    srv = Server(host='localhost', port=remote_port)
+    ws_srv = await srv.run(blocking=False)
+    worker = DummySimCore(
+        WssCommunicator, remote_host='localhost', remote_port=remote_port,
+        name='worker', uuid='1', cert=None, is_local_wss_enabled=True,
+        local_host='localhost', local_port=local_port)
+    serving = asyncio.create_task(worker.serve())
+    while '1' not in srv.workers:
+        await asyncio.sleep(0.01)
+    local = Client(host='localhost', port=local_port, uuid='local', name='local')
+    while True:
+        try:
+            await local.connect()
+            break
+        except OSError:
+            # The local server starts right after the worker has connected
+            await asyncio.sleep(0.01)
+    return srv, ws_srv, worker, serving, local
+
+
+async def local_and_remote(remote_port: int, local_port: int):
+    srv, ws_srv, worker, serving, local = await start_worker(remote_port, local_port)
+
+    remote_results, local_results = await asyncio.gather(
+        asyncio.gather(*[srv.request('1', Command(opcode=Opcodes.stop_sim)) for _ in range(20)]),
+        asyncio.gather(*[local.request(Command(opcode=Opcodes.stop_sim)) for _ in range(20)]))
+    # Nothing that was meant for the local connection reached the server
+    stray = srv.stats()['inbox']
+
+    await local.close()
+    serving.cancel()
+    await asyncio.gather(serving, return_exceptions=True)
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return remote_results, local_results, stray
+
+
+async def local_without_result(remote_port: int, local_port: int):
+    srv, ws_srv, worker, serving, local = await start_worker(remote_port, local_port)
+
+    # Neither of them sends a Result
+    await local.send(Command(opcode=Opcodes.noop))
+    await local.send(Command(opcode=Opcodes.abort_mission))
+    result = await local.request(Command(opcode=Opcodes.stop_sim))
+    await asyncio.sleep(0.05)
+    left = dict(worker.communicator._local_requests)  # pylint: disable=protected-access
+
+    await local.close()
+    serving.cancel()
+    await asyncio.gather(serving, return_exceptions=True)
+    ws_srv.close()
+    await ws_srv.wait_closed()
+    return result, left
+
+
+class TestWssCommunicator:
+
+    def test_local_results_go_back_to_local(self):
+        remote_results, local_results, stray = asyncio.run(local_and_remote(18775, 18776))
+        assert all(r.status == StatusCode.ok for r in remote_results + local_results)
+        assert stray == 0
+
+    def test_local_command_without_result(self):
+        result, left = asyncio.run(local_without_result(18792, 18793))
+        assert result.status == StatusCode.ok
+        assert left == {}